@@ -14,8 +14,8 @@ License:        MIT
 #   Increment Y and reset Z when new macros or features are added
 #   Increment Z when this is a bugfix or a cosmetic change
 # Dropping support for EOL Fedoras is *not* considered a breaking change
-Version:        1.23.0
-Release:        2%{?dist}
+Version:        1.24.0
+Release:        1%{?dist}
 
 # Macro files
 Source:         macros.pyproject
@@ -23,12 +23,18 @@ Source:         macros.aaa-pyproject-srpm
 
 # Implementation files, Python
 Source:         pyproject_buildrequires.py
+Source:         pyproject_buildrequires_server.py
 Source:         pyproject_convert.py
 Source:         pyproject_dependency_overrides.py
+Source:         pyproject_install.py
+Source:         pyproject_metadata_key.py
 Source:         pyproject_patch_metadata.py
+Source:         pyproject_postinstall.py
 Source:         pyproject_preprocess_record.py
+Source:         pyproject_provides_index.py
 Source:         pyproject_requirements_txt.py
 Source:         pyproject_save_files.py
+Source:         pyproject_tox_config.py
 Source:         pyproject_wheel.py
 
 # Implementation files, Lua
@@ -38,11 +44,16 @@ Source:         pyproject_getopt.lua
 Source:         compare_mandata.py
 Source:         test_dependency_overrides.py
 Source:         test_pyproject_buildrequires.py
+Source:         test_pyproject_buildrequires_server.py
 Source:         test_pyproject_getopt.lua
 Source:         test_pyproject_getopt_consistency.py
 Source:         test_pyproject_getopt_parser.py
+Source:         test_pyproject_install.py
+Source:         test_pyproject_provides_index.py
 Source:         test_pyproject_requirements_txt.py
 Source:         test_pyproject_save_files.py
+Source:         test_pyproject_tox_config.py
+Source:         test_pyproject_wheel.py
 
 # Test data
 Source:         pyproject_buildrequires_testcases.yaml
@@ -139,6 +150,7 @@ install -pm 644 macros.pyproject %{buildroot}%{_rpmmacrodir}/
 install -pm 644 macros.aaa-pyproject-srpm %{buildroot}%{_rpmmacrodir}/
 install -pm 644 pyproject_getopt.lua %{buildroot}%{_rpmluadir}/fedora/rpm/
 install -pm 644 pyproject_buildrequires.py %{buildroot}%{_rpmconfigdir}/redhat/
+install -pm 644 pyproject_buildrequires_server.py %{buildroot}%{_rpmconfigdir}/redhat/
 install -pm 644 pyproject_convert.py %{buildroot}%{_rpmconfigdir}/redhat/
 install -pm 644 pyproject_save_files.py  %{buildroot}%{_rpmconfigdir}/redhat/
 install -pm 644 pyproject_preprocess_record.py %{buildroot}%{_rpmconfigdir}/redhat/
@@ -146,6 +158,11 @@ install -pm 644 pyproject_requirements_txt.py %{buildroot}%{_rpmconfigdir}/redha
 install -pm 644 pyproject_wheel.py %{buildroot}%{_rpmconfigdir}/redhat/
 install -pm 644 pyproject_patch_metadata.py %{buildroot}%{_rpmconfigdir}/redhat/
 install -pm 644 pyproject_dependency_overrides.py %{buildroot}%{_rpmconfigdir}/redhat/
+install -pm 644 pyproject_provides_index.py %{buildroot}%{_rpmconfigdir}/redhat/
+install -pm 644 pyproject_tox_config.py %{buildroot}%{_rpmconfigdir}/redhat/
+install -pm 644 pyproject_install.py %{buildroot}%{_rpmconfigdir}/redhat/
+install -pm 644 pyproject_postinstall.py %{buildroot}%{_rpmconfigdir}/redhat/
+install -pm 644 pyproject_metadata_key.py %{buildroot}%{_rpmconfigdir}/redhat/
 
 
 %if %{with tests}
@@ -161,6 +178,7 @@ export HOSTNAME="rpmbuild"  # to speedup tox in network-less mock, see rhbz#1856
 %files
 %{_rpmmacrodir}/macros.pyproject
 %{_rpmconfigdir}/redhat/pyproject_buildrequires.py
+%{_rpmconfigdir}/redhat/pyproject_buildrequires_server.py
 %{_rpmconfigdir}/redhat/pyproject_convert.py
 %{_rpmconfigdir}/redhat/pyproject_save_files.py
 %{_rpmconfigdir}/redhat/pyproject_preprocess_record.py
@@ -168,6 +186,11 @@ export HOSTNAME="rpmbuild"  # to speedup tox in network-less mock, see rhbz#1856
 %{_rpmconfigdir}/redhat/pyproject_wheel.py
 %{_rpmconfigdir}/redhat/pyproject_patch_metadata.py
 %{_rpmconfigdir}/redhat/pyproject_dependency_overrides.py
+%{_rpmconfigdir}/redhat/pyproject_provides_index.py
+%{_rpmconfigdir}/redhat/pyproject_tox_config.py
+%{_rpmconfigdir}/redhat/pyproject_install.py
+%{_rpmconfigdir}/redhat/pyproject_postinstall.py
+%{_rpmconfigdir}/redhat/pyproject_metadata_key.py
 %{_rpmluadir}/fedora/rpm/pyproject_getopt.lua
 
 %doc README.md
@@ -179,6 +202,15 @@ export HOSTNAME="rpmbuild"  # to speedup tox in network-less mock, see rhbz#1856
 
 
 %changelog
+* Sun Oct 18 2026 agent <agent@local> - 1.24.0-1
+- %%pyproject_install: Add an optional built-in wheel installer, enabled with %%_pyproject_installer builtin
+- %%pyproject_wheel: Optionally call the build backend directly, enabled with %%_pyproject_wheel_frontend pep517
+- %%pyproject_buildrequires: Optionally restore the completed stages of previous passes via %%_pyproject_buildrequires_state
+- %%pyproject_buildrequires: Optionally generate more BuildRequires per pass with %%_pyproject_buildrequires_index
+- %%pyproject_buildrequires: Optionally run in a resident server with %%_pyproject_buildrequires_server
+- %%pyproject_buildrequires: Optionally record the durations of its parts with %%_pyproject_buildrequires_timings
+- %%pyproject_save_files: Add the -j/--jobs option and %%pyproject_save_files_batch for multi-wheel specfiles
+
 * Thu Jul 16 2026 Fedora Release Engineering <releng@fedoraproject.org> - 1.23.0-2
 - Rebuilt for https://fedoraproject.org/wiki/Fedora_45_Mass_Rebuild
 
@@ -1,21 +1,16 @@
-import glob
 import io
 import os
 import sys
 import importlib.metadata
 import argparse
-import traceback
 import json
-import subprocess
 import re
-import tempfile
-import email.parser
 import functools
+import collections
+import contextlib
+import itertools
 import pathlib
-import zipfile
-
-from pyproject_requirements_txt import convert_requirements_txt
-from pyproject_wheel import parse_config_settings_args
+import time
 
 
 # Some valid Python version specifiers are not supported.
@@ -43,6 +38,56 @@ def print_err(*args, **kwargs):
     print(*args, **kwargs)
 
 
+class Timings:
+    """
+    Wall and CPU times of the parts of generate_requires(), recorded when --timings is used.
+
+    The records are written as JSON lines, one per measured part, e.g.:
+
+        {"pass": "...", "kind": "hook", "name": "get_requires_for_build_wheel",
+         "start": 0.0132, "wall": 0.2471, "cpu": 0.2204, ...}
+
+    start is relative to the start of the pass, all times are in seconds.
+    The CPU time is the time of this process, it is null for subprocesses.
+    """
+    def __init__(self):
+        self.records = None
+
+    def start(self, enabled):
+        self.records = [] if enabled else None
+        self.pass_start = time.perf_counter()
+        self.pass_cpu_start = time.process_time()
+        self.pass_id = f'{time.time_ns()}-{os.getpid()}'
+
+    def record(self, kind, name, start, wall, cpu=None):
+        if self.records is not None:
+            self.records.append({
+                'kind': kind, 'name': name,
+                'start': start - self.pass_start, 'wall': wall, 'cpu': cpu,
+            })
+
+    @contextlib.contextmanager
+    def measure(self, kind, name=None):
+        if self.records is None:
+            yield
+            return
+        start, cpu_start = time.perf_counter(), time.process_time()
+        try:
+            yield
+        finally:
+            self.record(kind, name, start,
+                        time.perf_counter() - start, time.process_time() - cpu_start)
+
+    def write(self, path, **context):
+        """Append the records to the JSON lines file at path, with the context in each line"""
+        with open(path, 'a') as f:
+            for record in self.records:
+                f.write(json.dumps({'pass': self.pass_id, **context, **record}) + '\n')
+
+
+TIMINGS = Timings()
+
+
 try:
     from packaging.markers import Marker
     from packaging.requirements import Requirement, InvalidRequirement
@@ -58,6 +103,7 @@ from pyproject_convert import convert
 from pyproject_dependency_overrides import (
     parse_override_string, apply_overrides_to_specifiers,
 )
+from pyproject_metadata_key import file_digest, json_digest, metadata_cache_key
 
 
 def guess_reason_for_invalid_requirement(requirement_str):
@@ -80,12 +126,155 @@ def guess_reason_for_invalid_requirement(requirement_str):
     return None
 
 
+class ConversionCache:
+    """
+    Bounded LRU cache of RPM requirements converted from Python requirements.
+
+    The keys are (canonical name, specifier set, extras, python3_pkgversion).
+    The cache can be persisted between the passes, see PassState.
+    """
+    def __init__(self, entries=(), maxsize=4096):
+        self.maxsize = maxsize
+        self.entries = collections.OrderedDict()
+        for key, lines in entries:
+            self._store(self._key(key), lines)
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def _key(key):
+        name, specifier, extras, python3_pkgversion = key
+        return (name, specifier, tuple(extras), python3_pkgversion)
+
+    def _store(self, key, lines):
+        self.entries[key] = lines
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.maxsize:
+            self.entries.popitem(last=False)
+
+    def get(self, key, convert):
+        """Return the cached lines for the key, or convert() and cache them"""
+        key = self._key(key)
+        try:
+            lines = self.entries[key]
+        except KeyError:
+            self.misses += 1
+            lines = convert()
+            self._store(key, lines)
+        else:
+            self.hits += 1
+            self.entries.move_to_end(key)
+        return list(lines)
+
+    def to_json(self):
+        return [[list(key), lines] for key, lines in self.entries.items()]
+
+
+def mentioned_extras(marker):
+    """
+    Return the (canonical) extras the marker compares to with == or !=
+
+    Return None when the marker uses the extra in any other way,
+    or when it cannot be inspected.
+
+    Examples:
+
+        >>> sorted(mentioned_extras(Marker('extra == "Foo_Bar" or "x" != extra')))
+        ['foo-bar', 'x']
+
+        >>> mentioned_extras(Marker('python_version >= "3"'))
+        set()
+
+        >>> mentioned_extras(Marker('extra in "abc"')) is None
+        True
+    """
+    mentioned = set()
+
+    def walk(markers):
+        for item in markers:
+            if isinstance(item, list):
+                walk(item)
+            elif isinstance(item, tuple):
+                lhs, op, rhs = item
+                for variable, value in ((lhs, rhs), (rhs, lhs)):
+                    if type(variable).__name__ == 'Variable' and variable.value == 'extra':
+                        if str(op.value) not in ('==', '!=') or type(value).__name__ != 'Value':
+                            raise ValueError(f'Cannot inspect {marker}')
+                        mentioned.add(canonicalize_name(value.value))
+
+    try:
+        walk(marker._markers)
+    except (AttributeError, TypeError, ValueError):
+        return None
+    return mentioned
+
+
+class MarkerCache:
+    """
+    Results of markers evaluated in the extras environments.
+
+    The environments only differ in the extra, so the result for each (marker, extra)
+    never changes during one run.
+    Moreover, a marker cannot tell apart the extras it does not compare to,
+    so they all share one result, evaluated once.
+    """
+    # the key for the results shared by the extras not mentioned in the marker
+    OTHER_EXTRAS = None
+
+    def __init__(self):
+        # marker string -> (mentioned extras, {extra: result})
+        self.markers = {}
+
+    def _lookup(self, marker):
+        marker_str = str(marker)
+        try:
+            return self.markers[marker_str]
+        except KeyError:
+            entry = self.markers[marker_str] = (mentioned_extras(marker), {})
+            return entry
+
+    def mentioned(self, marker):
+        """Cached mentioned_extras()"""
+        return self._lookup(marker)[0]
+
+    def evaluate_any(self, marker, extras):
+        """Return True if the marker is true in the environment of any of the extras"""
+        mentioned, results = self._lookup(marker)
+        for extra in extras:
+            key = extra if mentioned is None or extra in mentioned else self.OTHER_EXTRAS
+            try:
+                result = results[key]
+            except KeyError:
+                result = results[key] = marker.evaluate(environment={'extra': extra})
+            if result:
+                return True
+        return False
+
+    def evaluate_other_extras(self, marker):
+        """
+        Return the result shared by the extras not mentioned in the marker,
+        None when the marker cannot be inspected.
+        """
+        mentioned, results = self._lookup(marker)
+        if mentioned is None:
+            return None
+        try:
+            return results[self.OTHER_EXTRAS]
+        except KeyError:
+            other = next(extra for extra in (f'other-{i}' for i in itertools.count()) if extra not in mentioned)
+            result = results[self.OTHER_EXTRAS] = marker.evaluate(environment={'extra': other})
+            return result
+
+
 class Requirements:
     """Requirement gatherer. The macro will eventually print out output_lines."""
     def __init__(self, get_installed_version, extras=None,
                  generate_extras=False, python3_pkgversion='3', config_settings=None,
-                 dependency_overrides=None):
+                 dependency_overrides=None, provides_index=None, conversions=None):
         self.get_installed_version = get_installed_version
+        self.provides_index = provides_index
+        self.conversions = ConversionCache() if conversions is None else conversions
+        self.marker_cache = MarkerCache()
         self.output_lines = []
         self.extras = set()
         self.extras_ok_nonexisting = set()
@@ -95,7 +284,14 @@ class Requirements:
                 self.add_extras(*extra.split(','))
 
         self.missing_requirements = False
-        self.ignored_alien_requirements = []
+        # requirements that are not installed, but available in the provides_index
+        self.pending_requirements = False
+        # key -> requirement, the keys are increasing to keep the original order
+        self.ignored_alien_requirements = {}
+        # extra -> keys of ignored alien requirements that might no longer be alien with it,
+        # the ANY_EXTRA keys need to be re-added whenever the extras change
+        self.ignored_aliens_by_extra = {}
+        self._alien_keys = itertools.count()
 
         self.generate_extras = generate_extras
         self.python3_pkgversion = python3_pkgversion
@@ -105,6 +301,11 @@ class Requirements:
 
         self.package_name = None
 
+        # Bookkeeping for the pass state, see PassState
+        self.installed_versions = {}
+        self.checked_requirements = []
+        self.passed_checks = []
+
     def add_extras(self, *extras, error_nonexisting=None):
         if error_nonexisting is None:
             error_nonexisting = REJECT_INVALID_EXTRAS
@@ -158,10 +359,8 @@ class Requirements:
         return [{'extra': ''}]
 
     def evaluate_all_environments(self, requirement):
-        for marker_env in self.marker_envs:
-            if requirement.marker.evaluate(environment=marker_env):
-                return True
-        return False
+        extras = [marker_env['extra'] for marker_env in self.marker_envs]
+        return self.marker_cache.evaluate_any(requirement.marker, extras)
 
     def set_package_name(self, name):
         canonical_name = canonicalize_name(name)
@@ -174,7 +373,10 @@ class Requirements:
 
     def add(self, requirement, *, source=None, extra=None):
         """Output a Python-style requirement string as RPM dep"""
+        with TIMINGS.measure('add', str(requirement)):
+            self._add(requirement, source=source, extra=extra)
 
+    def _add(self, requirement, *, source, extra):
         requirement_str = str(requirement)
         print_err(f'Handling {requirement_str} from {source}')
 
@@ -210,7 +412,7 @@ class Requirements:
         if (requirement.marker is not None and
                 not self.evaluate_all_environments(requirement)):
             print_err(f'Ignoring alien requirement:', requirement_str)
-            self.ignored_alien_requirements.append(requirement)
+            self.ignore_alien_requirement(requirement)
             return
 
         # Handle self-referencing requirements
@@ -219,10 +421,10 @@ class Requirements:
             if requirement.extras:
                 if not (requirement.extras <= self.extras):  # only handle it if needed
                     # let all further requirements know we want those extras
-                    self.add_extras(*requirement.extras)
-                    # re-add all of the alien requirements ignored in the past
-                    # they might no longer be alien now
-                    self.readd_ignored_alien_requirements()
+                    new_extras = self.add_extras(*requirement.extras)
+                    # re-add the alien requirements ignored in the past
+                    # that might no longer be alien now
+                    self.readd_ignored_alien_requirements(extras=new_extras)
             else:
                 print_err(f'Ignoring self-referential requirement without extras:', requirement_str)
             return
@@ -232,6 +434,45 @@ class Requirements:
         requirement = self._apply_dependency_overrides(requirement)
         requirement_str = str(requirement)
 
+        self.verify_installed(requirement)
+
+        extras = sorted(requirement.extras) if self.generate_extras else []
+        key = (name, str(requirement.specifier), extras, self.python3_pkgversion)
+        self.output_lines.extend(
+            self.conversions.get(key, lambda: self.convert(name, requirement.specifier, extras))
+        )
+
+    def convert(self, name, specifier_set, extras):
+        """Convert the requirement to RPM requirements (on name and name[extra] for all extras)"""
+        extra_names = [f'{name}[{extra.lower()}]' for extra in extras]
+        lines = []
+        for name in [name] + extra_names:
+            together = []
+            for specifier in sorted(
+                specifier_set,
+                key=lambda s: (s.operator, s.version),
+            ):
+                if not VERSION_RE.fullmatch(str(specifier.version)):
+                    raise ValueError(
+                        f'Unknown character in version: {specifier.version}. '
+                        + '(This might be a bug in pyproject-rpm-macros.)',
+                    )
+                together.append(convert(python3dist(name, python3_pkgversion=self.python3_pkgversion),
+                                        specifier.operator, specifier.version))
+            if len(together) == 0:
+                dep = python3dist(name, python3_pkgversion=self.python3_pkgversion)
+                lines.append(dep)
+            elif len(together) == 1:
+                lines.append(together[0])
+            else:
+                lines.append(f"({' with '.join(together)})")
+        return lines
+
+    def verify_installed(self, requirement):
+        """Check whether the requirement is installed, note it if it is not"""
+        requirement_str = str(requirement)
+        name = canonicalize_name(requirement.name)
+
         # We need to always accept pre-releases as satisfying the requirement
         # Otherwise e.g. installed cffi version 1.15.0rc2 won't even satisfy the requirement for "cffi"
         # https://bugzilla.redhat.com/show_bug.cgi?id=2014639#c3
@@ -243,57 +484,243 @@ class Requirements:
         except importlib.metadata.PackageNotFoundError:
             print_err(f'Requirement not satisfied: {requirement_str}')
             installed = None
+        self.installed_versions[name] = installed
+        self.checked_requirements.append(requirement_str)
         if installed and installed in requirement.specifier:
             print_err(f'Requirement satisfied: {requirement_str}')
             print_err(f'   (installed: {requirement.name} {installed})')
             if requirement.extras:
                 print_err(f'   (extras are currently not checked)')
+        elif self.is_available(requirement):
+            print_err(f'   (available in the provides index, not ending the pass)')
+            self.pending_requirements = True
         else:
             self.missing_requirements = True
 
-        if self.generate_extras:
-            extra_names = [f'{name}[{extra.lower()}]' for extra in sorted(requirement.extras)]
-        else:
-            extra_names = []
+    def is_installed(self, requirement_str):
+        """Whether the requirement is installed, without generating or logging anything"""
+        requirement = Requirement(requirement_str)
+        requirement.specifier.prereleases = True
+        try:
+            installed = self.get_installed_version(requirement.name)
+        except importlib.metadata.PackageNotFoundError:
+            return False
+        return installed in requirement.specifier
 
-        for name in [name] + extra_names:
-            together = []
-            for specifier in sorted(
-                requirement.specifier,
-                key=lambda s: (s.operator, s.version),
-            ):
-                if not VERSION_RE.fullmatch(str(specifier.version)):
-                    raise ValueError(
-                        f'Unknown character in version: {specifier.version}. '
-                        + '(This might be a bug in pyproject-rpm-macros.)',
-                    )
-                together.append(convert(python3dist(name, python3_pkgversion=self.python3_pkgversion),
-                                        specifier.operator, specifier.version))
-            if len(together) == 0:
-                dep = python3dist(name, python3_pkgversion=self.python3_pkgversion)
-                self.output_lines.append(dep)
-            elif len(together) == 1:
-                self.output_lines.append(together[0])
-            else:
-                self.output_lines.append(f"({' with '.join(together)})")
+    def is_available(self, requirement):
+        """Whether the requirement can be satisfied from the provides_index"""
+        if self.provides_index is None:
+            return False
+        versions = self.provides_index.get(canonicalize_name(requirement.name), [])
+        return any(version in requirement.specifier for version in versions)
+
+    @contextlib.contextmanager
+    def speculate(self, source):
+        """
+        End current pass on errors that might be caused by the pending requirements.
+
+        With pending requirements, we try to evaluate further stages anyway
+        (e.g. import the build backend if an older version is installed).
+        Any errors are reevaluated once the pending requirements are installed in the next pass.
+        """
+        try:
+            yield
+        except Exception as e:
+            if not self.pending_requirements or isinstance(e, EndPass):
+                raise
+            print_err(f'Cannot evaluate {source} until the pending requirements are installed: {e!r}')
+            print_err(f'Exiting dependency generation pass: {source}')
+            raise EndPass(source) from e
 
     def check(self, *, source=None):
         """End current pass if any unsatisfied dependencies were output"""
         if self.missing_requirements:
             print_err(f'Exiting dependency generation pass: {source}')
             raise EndPass(source)
+        self.passed_checks.append(source)
 
     def extend(self, requirement_strs, **kwargs):
         """add() several requirements"""
         for req_str in requirement_strs:
             self.add(req_str, **kwargs)
 
-    def readd_ignored_alien_requirements(self, **kwargs):
-        """add() previously ignored alien requirements again."""
-        requirements, self.ignored_alien_requirements = self.ignored_alien_requirements, []
+    # see ignored_aliens_by_extra
+    ANY_EXTRA = None
+
+    def ignore_alien_requirement(self, requirement):
+        """Remember an alien requirement, so it can be re-added when the extras change"""
+        key = next(self._alien_keys)
+        self.ignored_alien_requirements[key] = requirement
+        mentioned = self.marker_cache.mentioned(requirement.marker)
+        if (mentioned is None or '' in mentioned or
+                self.marker_cache.evaluate_other_extras(requirement.marker) is not False):
+            # the marker cannot be inspected,
+            # or it might evaluate differently once the empty extra is no longer evaluated,
+            # or it is true with the extras it does not mention (e.g. extra != "foo")
+            mentioned = {self.ANY_EXTRA}
+        # markers not mentioning any extras will stay alien forever
+        for extra in mentioned:
+            self.ignored_aliens_by_extra.setdefault(extra, []).append(key)
+
+    def readd_ignored_alien_requirements(self, *, extras=None, **kwargs):
+        """
+        add() previously ignored alien requirements again.
+
+        When extras are given, only re-add the requirements that might no longer be alien
+        with those (newly added) extras.
+        """
+        if extras is None:
+            keys = list(self.ignored_alien_requirements)
+            self.ignored_aliens_by_extra = {}
+        else:
+            keys = set()
+            for extra in (self.ANY_EXTRA, *extras):
+                keys.update(self.ignored_aliens_by_extra.pop(extra, ()))
+            # a requirement mentioning several extras might have been re-added already
+            keys = sorted(k for k in keys if k in self.ignored_alien_requirements)
+        requirements = [self.ignored_alien_requirements.pop(k) for k in keys]
         kwargs.setdefault('source', 'Previously ignored alien requirements')
         self.extend(requirements, **kwargs)
 
+    def snapshot(self):
+        """Return the gathered requirements as JSON-serializable data"""
+        return {
+            'output_lines': list(self.output_lines),
+            'extras': sorted(self.extras),
+            'extras_ok_nonexisting': sorted(self.extras_ok_nonexisting),
+            'ignored_alien_requirements': [str(r) for r in self.ignored_alien_requirements.values()],
+            'metadata_extras': list(self.metadata_extras),
+            'package_name': self.package_name,
+            'checked_requirements': list(self.checked_requirements),
+        }
+
+    def restore(self, snapshot):
+        """Replace the gathered requirements with a previously taken snapshot()"""
+        self.output_lines = list(snapshot['output_lines'])
+        self.extras = set(snapshot['extras'])
+        self.extras_ok_nonexisting = set(snapshot['extras_ok_nonexisting'])
+        self.ignored_alien_requirements = {}
+        self.ignored_aliens_by_extra = {}
+        for requirement_str in snapshot['ignored_alien_requirements']:
+            self.ignore_alien_requirement(Requirement(requirement_str))
+        self.metadata_extras = list(snapshot['metadata_extras'])
+        self.package_name = snapshot['package_name']
+        self.checked_requirements = list(snapshot['checked_requirements'])
+
+
+@functools.cache
+def converter_digest():
+    """When the conversion changes, the persisted ConversionCache is discarded"""
+    return json_digest([file_digest(__file__), file_digest(sys.modules[convert.__module__].__file__)])
+
+
+class PassState:
+    """
+    Results of the stages completed in previous passes of %pyproject_buildrequires.
+
+    After the missing requirements of a pass get installed, RPM runs the script again.
+    Stages that have already completed in a previous pass are not evaluated again,
+    but their results are restored from the state file, as long as:
+
+     - the project files and the options are the same (inputs),
+     - all previous stages produced the same results (before),
+     - the requirements checked by all previous stages have the same installed versions (depends).
+
+    The requirements output by the restored stages are still verified to be installed.
+    """
+    def __init__(self, path, inputs):
+        self.path = path
+        self.key = os.getcwd()
+        # normalize tuples etc. so we can compare it with loaded data
+        self.inputs = json.loads(json.dumps(inputs, sort_keys=True))
+        try:
+            self.data = json.loads(self.path.read_text())
+        except (FileNotFoundError, ValueError):
+            self.data = {}
+        # %pyproject_buildrequires -d ... might be used several times
+        passes = self.data.setdefault('passes', {})
+        state = passes.get(self.key, {})
+        if state.get('inputs') != self.inputs:
+            state = {'inputs': self.inputs, 'stages': {}}
+        self.stages = state['stages']
+        passes[self.key] = state
+
+        # The conversions don't depend on the project, only on our implementation
+        conversions = self.data.get('conversions', {})
+        if conversions.get('converter') != converter_digest():
+            conversions = {}
+        self.conversions = ConversionCache(conversions.get('entries', ()))
+
+        # The outputs of tox, see ToxRun
+        self.tox_outputs = self.data.setdefault('tox_outputs', {})
+
+        # The metadata prepared by the build backend, see prepare_metadata()
+        self.metadata = self.data.setdefault('metadata', {}).setdefault(self.key, {})
+        # %pyproject_buildrequires removes the *.dist-info directories in the source tree after each pass,
+        # the prepared metadata is kept next to the state file for %pyproject_wheel
+        self.metadata_directory = str(self.path.absolute().with_name(f'{self.path.stem}-metadata')
+                                      / json_digest(self.key)[:16])
+
+    def _depends_changed(self, depends, get_installed_version):
+        for name, version in depends.items():
+            try:
+                installed = get_installed_version(name)
+            except importlib.metadata.PackageNotFoundError:
+                installed = None
+            if installed != version:
+                return True
+        return False
+
+    def restore(self, name, requirements):
+        """
+        Restore the results of the named stage from a previous pass.
+        Return True if restored, False if the stage needs to be evaluated.
+        """
+        record = self.stages.get(name)
+        if record is None:
+            return False
+        if record['before'] != json_digest(requirements.snapshot()):
+            return False
+        if self._depends_changed(record['depends'], requirements.get_installed_version):
+            return False
+
+        print_err(f'Restoring {name} from a previous pass')
+        checked_before = len(requirements.checked_requirements)
+        requirements.restore(record['after'])
+        requirements.installed_versions.update(record['depends'])
+        checked = requirements.checked_requirements[checked_before:]
+        del requirements.checked_requirements[checked_before:]
+        for requirement_str in checked:
+            requirements.verify_installed(Requirement(requirement_str))
+        for source in record['checks']:
+            requirements.check(source=source)
+        return True
+
+    def run(self, name, function, requirements):
+        """Evaluate the named stage unless it can be restored, record the results"""
+        if self.restore(name, requirements):
+            return
+        before = json_digest(requirements.snapshot())
+        depends = dict(requirements.installed_versions)
+        checks_before = len(requirements.passed_checks)
+        self.stages.pop(name, None)
+        function()
+        self.stages[name] = {
+            'before': before,
+            'depends': depends,
+            'after': requirements.snapshot(),
+            'checks': requirements.passed_checks[checks_before:],
+        }
+
+    def save(self):
+        self.data['conversions'] = {
+            'converter': converter_digest(),
+            'entries': self.conversions.to_json(),
+        }
+        tmp_path = self.path.with_name(self.path.name + '.tmp')
+        tmp_path.write_text(json.dumps(self.data))
+        os.replace(tmp_path, self.path)
+
 
 def toml_load(opened_binary_file):
     try:
@@ -316,12 +743,12 @@ def load_pyproject():
     except FileNotFoundError:
         pyproject_data = {}
     else:
-        with f:
+        with f, TIMINGS.measure('load', 'pyproject.toml'):
             pyproject_data = toml_load(f)
     return pyproject_data
 
 
-def get_backend(requirements):
+def generate_build_system_requirements(requirements):
     pyproject_data = load_pyproject()
 
     buildsystem_data = pyproject_data.get('build-system', {})
@@ -330,8 +757,7 @@ def get_backend(requirements):
         source='build-system.requires',
     )
 
-    backend_name = buildsystem_data.get('build-backend')
-    if not backend_name:
+    if not buildsystem_data.get('build-backend'):
         # https://www.python.org/dev/peps/pep-0517/:
         # If the pyproject.toml file is absent, or the build-backend key is
         # missing, the source tree is not using this specification, and tools
@@ -341,7 +767,6 @@ def get_backend(requirements):
         # and end with an error.
         if not os.path.exists('setup.py'):
             raise FileNotFoundError('File "setup.py" not found for legacy project.')
-        backend_name = 'setuptools.build_meta:__legacy__'
 
         # Note: For projects without pyproject.toml, this was already echoed
         # by the %pyproject_buildrequires macro, but this also handles cases
@@ -351,6 +776,11 @@ def get_backend(requirements):
 
     requirements.check(source='build backend')
 
+
+def load_backend():
+    buildsystem_data = load_pyproject().get('build-system', {})
+    backend_name = buildsystem_data.get('build-backend') or 'setuptools.build_meta:__legacy__'
+
     backend_path = buildsystem_data.get('backend-path')
     if backend_path:
         # PEP 517 example shows the path as a list, but some projects don't follow that
@@ -359,7 +789,8 @@ def get_backend(requirements):
         sys.path = backend_path + sys.path
 
     module_name, _, object_name = backend_name.partition(":")
-    backend_module = importlib.import_module(module_name)
+    with TIMINGS.measure('import', module_name):
+        backend_module = importlib.import_module(module_name)
 
     if object_name:
         return getattr(backend_module, object_name)
@@ -367,15 +798,22 @@ def get_backend(requirements):
     return backend_module
 
 
+def get_backend(requirements):
+    generate_build_system_requirements(requirements)
+    return load_backend()
+
+
 def generate_build_requirements(backend, requirements):
     get_requires = getattr(backend, 'get_requires_for_build_wheel', None)
     if get_requires:
-        new_reqs = get_requires(requirements.config_settings)
+        with TIMINGS.measure('hook', 'get_requires_for_build_wheel'):
+            new_reqs = get_requires(requirements.config_settings)
         requirements.extend(new_reqs, source='get_requires_for_build_wheel')
         requirements.check(source='get_requires_for_build_wheel')
 
 
 def parse_metadata_file(metadata_file):
+    import email.parser
     return email.parser.Parser().parse(metadata_file, headersonly=True)
 
 
@@ -400,10 +838,25 @@ def extract_data_from_metadata_file(metadata_file):
     return package_name, requires, extras_names
 
 
-def generate_run_requirements_hook(backend, requirements):
+def prepare_metadata(backend, requirements, metadata_cache=None, metadata_directory='.'):
+    """
+    Return the contents of the METADATA file prepared by the build backend in metadata_directory.
+
+    backend is a callable returning the backend, so it is only imported when needed.
+    When a metadata_cache (a dict) is given, the METADATA from a previous pass is reused
+    (and the hook is not called) as long as the metadata_cache_key() is the same.
+    The absolute path of the prepared .dist-info directory is saved in the metadata_cache,
+    so metadata_directory should be a directory that is kept between the passes.
+    """
+    if metadata_cache is not None:
+        key = metadata_cache_key(load_pyproject().get('build-system', {}),
+                                 requirements.config_settings, requirements.get_installed_version)
+        if metadata_cache.get('key') == key:
+            print_err('Reusing the metadata prepared by the build backend in a previous pass')
+            return metadata_cache['metadata']
     hook_name = 'prepare_metadata_for_build_wheel'
-    prepare_metadata = getattr(backend, hook_name, None)
-    if not prepare_metadata:
+    prepare_metadata_hook = getattr(backend(), hook_name, None)
+    if not prepare_metadata_hook:
         raise ValueError(
             'The build backend cannot provide build metadata '
             '(incl. runtime requirements) before build. '
@@ -411,17 +864,35 @@ def generate_run_requirements_hook(backend, requirements):
             'table, you can use the -p flag to read them. '
             'Alternatively, use the -R flag not to generate runtime dependencies.'
         )
-    dir_basename = prepare_metadata('.', requirements.config_settings)
-    with open(dir_basename + '/METADATA') as metadata_file:
-        name, requires, metadata_extras = extract_data_from_metadata_file(metadata_file)
-        requirements.set_package_name(name)
-        requirements.metadata_extras.extend(metadata_extras)
-        for key, req in requires.items():
-            requirements.extend(req,
-                                source=f'hook generated metadata: {key} ({requirements.package_name})')
+    if metadata_directory != '.':
+        import shutil
+        # setuptools assumes no pre-existing dist-info
+        shutil.rmtree(metadata_directory, ignore_errors=True)
+        os.makedirs(metadata_directory)
+    with TIMINGS.measure('hook', hook_name):
+        dir_basename = prepare_metadata_hook(metadata_directory, requirements.config_settings)
+    dist_info = os.path.join(metadata_directory, dir_basename)
+    with open(dist_info + '/METADATA') as metadata_file:
+        metadata = metadata_file.read()
+    if metadata_cache is not None:
+        metadata_cache.clear()
+        metadata_cache.update(key=key, dist_info=os.path.abspath(dist_info), metadata=metadata)
+    return metadata
+
+
+def generate_run_requirements_hook(backend, requirements, metadata_cache=None, metadata_directory='.'):
+    """backend is a callable returning the backend, see prepare_metadata()"""
+    metadata = prepare_metadata(backend, requirements, metadata_cache, metadata_directory)
+    name, requires, metadata_extras = extract_data_from_metadata_file(io.StringIO(metadata))
+    requirements.set_package_name(name)
+    requirements.metadata_extras.extend(metadata_extras)
+    for key, req in requires.items():
+        requirements.extend(req,
+                            source=f'hook generated metadata: {key} ({requirements.package_name})')
 
 
 def find_built_wheel(wheeldir):
+    import glob
     wheels = glob.glob(os.path.join(wheeldir, '*.whl'))
     if not wheels:
         return None
@@ -441,11 +912,12 @@ def generate_run_requirements_wheel(backend, requirements, wheeldir):
         requirements.add('pip >= 19', source='%pyproject_buildrequires -w')
         requirements.check(source='%pyproject_buildrequires -w')
         import pyproject_wheel
-        returncode = pyproject_wheel.build_wheel(
-            wheeldir=wheeldir,
-            stdout=sys.stderr,
-            config_settings=requirements.config_settings,
-        )
+        with TIMINGS.measure('subprocess', 'pip wheel'):
+            returncode = pyproject_wheel.build_wheel(
+                wheeldir=wheeldir,
+                stdout=sys.stderr,
+                config_settings=requirements.config_settings,
+            )
         if returncode != 0:
             raise RuntimeError('Failed to build the wheel for %pyproject_buildrequires -w.')
         wheel = find_built_wheel(wheeldir)
@@ -453,6 +925,7 @@ def generate_run_requirements_wheel(backend, requirements, wheeldir):
         raise RuntimeError('Cannot locate the built wheel for %pyproject_buildrequires -w.')
 
     print_err(f'Reading metadata from {wheel}')
+    import zipfile
     with zipfile.ZipFile(wheel) as wheelfile:
         for name in wheelfile.namelist():
             if name.count('/') == 1 and name.endswith('.dist-info/METADATA'):
@@ -493,84 +966,223 @@ def generate_run_requirements_pyproject(requirements):
         requirements.metadata_extras.append(canonicalize_name(extra))
 
 
-def generate_run_requirements(backend, requirements, *, build_wheel, pyproject_dependencies, wheeldir):
+def generate_run_requirements(backend, requirements, *, build_wheel, pyproject_dependencies, wheeldir,
+                              metadata_cache=None, metadata_directory='.'):
+    """backend is a callable returning the backend, so it is only imported when needed"""
     if pyproject_dependencies:
         generate_run_requirements_pyproject(requirements)
     elif build_wheel:
-        generate_run_requirements_wheel(backend, requirements, wheeldir)
+        generate_run_requirements_wheel(backend(), requirements, wheeldir)
     else:
-        generate_run_requirements_hook(backend, requirements)
+        generate_run_requirements_hook(backend, requirements, metadata_cache, metadata_directory)
 
 
-def generate_tox_requirements(toxenv, requirements):
-    toxenv = ','.join(toxenv)
-    requirements.add('tox-current-env >= 0.0.16', source='tox itself')
-    requirements.check(source='tox itself')
-    with tempfile.NamedTemporaryFile('r') as deps, \
-        tempfile.NamedTemporaryFile('r') as extras, \
-            tempfile.NamedTemporaryFile('r') as provision:
-        r = subprocess.run(
-            [sys.executable, '-m', 'tox',
-             '--print-deps-to', deps.name,
-             '--print-extras-to', extras.name,
-             '--no-provision', provision.name,
-             '--assert-config',
-             '-q', '-r', '-e', toxenv],
-            check=False,
+class ToxRun:
+    """
+    A tox process printing the requested information to temporary files
+    (via the --print-*-to options of tox-current-env).
+
+    The process is started right away and runs until wait() is called.
+
+    When a cache (a dict) is given, the outputs of successful runs are stored in it
+    under the cache_key (see tox_cache_key()), the output options and the args.
+    When the outputs are already there, tox is not run at all.
+    """
+    def __init__(self, output_options, args, *, cache=None, cache_key=None):
+        import subprocess
+        import tempfile
+        self.name = ' '.join(('tox', *output_options, *args))
+        self.cache = cache
+        self.cache_digest = self.digest(cache_key, output_options, args)
+        self.files = {}
+        self.process = None
+        if cache is not None and self.cache_digest in cache:
+            return
+        self.files = {option: tempfile.NamedTemporaryFile('r') for option in output_options}
+        command = [sys.executable, '-m', 'tox']
+        for option, file in self.files.items():
+            command.extend((option, file.name))
+        command.extend(args)
+        self.start = time.perf_counter()
+        self.process = subprocess.Popen(
+            command,
             encoding='utf-8',
             stdout=subprocess.PIPE,
             stderr=subprocess.STDOUT,
         )
-        if r.stdout:
-            print_err(r.stdout, end='')
 
-        provision_content = provision.read()
-        if provision_content and r.returncode != 0:
-            provision_requires = json.loads(provision_content)
-            if provision_requires.get('minversion') is not None:
-                requirements.add(f'tox >= {provision_requires["minversion"]}',
-                                 source='tox provision (minversion)')
-            if 'requires' in provision_requires:
-                requirements.extend(provision_requires["requires"],
-                                    source='tox provision (requires)')
-            requirements.check(source='tox provision')  # this terminates the script
-            raise RuntimeError(
-                'Dependencies requested by tox provisioning appear installed, '
-                'but tox disagreed.')
-        else:
-            r.check_returncode()
+    @staticmethod
+    def digest(cache_key, output_options, args):
+        return json_digest([cache_key, output_options, args])
+
+    def wait(self):
+        """Return the CompletedProcess and a dict with the contents of the output files"""
+        import subprocess
+        if self.process is None:
+            print_err(f'Reusing the output of {self.name} from a previous pass')
+            cached = self.cache[self.cache_digest]
+            return subprocess.CompletedProcess(self.name, 0, cached['stdout']), cached['outputs']
+        # the time spent waiting for tox to finish
+        with TIMINGS.measure('wait', self.name):
+            stdout, _ = self.process.communicate()
+        TIMINGS.record('subprocess', self.name, self.start, time.perf_counter() - self.start)
+        completed = subprocess.CompletedProcess(self.process.args, self.process.returncode, stdout)
+        outputs = {option: file.read() for option, file in self.files.items()}
+        self.close()
+        if self.cache is not None and completed.returncode == 0:
+            self.cache[self.cache_digest] = {'stdout': stdout, 'outputs': outputs}
+        return completed, outputs
+
+    def close(self):
+        for file in self.files.values():
+            file.close()
+
+
+class ToxConfigRun:
+    """
+    The outputs ToxRun would have, read from the tox configuration by pyproject_tox_config.
 
-        tox_extras = {e for e in extras.read().splitlines() if e}
-        if not (tox_extras <= requirements.extras):
-            requirements.add_extras(*tox_extras, error_nonexisting=False)
-            requirements.readd_ignored_alien_requirements(source=f'tox added extras: {toxenv}')
+    Raises pyproject_tox_config.UnsupportedConfig when the configuration needs tox itself.
+    """
+    def __init__(self, output_options, toxenv, requirements):
+        import pyproject_tox_config
+        self.name = ' '.join(('tox', *output_options, '-e', ','.join(toxenv)))
+        with TIMINGS.measure('load', 'tox configuration'):
+            self.returncode, self.outputs = pyproject_tox_config.print_outputs(
+                toxenv, output_options, is_installed=requirements.is_installed)
 
-        deplines = deps.read().splitlines()
-        packages = convert_requirements_txt(deplines)
-        requirements.extend(packages,
-                            source=f'tox --print-deps-only: {toxenv}')
+    def wait(self):
+        import subprocess
+        print_err(f'Read the output of {self.name} from the tox configuration')
+        return subprocess.CompletedProcess(self.name, self.returncode, ''), self.outputs
 
 
-def tox_dependency_groups(toxenv):
-    # We call this command separately instead of folding it into the previous one
-    # becasue --print-dependency-groups-to only works with tox 4.22+ and tox-current-env 0.0.14+.
-    # We handle failure gracefully: upstreams using dependency_groups should require tox >= 4.22.
+TOX_PRINT_DEPS = ('--print-deps-to', '--print-extras-to', '--no-provision')
+TOX_PRINT_DEPENDENCY_GROUPS = ('--print-dependency-groups-to',)
+
+
+def tox_print_deps_args(toxenv):
+    return ('--assert-config', '-q', '-r', '-e', ','.join(toxenv))
+
+
+def tox_cache_key(toxenv, requirements):
+    """The output of tox only changes with its configuration, the environments and the versions"""
+    versions = {}
+    for name in ('tox', 'tox-current-env'):
+        try:
+            versions[name] = requirements.get_installed_version(name)
+        except importlib.metadata.PackageNotFoundError:
+            versions[name] = None
+    config = {f: file_digest(f) for f in ('tox.ini', 'tox.toml', 'pyproject.toml', 'setup.cfg')}
+    return [os.getcwd(), config, list(toxenv), versions, sys.version]
+
+
+def tox_prints_dependency_groups(requirements):
+    """Can the dependency groups be printed by the same tox process as the deps?"""
+    # --print-dependency-groups-to only works with tox 4.22+ and tox-current-env 0.0.14+
+    return requirements.is_installed('tox >= 4.22') and requirements.is_installed('tox-current-env >= 0.0.14')
+
+
+def tox_print_deps(toxenv, requirements, cache=None):
+    """
+    Start tox printing the deps (and the dependency groups when supported) of toxenv
+
+    With tox 4.22+, the common configurations are read without running tox.
+    """
+    output_options = TOX_PRINT_DEPS
+    if tox_prints_dependency_groups(requirements):
+        output_options += TOX_PRINT_DEPENDENCY_GROUPS
+        from pyproject_tox_config import UnsupportedConfig
+        try:
+            return ToxConfigRun(output_options, toxenv, requirements)
+        except UnsupportedConfig as e:
+            print_err(f'Running tox, the configuration cannot be read without it: {e}')
+    return ToxRun(output_options, tox_print_deps_args(toxenv),
+                  cache=cache, cache_key=tox_cache_key(toxenv, requirements))
+
+
+def generate_tox_requirements(toxenv, requirements, cache=None):
+    """
+    Return the outputs of tox, to be passed to tox_dependency_groups().
+    """
+    requirements.add('tox-current-env >= 0.0.16', source='tox itself')
+    requirements.check(source='tox itself')
+    r, outputs = tox_print_deps(toxenv, requirements, cache).wait()
+    if (r.returncode != 0 and TOX_PRINT_DEPENDENCY_GROUPS[0] in outputs and
+            not outputs['--no-provision']):
+        # The failure is reported (if it persists) by the separate invocation
+        print_err('tox failed to print the dependency groups together with the deps, '
+                  'printing them separately')
+        r, outputs = ToxRun(TOX_PRINT_DEPS, tox_print_deps_args(toxenv)).wait()
     toxenv = ','.join(toxenv)
-    with tempfile.NamedTemporaryFile('r') as groups:
-        r = subprocess.run(
-            [sys.executable, '-m', 'tox',
-             '--print-dependency-groups-to', groups.name,
-             '-q', '-e', toxenv],
-            check=False,
-            encoding='utf-8',
-            stdout=subprocess.PIPE,
-            stderr=subprocess.STDOUT,
-        )
-        if r.returncode == 0:
-            if r.stdout:
-                print_err(r.stdout, end='')
-            if output := groups.read().strip():
-                return output.splitlines()
+    if r.stdout:
+        print_err(r.stdout, end='')
+
+    provision_content = outputs['--no-provision']
+    if provision_content and r.returncode != 0:
+        provision_requires = json.loads(provision_content)
+        if provision_requires.get('minversion') is not None:
+            requirements.add(f'tox >= {provision_requires["minversion"]}',
+                             source='tox provision (minversion)')
+        if 'requires' in provision_requires:
+            requirements.extend(provision_requires["requires"],
+                                source='tox provision (requires)')
+        requirements.check(source='tox provision')  # this terminates the script
+        raise RuntimeError(
+            'Dependencies requested by tox provisioning appear installed, '
+            'but tox disagreed.')
+    else:
+        r.check_returncode()
+
+    tox_extras = {e for e in outputs['--print-extras-to'].splitlines() if e}
+    if not (tox_extras <= requirements.extras):
+        new_extras = requirements.add_extras(*tox_extras, error_nonexisting=False)
+        requirements.readd_ignored_alien_requirements(
+            extras=new_extras, source=f'tox added extras: {toxenv}')
+
+    from pyproject_requirements_txt import convert_requirements_txt
+    deplines = outputs['--print-deps-to'].splitlines()
+    packages = convert_requirements_txt(deplines)
+    requirements.extend(packages,
+                        source=f'tox --print-deps-only: {toxenv}')
+    return outputs
+
+
+def tox_dependency_groups(toxenv, requirements, tox_outputs=None, cache=None):
+    """
+    tox_outputs are the outputs of generate_tox_requirements(),
+    the dependency groups are already there with new enough tox.
+    """
+    option = TOX_PRINT_DEPENDENCY_GROUPS[0]
+    cache_key = tox_cache_key(toxenv, requirements)
+    if tox_outputs is None and cache is not None:
+        # the tox stage was restored from a previous pass, but its outputs might be cached
+        cached = cache.get(ToxRun.digest(cache_key, TOX_PRINT_DEPS + TOX_PRINT_DEPENDENCY_GROUPS,
+                                         tox_print_deps_args(toxenv)))
+        tox_outputs = cached and cached['outputs']
+    if not tox_outputs and tox_prints_dependency_groups(requirements):
+        from pyproject_tox_config import UnsupportedConfig
+        try:
+            tox_outputs = ToxConfigRun(TOX_PRINT_DEPS + TOX_PRINT_DEPENDENCY_GROUPS, toxenv, requirements).outputs
+        except UnsupportedConfig:
+            pass
+    if tox_outputs and option in tox_outputs:
+        output = tox_outputs[option].strip()
+        return output.splitlines() if output else []
+
+    # We call this command separately when tox cannot print the dependency groups with the deps,
+    # --print-dependency-groups-to only works with tox 4.22+ and tox-current-env 0.0.14+.
+    # We handle failure gracefully: upstreams using dependency_groups should require tox >= 4.22.
+    r, outputs = ToxRun(
+        TOX_PRINT_DEPENDENCY_GROUPS,
+        ('-q', '-e', ','.join(toxenv)),
+        cache=cache, cache_key=cache_key,
+    ).wait()
+    if r.returncode == 0:
+        if r.stdout:
+            print_err(r.stdout, end='')
+        if output := outputs[option].strip():
+            return output.splitlines()
     return []
 
 
@@ -659,49 +1271,154 @@ def python3dist(name, op=None, version=None, python3_pkgversion="3"):
         return f'{prefix}({name}) {op} {version}'
 
 
+def generate_requirements_files_requirements(requirement_files, requirements):
+    from pyproject_requirements_txt import convert_requirements_txt
+    for req_file in requirement_files:
+        requirements.extend(
+            convert_requirements_txt(req_file.read_text().splitlines(), req_file),
+            source=f'requirements file {req_file}'
+        )
+    requirements.check(source='all requirements files')
+
+
+Stage = collections.namedtuple('Stage', ('name', 'function', 'after'), defaults=((),))
+Stage.__doc__ = """A stage of generate_requires(), runs after the named stages completed"""
+
+
+def run_stages(stages, requirements, state=None):
+    """
+    Run the stages in the given order.
+
+    When a stage ends the pass, the following stages that don't need it still run,
+    so all their missing requirements are generated in this pass together.
+    The stages that need it are postponed to the next pass.
+
+    The stages run one after another, not concurrently:
+    they update the shared requirements in order (so the output is deterministic)
+    and apart from the build backend hooks and tox, they only read files.
+    tox is not started ahead of time, as an earlier stage ending the pass would throw its work away.
+    """
+    names ={stage.name for stage in stages}
+    completed = set()
+    end_pass = None
+    for stage in stages:
+        waiting_for = [name for name in stage.after if name in names and name not in completed]
+        if waiting_for:
+            print_err(f'Postponing {stage.name} until {", ".join(waiting_for)} completes')
+            continue
+        try:
+            with requirements.speculate(stage.name), TIMINGS.measure('stage', stage.name):
+                if state:
+                    state.run(stage.name, stage.function, requirements)
+                else:
+                    stage.function()
+        except EndPass as e:
+            end_pass = end_pass or e
+        else:
+            completed.add(stage.name)
+    if end_pass:
+        raise end_pass
+
+
+def pass_state_inputs(requirement_files, **options):
+    """The inputs of all the stages, the pass state is discarded when they change"""
+    filenames = ['pyproject.toml', 'setup.py', 'setup.cfg', 'tox.ini', 'tox.toml']
+    filenames.extend(str(f) for f in requirement_files)
+    return {
+        'files': {filename: file_digest(filename) for filename in filenames},
+        'options': options,
+        'python': sys.version,
+        'reject_invalid_extras': REJECT_INVALID_EXTRAS,
+    }
+
+
 def generate_requires(
     *, include_runtime=False, build_wheel=False, wheeldir=None, toxenv=None, extras=None, dependency_groups=None,
     get_installed_version=importlib.metadata.version,  # for dep injection
     generate_extras=False, python3_pkgversion="3", requirement_files=None, use_build_system=True,
     pyproject_dependencies=False,
-    output, config_settings=None, dependency_overrides=None,
+    output, config_settings=None, dependency_overrides=None, state_file=None, provides_index=None,
+    timings_file=None,
 ):
     """Generate the BuildRequires for the project in the current directory
 
     The generated BuildRequires are written to the provided output.
+    When state_file is provided, the stages completed in previous passes are restored from it.
+    When provides_index is provided, requirements available in it don't end the pass,
+    so more requirements can be generated in one pass.
+    When timings_file is provided, the durations of the parts are appended to it, see Timings.
 
     This is the main Python entry point.
     """
+    TIMINGS.start(enabled=timings_file is not None)
+    dependency_groups = dependency_groups or []
+    requirement_files = requirement_files or []
+    state = None
+    if state_file:
+        state = PassState(state_file, pass_state_inputs(
+            requirement_files,
+            include_runtime=include_runtime, build_wheel=build_wheel, toxenv=toxenv,
+            extras=extras, dependency_groups=dependency_groups, generate_extras=generate_extras,
+            python3_pkgversion=python3_pkgversion, use_build_system=use_build_system,
+            pyproject_dependencies=pyproject_dependencies, config_settings=config_settings,
+            dependency_overrides=dependency_overrides,
+            provides_index=provides_index and json_digest(provides_index),
+        ))
+
     requirements = Requirements(
         get_installed_version, extras=extras or [],
         generate_extras=generate_extras,
         python3_pkgversion=python3_pkgversion,
         config_settings=config_settings,
         dependency_overrides=dependency_overrides or [],
+        provides_index=provides_index,
+        conversions=state and state.conversions,
     )
 
-    dependency_groups = dependency_groups or []
-    try:
-        if (include_runtime or toxenv or pyproject_dependencies) and not use_build_system:
-            raise ValueError('-N option cannot be used in combination with -r, -e, -t, -x, -p options')
-        if requirement_files:
-            for req_file in requirement_files:
-                requirements.extend(
-                    convert_requirements_txt(req_file.read_text().splitlines(), req_file),
-                    source=f'requirements file {req_file}'
-                )
-            requirements.check(source='all requirements files')
-        if use_build_system:
-            backend = get_backend(requirements)
-            generate_build_requirements(backend, requirements)
-        if include_runtime or toxenv:
-            generate_run_requirements(backend, requirements, build_wheel=build_wheel,
-                pyproject_dependencies=pyproject_dependencies, wheeldir=wheeldir)
+    # The backend is only imported when a stage needs it
+    backend = functools.cache(load_backend)
+
+    tox_cache = state and state.tox_outputs
+    tox_outputs = {}
+
+    stages = []
+    if requirement_files:
+        stages.append(Stage('requirements files', lambda: generate_requirements_files_requirements(
+            requirement_files, requirements)))
+    if use_build_system:
+        stages.append(Stage('build backend', lambda: generate_build_system_requirements(requirements)))
+        stages.append(Stage('get_requires_for_build_wheel', lambda: generate_build_requirements(
+            backend(), requirements), after=('build backend',)))
+    if include_runtime or toxenv:
+        stages.append(Stage('run requirements', lambda: generate_run_requirements(
+            backend, requirements, build_wheel=build_wheel,
+            pyproject_dependencies=pyproject_dependencies, wheeldir=wheeldir,
+            metadata_cache=state and state.metadata,
+            metadata_directory=state.metadata_directory if state else '.'),
+            # [project] dependencies are read without the backend
+            after=() if pyproject_dependencies else ('get_requires_for_build_wheel',)))
+    if toxenv:
+        # tox is only started once the previous stages cannot end the pass anymore,
+        # otherwise its work would be thrown away
+        stages.append(Stage('tox', lambda: tox_outputs.update(generate_tox_requirements(
+            toxenv, requirements, cache=tox_cache)),
+            after=('run requirements',)))
+
+    def generate_all_dependency_groups():
         if toxenv:
-            generate_tox_requirements(toxenv, requirements)
-            dependency_groups.extend(tox_dependency_groups(toxenv))
+            dependency_groups.extend(tox_dependency_groups(
+                toxenv, requirements, tox_outputs or None, tox_cache))
         if dependency_groups:
             generate_dependency_groups(dependency_groups, requirements)
+    if toxenv or dependency_groups:
+        # self-referential requirements need the package name from the runtime metadata
+        stages.append(Stage('dependency groups', generate_all_dependency_groups,
+                            after=('run requirements', 'tox')))
+
+    try:
+        if (include_runtime or toxenv or pyproject_dependencies) and not use_build_system:
+            raise ValueError('-N option cannot be used in combination with -r, -e, -t, -x, -p options')
+        run_stages(stages, requirements, state)
         if include_runtime:
             for extra in requirements.extras:
                 if extra not in requirements.metadata_extras:
@@ -718,7 +1435,21 @@ def generate_requires(
     except EndPass:
         return
     finally:
-        output.write_text(os.linesep.join(requirements.output_lines) + os.linesep)
+        with TIMINGS.measure('write', 'output'):
+            output.write_text(os.linesep.join(requirements.output_lines) + os.linesep)
+        if state:
+            with TIMINGS.measure('write', 'state'):
+                state.save()
+        if timings_file:
+            TIMINGS.record('pass', None, TIMINGS.pass_start, time.perf_counter() - TIMINGS.pass_start,
+                           time.process_time() - TIMINGS.pass_cpu_start)
+            TIMINGS.write(
+                timings_file,
+                cwd=os.getcwd(),
+                package=requirements.package_name,
+                conversions={'hits': requirements.conversions.hits,
+                             'misses': requirements.conversions.misses},
+            )
 
 
 def argparser():
@@ -804,6 +1535,18 @@ def argparser():
         '--dep-overrides-file', type=pathlib.Path, default=None,
         help=argparse.SUPPRESS,
     )
+    parser.add_argument(
+        '--state-file', type=pathlib.Path, default=None,
+        help=argparse.SUPPRESS,
+    )
+    parser.add_argument(
+        '--provides-index', type=pathlib.Path, default=None,
+        help=argparse.SUPPRESS,
+    )
+    parser.add_argument(
+        '--timings', type=pathlib.Path, default=None,
+        help=argparse.SUPPRESS,
+    )
     parser.add_argument('-d', '--directory', help=argparse.SUPPRESS)  # processed by RPM macro
     return parser
 
@@ -839,6 +1582,16 @@ def main(argv):
     if args.dep_overrides_file and args.dep_overrides_file.is_file():
         dependency_overrides = args.dep_overrides_file.read_text().split()
 
+    config_settings = None
+    if args.config_settings:
+        from pyproject_wheel import parse_config_settings_args
+        config_settings = parse_config_settings_args(args.config_settings)
+
+    provides_index = None
+    if args.provides_index:
+        from pyproject_provides_index import load_provides_index
+        provides_index = load_provides_index(args.provides_index, args.python3_pkgversion)
+
     try:
         generate_requires(
             include_runtime=args.runtime,
@@ -853,11 +1606,15 @@ def main(argv):
             use_build_system=args.use_build_system,
             pyproject_dependencies=args.pyproject_dependencies,
             output=args.output,
-            config_settings=parse_config_settings_args(args.config_settings),
+            config_settings=config_settings,
             dependency_overrides=dependency_overrides,
+            state_file=args.state_file,
+            provides_index=provides_index,
+            timings_file=args.timings,
         )
     except Exception:
         # Log the traceback explicitly (it's useful debug info)
+        import traceback
         traceback.print_exc()
         exit(1)
 
@@ -0,0 +1,389 @@
+"""A resident process running %pyproject_buildrequires passes.
+
+Every pass of %pyproject_buildrequires normally starts a new Python interpreter
+and imports the build backend again.
+When %_pyproject_buildrequires_server is defined, the macro runs this script instead:
+
+    pyproject_buildrequires_server.py SOCKET [ARGS...]
+
+The first invocation starts a server process listening on the UNIX socket SOCKET.
+The invocations send their arguments, working directory, environment,
+stdout and stderr to the server, which runs pyproject_buildrequires.main() with them.
+All the output goes directly to the caller's stdout and stderr.
+
+The server only serves the requests while the distributions providing its imported modules are unchanged
+(e.g. the build backend or packaging), other newly installed BuildRequires are picked up as usual.
+When those are upgraded or removed, it exits and a new one is started.
+Whenever the server cannot be used, the pass is run in the calling process.
+
+The server exits when the socket is removed (e.g. with the build directory),
+when it was not used for IDLE_TIMEOUT,
+or when the rpmbuild process of the last pass is gone and no new pass came within ORPHAN_TIMEOUT.
+"""
+
+import importlib
+import json
+import os
+import socket
+import sys
+import tempfile
+import time
+
+
+# The server exits when it was not used for this many seconds
+IDLE_TIMEOUT = 300
+
+# The server exits when it was not used for this many seconds after the rpmbuild process of the last pass exited,
+# the next pass is run by a new rpmbuild process once the missing BuildRequires are installed
+ORPHAN_TIMEOUT = 60
+
+# How long to wait for a freshly started server to listen
+START_TIMEOUT = 10
+
+# The maximal size of a request or a response
+BUFSIZE = 1024 * 1024
+
+# Environment variables read when pyproject_buildrequires is imported
+IMPORT_ENVIRON = ('FEDORA', 'RHEL')
+
+# The interpreter flags that need to match, see interpreter_options()
+INTERPRETER_FLAGS = ('isolated', 'no_user_site', 'ignore_environment', 'dont_write_bytecode')
+
+# The scripts the server imports once, they must not change either
+SCRIPTS = ('pyproject_buildrequires.py', 'pyproject_convert.py', 'pyproject_tox_config.py',
+           'pyproject_buildrequires_server.py')
+
+
+def print_err(*args, **kwargs):
+    kwargs.setdefault('file', sys.stderr)
+    print(*args, **kwargs)
+
+
+def mtime(path):
+    try:
+        return os.stat(path).st_mtime_ns
+    except OSError:
+        return None
+
+
+def packages_distributions():
+    """importlib.metadata.packages_distributions(), only the declared top-level packages on Python < 3.10"""
+    import importlib.metadata
+    try:
+        return importlib.metadata.packages_distributions()
+    except AttributeError:
+        packages = {}
+        for dist in importlib.metadata.distributions():
+            for package in (dist.read_text('top_level.txt') or '').split():
+                packages.setdefault(package, []).append(dist.metadata['Name'])
+        return packages
+
+
+def installed_version(dist_name):
+    import importlib.metadata
+    try:
+        return importlib.metadata.version(dist_name)
+    except importlib.metadata.PackageNotFoundError:
+        return None
+
+
+def loaded_distributions():
+    """
+    The versions of the installed distributions providing the modules imported in this process.
+
+    When any of them changes, the imported modules are outdated.
+    Newly installed distributions don't matter, they are imported when needed.
+    """
+    top_level = {name.partition('.')[0] for name in sys.modules}
+    dist_names = set()
+    for package, dists in packages_distributions().items():
+        if package in top_level:
+            dist_names.update(dists)
+    return {dist_name: installed_version(dist_name) for dist_name in sorted(dist_names)}
+
+
+def outdated_distributions(versions):
+    """The names of the distributions from loaded_distributions() that were upgraded or removed since"""
+    importlib.invalidate_caches()
+    return [dist_name for dist_name, version in versions.items() if installed_version(dist_name) != version]
+
+
+def build_owner():
+    """The pid of the rpmbuild process running this pass, or of the parent process when there is none"""
+    pid = os.getppid()
+    while pid > 1:
+        try:
+            with open(f'/proc/{pid}/stat') as f:
+                stat = f.read()
+        except OSError:
+            break
+        # pid (comm) state ppid ..., comm can contain spaces and parentheses
+        comm_end = stat.rindex(')')
+        if stat[stat.index('(') + 1:comm_end] == 'rpmbuild':
+            return pid
+        pid = int(stat[comm_end + 1:].split()[1])
+    return os.getppid()
+
+
+def process_exists(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+def fingerprint():
+    """
+    Identify the state of the interpreter, the server only serves requests with the same fingerprint.
+
+    The installed distributions are not a part of it, see loaded_distributions().
+    """
+    scripts_dir = os.path.dirname(os.path.abspath(__file__))
+    return {
+        'executable': sys.executable,
+        'version': sys.version,
+        'flags': [getattr(sys.flags, flag) for flag in INTERPRETER_FLAGS],
+        # a new .pth file changes the paths, but the server's site was already processed
+        'path': list(sys.path),
+        'scripts': [[script, mtime(os.path.join(scripts_dir, script))] for script in SCRIPTS],
+        'environ': {name: os.environ.get(name) for name in IMPORT_ENVIRON},
+    }
+
+
+def interpreter_options():
+    """The command line options the interpreter was started with (the ones used by the macros)"""
+    options = []
+    if sys.flags.isolated:
+        options.append('-I')
+    else:
+        if sys.flags.no_user_site:
+            options.append('-s')
+        if sys.flags.ignore_environment:
+            options.append('-E')
+    if sys.flags.dont_write_bytecode:
+        options.append('-B')
+    return options
+
+
+def send_message(sock, message, fds=()):
+    data = json.dumps(message).encode('utf-8')
+    if len(data) > BUFSIZE:
+        raise ValueError('The message is too large')
+    socket.send_fds(sock, [data], list(fds))
+
+
+def receive_message(sock, maxfds=0):
+    data, fds, _, _ = socket.recv_fds(sock, BUFSIZE, maxfds)
+    if not data:
+        raise ConnectionError('The connection was closed')
+    return json.loads(data), fds
+
+
+def request(socket_path, args):
+    """
+    Let the server listening on socket_path run pyproject_buildrequires with args.
+
+    Return the exit code, or None when the server refused the request (and exited).
+    Raise OSError when the server is not available.
+    """
+    with socket.socket(socket.AF_UNIX, socket.SOCK_SEQPACKET) as sock:
+        sock.connect(socket_path)
+        sys.stdout.flush()
+        sys.stderr.flush()
+        send_message(sock, {
+            'args': args,
+            'cwd': os.getcwd(),
+            'environ': dict(os.environ),
+            'fingerprint': fingerprint(),
+            'owner': build_owner(),
+        }, fds=(sys.stdout.fileno(), sys.stderr.fileno()))
+        response, _ = receive_message(sock)
+    return response['returncode']
+
+
+def start_server(socket_path):
+    """Start a detached server listening on socket_path, return True once it listens"""
+    import subprocess
+    try:
+        os.unlink(socket_path)
+    except FileNotFoundError:
+        pass
+    subprocess.Popen(
+        [sys.executable, *interpreter_options(), os.path.abspath(__file__), '--serve', socket_path],
+        stdin=subprocess.DEVNULL,
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL,
+        start_new_session=True,
+    )
+    deadline = time.monotonic() + START_TIMEOUT
+    while time.monotonic() < deadline:
+        if os.path.exists(socket_path):
+            return True
+        time.sleep(0.01)
+    return False
+
+
+def run_on_server(socket_path, args):
+    """Return the exit code of the pass run by the server, None if no server could be used"""
+    for _ in range(2):
+        try:
+            returncode = request(socket_path, args)
+        except (FileNotFoundError, ConnectionRefusedError):
+            pass  # the server is not running (anymore)
+        except (OSError, ValueError) as e:
+            print_err(f'Cannot use the %pyproject_buildrequires server: {e}')
+            return None
+        else:
+            if returncode is not None:
+                return returncode
+            # the server was started before new packages were installed, it exited
+        if not start_server(socket_path):
+            return None
+    return None
+
+
+def exit_code(code):
+    """The exit code of a process ending with SystemExit(code)"""
+    if code is None:
+        return 0
+    if isinstance(code, int):
+        return code
+    print_err(code)
+    return 1
+
+
+def handle(pyproject_buildrequires, message, fds):
+    """Run one pass of pyproject_buildrequires in the environment described by the message"""
+    saved_cwd = os.getcwd()
+    saved_environ = dict(os.environ)
+    saved_path = list(sys.path)
+    saved_modules = set(sys.modules)
+    saved_fds = [os.dup(1), os.dup(2)]
+    for fd, target in zip(fds, (1, 2)):
+        os.dup2(fd, target)
+    try:
+        os.chdir(message['cwd'])
+        os.environ.clear()
+        os.environ.update(message['environ'])
+        # tempfile caches the directory (derived from TMPDIR) of the first request otherwise
+        tempfile.tempdir = None
+        importlib.invalidate_caches()
+        pyproject_buildrequires.load_pyproject.cache_clear()
+        try:
+            pyproject_buildrequires.main(message['args'])
+        except SystemExit as e:
+            return exit_code(e.code)
+        except Exception:
+            import traceback
+            traceback.print_exc()
+            return 1
+        return 0
+    finally:
+        sys.stdout.flush()
+        sys.stderr.flush()
+        for fd, target in zip(saved_fds, (1, 2)):
+            os.dup2(fd, target)
+            os.close(fd)
+        # The modules of the project (e.g. an in-tree backend) are imported again for the next pass,
+        # it might be in a different directory
+        project_dir = os.path.join(os.path.realpath(message['cwd']), '')
+        for name, module in list(sys.modules.items()):
+            module_file = getattr(module, '__file__', None)
+            if (name not in saved_modules and module_file and
+                    os.path.realpath(module_file).startswith(project_dir)):
+                del sys.modules[name]
+        os.chdir(saved_cwd)
+        os.environ.clear()
+        os.environ.update(saved_environ)
+        sys.path[:] = saved_path
+
+
+def serve(socket_path):
+    """
+    Serve the requests on socket_path until the socket is removed,
+    until idle for IDLE_TIMEOUT or for ORPHAN_TIMEOUT after the rpmbuild process of the last request exited.
+    """
+    # the fingerprint is normalized, so we can compare it with the received ones
+    own_fingerprint = json.loads(json.dumps(fingerprint()))
+    with socket.socket(socket.AF_UNIX, socket.SOCK_SEQPACKET) as server:
+        umask = os.umask(0o077)
+        try:
+            server.bind(socket_path)
+        finally:
+            os.umask(umask)
+        server.listen()
+        inode = os.stat(socket_path).st_ino
+
+        def listening():
+            """The socket was not removed (or replaced by another server)"""
+            try:
+                return os.stat(socket_path).st_ino == inode
+            except FileNotFoundError:
+                return False
+
+        import pyproject_buildrequires
+        loaded = loaded_distributions()
+
+        def idle():
+            idle_time = time.monotonic() - last_used
+            if idle_time >= IDLE_TIMEOUT:
+                return True
+            return idle_time >= ORPHAN_TIMEOUT and owner is not None and not process_exists(owner)
+
+        server.settimeout(1)
+        last_used = time.monotonic()
+        owner = None
+        try:
+            while listening() and not idle():
+                try:
+                    connection, _ = server.accept()
+                except socket.timeout:
+                    continue
+                with connection:
+                    connection.settimeout(None)
+                    try:
+                        message, fds = receive_message(connection, maxfds=2)
+                    except (OSError, ValueError):
+                        continue
+                    try:
+                        if (message.get('fingerprint') != own_fingerprint or len(fds) != 2 or
+                                outdated_distributions(loaded)):
+                            # stop listening, so the client can start a new server
+                            os.unlink(socket_path)
+                            send_message(connection, {'returncode': None})
+                            return
+                        owner = message.get('owner')
+                        returncode = handle(pyproject_buildrequires, message, fds)
+                        # e.g. the build backend was imported
+                        loaded = loaded_distributions()
+                    finally:
+                        for fd in fds:
+                            os.close(fd)
+                    try:
+                        send_message(connection, {'returncode': returncode})
+                    except OSError:
+                        pass  # the client is gone
+                    last_used = time.monotonic()
+        finally:
+            if listening():
+                os.unlink(socket_path)
+
+
+def main(argv):
+    if argv[:1] == ['--serve']:
+        serve(argv[1])
+        return
+    socket_path, *args = argv
+    returncode = run_on_server(socket_path, args)
+    if returncode is None:
+        import pyproject_buildrequires
+        pyproject_buildrequires.main(args)
+    else:
+        sys.exit(returncode)
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
@@ -0,0 +1,343 @@
+"""Install wheels to the buildroot without pip.
+
+Used by %pyproject_install when %_pyproject_installer is defined to builtin.
+The files are unpacked straight from the wheel and the RECORD is not written at all:
+the paths of the installed files are saved to %{_pyproject_record} directly
+and the ghost dist-info files are written in the same pass.
+"""
+
+import argparse
+import concurrent.futures
+import configparser
+import email.parser
+import os
+import posixpath
+import re
+import shutil
+import stat
+import sys
+import sysconfig
+import zipfile
+from pathlib import PosixPath
+
+from pyproject_postinstall import load_overrides, patch_distinfo_metadata, write_ghost_distinfo
+from pyproject_preprocess_record import save_parsed_record
+from pyproject_save_files import BuildrootPath
+
+
+# Copied from pip 23.2.1, the script_template of its vendored distlib ScriptMaker,
+# so the scripts are identical to the ones pip writes.
+# test_script_template_matches_pip catches it when the template of the installed pip changes.
+SCRIPT_TEMPLATE = r'''# -*- coding: utf-8 -*-
+import re
+import sys
+from %(module)s import %(import_name)s
+if __name__ == '__main__':
+    sys.argv[0] = re.sub(r'(-script\.pyw|\.exe)?$', '', sys.argv[0])
+    sys.exit(%(func)s())
+'''
+
+# module:attr.attr [extra1, extra2], the extras are ignored like pip does
+ENTRY_POINT_RE = re.compile(r'^(?P<module>[\w.]+)\s*:\s*(?P<func>[\w.]+)\s*(\[.*\])?\s*$')
+
+
+def print_err(*args, **kwargs):
+    kwargs.setdefault('file', sys.stderr)
+    print(*args, **kwargs)
+
+
+def current_umask():
+    mask = os.umask(0)
+    os.umask(mask)
+    return mask
+
+
+def install_scheme(prefix, purelib, platlib, dist_name):
+    """
+    Return the target directories for the wheel, the same as pip install --prefix uses.
+
+    purelib and platlib are passed by the macro, the rest is derived from the prefix.
+
+    Example:
+
+        >>> scheme = install_scheme('/usr', '/usr/lib/python3.14/site-packages',
+        ...                         '/usr/lib64/python3.14/site-packages', 'pkg')
+        >>> scheme['scripts'], scheme['data']
+        ('/usr/bin', '/usr')
+        >>> scheme['headers']
+        '/usr/include/python3.../pkg'
+    """
+    prefix_vars = {'base': prefix, 'platbase': prefix, 'installed_base': prefix, 'installed_platbase': prefix}
+    paths = sysconfig.get_paths('posix_prefix', vars=prefix_vars)
+    return {
+        'purelib': purelib,
+        'platlib': platlib,
+        'scripts': paths['scripts'],
+        'data': paths['data'],
+        'headers': posixpath.join(paths['include'], dist_name),
+    }
+
+
+def find_distinfo(wheel_path, names):
+    """
+    Return the name of the .dist-info directory in the wheel.
+
+    Example:
+
+        >>> find_distinfo('tldr-0.5-py3-none-any.whl', ['tldr.py', 'tldr-0.5.dist-info/METADATA'])
+        'tldr-0.5.dist-info'
+        >>> find_distinfo('tldr-0.5-py3-none-any.whl', ['tldr.py'])
+        Traceback (most recent call last):
+          ...
+        ValueError: tldr-0.5-py3-none-any.whl contains 0 .dist-info directories, expected 1
+    """
+    distinfos = {name.split('/', 1)[0] for name in names
+                 if name.split('/', 1)[0].endswith('.dist-info')}
+    if len(distinfos) != 1:
+        raise ValueError(f'{wheel_path} contains {len(distinfos)} .dist-info directories, expected 1')
+    return distinfos.pop()
+
+
+def target_path(name, data_dir, root, scheme):
+    """
+    Return the installation path of a file from the wheel.
+
+    Examples:
+
+        >>> scheme = {'scripts': '/usr/bin', 'data': '/usr'}
+        >>> target_path('pkg/__init__.py', 'pkg-1.data', '/usr/lib/site', scheme)
+        ('/usr/lib/site/pkg/__init__.py', None)
+        >>> target_path('pkg-1.data/scripts/run', 'pkg-1.data', '/usr/lib/site', scheme)
+        ('/usr/bin/run', 'scripts')
+        >>> target_path('pkg-1.data/data/share/man/pkg.1', 'pkg-1.data', '/usr/lib/site', scheme)
+        ('/usr/share/man/pkg.1', 'data')
+        >>> target_path('pkg-1.data/data/../../etc/passwd', 'pkg-1.data', '/usr/lib/site', scheme)
+        Traceback (most recent call last):
+          ...
+        ValueError: pkg-1.data/data/../../etc/passwd would be installed outside of /usr
+    """
+    original_name = name
+    if name.startswith(data_dir + '/'):
+        key, _, name = name[len(data_dir) + 1:].partition('/')
+        try:
+            directory = scheme[key]
+        except KeyError:
+            raise ValueError(f'Unknown wheel data directory {data_dir}/{key}') from None
+    else:
+        key, directory = None, root
+    path = posixpath.normpath(posixpath.join(directory, name))
+    if not path.startswith(directory.rstrip('/') + '/'):
+        raise ValueError(f'{original_name} would be installed outside of {directory}')
+    return path, key
+
+
+def fix_script(content, executable):
+    """
+    Replace #!python with #!/path/to/python, like pip does.
+
+    Examples:
+
+        >>> fix_script(b'#!python -E\\nimport sys\\n', '/usr/bin/python3')
+        b'#!/usr/bin/python3\\nimport sys\\n'
+        >>> fix_script(b'#!/bin/sh\\necho\\n', '/usr/bin/python3')
+        b'#!/bin/sh\\necho\\n'
+    """
+    if not content.startswith(b'#!python'):
+        return content
+    _, _, rest = content.partition(b'\n')
+    return b'#!' + os.fsencode(executable) + b'\n' + rest
+
+
+def entry_point_scripts(entry_points_txt, executable):
+    """
+    Yield (name, content) of the console and GUI scripts defined in entry_points.txt.
+
+    Example:
+
+        >>> text = '[console_scripts]\\ntldr = tldr.cli:main.run [color]\\n[other]\\nx = y:z\\n'
+        >>> [(name, content.splitlines()[:1]) for name, content in entry_point_scripts(text, '/usr/bin/python3')]
+        [('tldr', ['#!/usr/bin/python3'])]
+        >>> 'from tldr.cli import main' in dict(entry_point_scripts(text, '/usr/bin/python3'))['tldr']
+        True
+    """
+    parser = configparser.ConfigParser(delimiters=('=',), interpolation=None)
+    parser.optionxform = str  # the script names are case sensitive
+    parser.read_string(entry_points_txt)
+    for section in ('console_scripts', 'gui_scripts'):
+        if not parser.has_section(section):
+            continue
+        for name, value in parser.items(section):
+            match = ENTRY_POINT_RE.match(value)
+            if not match:
+                raise ValueError(f'Invalid entry point {name} = {value}')
+            func = match['func']
+            content = f'#!{executable}\n' + SCRIPT_TEMPLATE % {
+                'module': match['module'],
+                'import_name': func.split('.')[0],
+                'func': func,
+            }
+            yield name, content
+
+
+def write_file(real_path, source, *, mode=None):
+    os.makedirs(os.path.dirname(real_path), exist_ok=True)
+    # remove the existing file first, so hardlinks or read-only files are not written through
+    if os.path.lexists(real_path):
+        os.unlink(real_path)
+    with open(real_path, 'wb') as f:
+        if isinstance(source, bytes):
+            f.write(source)
+        else:
+            shutil.copyfileobj(source, f, 1024 * 1024)
+    if mode is not None:
+        os.chmod(real_path, mode)
+
+
+def wheel_contents(wheel, wheel_path, *, prefix, purelib, platlib, executable):
+    """
+    For an open wheel (zipfile.ZipFile), return the installation path of its dist-info directory,
+    a list of (ZipInfo, path, scheme key) for the files to unpack
+    and a list of (path, content) for the entry point scripts to generate.
+    """
+    infos = [info for info in wheel.infolist() if not info.is_dir()]
+    distinfo = find_distinfo(wheel_path, [info.filename for info in infos])
+    data_dir = distinfo.removesuffix('.dist-info') + '.data'
+    wheel_metadata = email.parser.BytesParser().parsebytes(wheel.read(f'{distinfo}/WHEEL'))
+    metadata = email.parser.BytesParser().parsebytes(wheel.read(f'{distinfo}/METADATA'), headersonly=True)
+    is_purelib = wheel_metadata.get('Root-Is-Purelib', '').lower() == 'true'
+    root = purelib if is_purelib else platlib
+    scheme = install_scheme(prefix, purelib, platlib, metadata['Name'])
+
+    files = []
+    for info in infos:
+        if info.filename.startswith(f'{distinfo}/RECORD'):
+            # RECORD (and its signatures) would be removed in %pyproject_install anyway
+            continue
+        files.append((info, *target_path(info.filename, data_dir, root, scheme)))
+
+    scripts = []
+    if f'{distinfo}/entry_points.txt' in wheel.NameToInfo:
+        entry_points_txt = wheel.read(f'{distinfo}/entry_points.txt').decode('utf-8')
+        for name, content in entry_point_scripts(entry_points_txt, executable):
+            scripts.append((posixpath.join(scheme['scripts'], name), content))
+
+    return posixpath.join(root, distinfo), files, scripts
+
+
+def install_wheel(wheel_path, *, buildroot, prefix, purelib, platlib, executable=sys.executable, umask=None):
+    """
+    Install the wheel to the buildroot.
+
+    Return the BuildrootPath of the (not written) RECORD file and the list of installed paths.
+    The RECORD file itself is not in the list.
+    """
+    if umask is None:
+        umask = current_umask()
+    with zipfile.ZipFile(wheel_path) as wheel:
+        distinfo_path, files, scripts = wheel_contents(
+            wheel, wheel_path, prefix=prefix, purelib=purelib, platlib=platlib, executable=executable,
+        )
+        installed = []
+        for info, path, key in files:
+            real_path = buildroot + path
+            mode = info.external_attr >> 16
+            # like pip, only the executable bit is preserved
+            mode = 0o777 & ~umask | 0o111 if mode and stat.S_ISREG(mode) and mode & 0o111 else None
+            if key == 'scripts':
+                write_file(real_path, fix_script(wheel.read(info), executable), mode=mode)
+            else:
+                with wheel.open(info) as source:
+                    write_file(real_path, source, mode=mode)
+            installed.append(path)
+
+    for path, content in scripts:
+        write_file(buildroot + path, content.encode('utf-8'), mode=0o666 & ~umask | 0o555)
+        installed.append(path)
+
+    write_file(buildroot + distinfo_path + '/INSTALLER', b'rpm\n')
+    installed.append(distinfo_path + '/INSTALLER')
+    return BuildrootPath(posixpath.join(distinfo_path, 'RECORD')), installed
+
+
+def shared_paths(wheel_paths, *, prefix, purelib, platlib):
+    """
+    Return the set of paths that would be installed by more than one of the wheels.
+
+    Only the zip directories (and the small metadata files) are read.
+    """
+    seen, shared = set(), set()
+    for wheel_path in wheel_paths:
+        with zipfile.ZipFile(wheel_path) as wheel:
+            distinfo_path, files, scripts = wheel_contents(
+                wheel, wheel_path, prefix=prefix, purelib=purelib, platlib=platlib, executable=sys.executable,
+            )
+        paths = {path for _, path, _ in files} | {path for path, _ in scripts}
+        shared |= seen & paths
+        seen |= paths
+    return shared
+
+
+def install_and_patch(wheel_path, *, overrides=None, **kwargs):
+    print_err(f'Installing {wheel_path.name}')
+    record_path, installed = install_wheel(wheel_path, **kwargs)
+    patch_distinfo_metadata(kwargs['buildroot'], record_path, overrides)
+    return record_path, installed
+
+
+def install_wheels(wheel_paths, *, jobs=1, **kwargs):
+    """
+    Install the wheels (and patch their metadata), possibly in parallel.
+
+    Return a list of (BuildrootPath of RECORD, installed paths) in the order of the wheels,
+    the shared output files are then written by the caller alone.
+    When several wheels would install the same file, they are installed one after another,
+    so the last one wins, like with pip.
+    """
+    jobs = min(jobs, len(wheel_paths))
+    if jobs > 1:
+        layout = {key: kwargs[key] for key in ('prefix', 'purelib', 'platlib')}
+        if shared := shared_paths(wheel_paths, **layout):
+            print_err(f'Installing the wheels one by one, {len(shared)} paths are shared, e.g. {min(shared)}')
+            jobs = 1
+    if jobs <= 1:
+        return [install_and_patch(wheel_path, **kwargs) for wheel_path in wheel_paths]
+    # the umask is process-wide, read it once here and not concurrently in the workers
+    kwargs.setdefault('umask', current_umask())
+    with concurrent.futures.ProcessPoolExecutor(max_workers=jobs) as executor:
+        futures = [executor.submit(install_and_patch, wheel_path, **kwargs) for wheel_path in wheel_paths]
+        return [future.result() for future in futures]
+
+
+def main(cli_args):
+    results = install_wheels(
+        cli_args.wheels,
+        jobs=cli_args.jobs,
+        buildroot=str(cli_args.buildroot).rstrip('/'),
+        prefix=str(cli_args.prefix),
+        purelib=str(cli_args.purelib),
+        platlib=str(cli_args.platlib),
+        overrides=load_overrides(cli_args.dep_overrides),
+    )
+    for record_path, installed in results:
+        save_parsed_record(record_path, installed, cli_args.record_output)
+        write_ghost_distinfo(record_path, cli_args.ghost_distinfo_base)
+
+
+def argparser():
+    parser = argparse.ArgumentParser()
+    r = parser.add_argument_group("required arguments")
+    r.add_argument("--buildroot", type=PosixPath, required=True)
+    r.add_argument("--prefix", type=PosixPath, required=True)
+    r.add_argument("--purelib", type=PosixPath, required=True)
+    r.add_argument("--platlib", type=PosixPath, required=True)
+    r.add_argument("--record-output", type=PosixPath, required=True)
+    r.add_argument("--ghost-distinfo-base", type=PosixPath, required=True)
+    parser.add_argument("--dep-overrides", type=PosixPath, default=None)
+    parser.add_argument("--jobs", type=int, default=1, help="Install up to this many wheels in parallel")
+    parser.add_argument("wheels", type=PosixPath, nargs="+", metavar="WHEEL")
+    return parser
+
+
+if __name__ == "__main__":
+    cli_args = argparser().parse_args()
+    main(cli_args)
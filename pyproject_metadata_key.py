@@ -0,0 +1,49 @@
+"""Digests identifying the inputs of the build backend hooks.
+
+Shared by %pyproject_buildrequires (pyproject_buildrequires.py) and %pyproject_wheel (pyproject_wheel.py),
+importing this module has no side effects.
+"""
+
+import hashlib
+import importlib.metadata
+import json
+import os
+import sys
+
+from packaging.requirements import Requirement
+
+
+def json_digest(snapshot):
+    return hashlib.sha256(json.dumps(snapshot, sort_keys=True).encode()).hexdigest()
+
+
+def file_digest(path):
+    try:
+        with open(path, 'rb') as f:
+            return hashlib.sha256(f.read()).hexdigest()
+    except FileNotFoundError:
+        return None
+
+
+def metadata_cache_key(buildsystem_data, config_settings, get_installed_version=importlib.metadata.version):
+    """
+    The metadata prepared by the build backend is the same as long as this does not change:
+    the project files, the backend, the config settings and the installed build-system requirements.
+    Metadata computed from other files is not noticed to change,
+    hence the metadata is only cached with the opt-in %_pyproject_buildrequires_state.
+
+    buildsystem_data is the [build-system] table of pyproject.toml.
+    """
+    names = [Requirement(r).name for r in buildsystem_data.get('requires', ())]
+    if not buildsystem_data.get('build-backend'):
+        names.append('setuptools')
+    versions = {}
+    for name in names:
+        try:
+            versions[name] = get_installed_version(name)
+        except importlib.metadata.PackageNotFoundError:
+            versions[name] = None
+    files = {f: file_digest(f) for f in ('pyproject.toml', 'setup.py', 'setup.cfg', 'PKG-INFO')}
+    return json_digest([os.getcwd(), files, buildsystem_data.get('build-backend'),
+                        buildsystem_data.get('backend-path'), config_settings or None,
+                        versions, sys.version])
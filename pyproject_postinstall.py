@@ -0,0 +1,111 @@
+"""Process the .dist-info directories installed by pip in %pyproject_install.
+
+All the dist-info directories in the given site dirs are processed in one interpreter:
+the RECORD is parsed and saved to %{_pyproject_record}, the ghost dist-info files are written,
+INSTALLER is changed to rpm, RECORD and REQUESTED are removed
+and the dependency overrides are applied to METADATA.
+"""
+
+import argparse
+import sys
+from pathlib import PosixPath
+
+from pyproject_preprocess_record import parse_record, read_record, save_parsed_record
+from pyproject_save_files import BuildrootPath, canonical_name_from_distinfo
+
+
+def print_err(*args, **kwargs):
+    kwargs.setdefault('file', sys.stderr)
+    print(*args, **kwargs)
+
+
+def load_overrides(dep_overrides):
+    """Return the parsed dependency overrides, or None if there are none"""
+    if dep_overrides is None or not dep_overrides.is_file():
+        return None
+    # uses packaging, only imported when needed
+    from pyproject_patch_metadata import parse_overrides
+    try:
+        return parse_overrides(dep_overrides.read_text(encoding='utf-8').split())
+    except ValueError as e:
+        print_err(f'ERROR: {e}')
+        sys.exit(1)
+
+
+def patch_distinfo_metadata(buildroot, record_path, overrides):
+    if not overrides:
+        return
+    from pyproject_patch_metadata import patch_metadata
+    patch_metadata(record_path.parent.to_real(buildroot) / 'METADATA', overrides)
+
+
+def write_ghost_distinfo(record_path, ghost_distinfo_base):
+    line = f'%ghost %dir {record_path.parent}\n'
+    normalized = canonical_name_from_distinfo(record_path.parent.name)
+    for path in ghost_distinfo_base, PosixPath(f'{ghost_distinfo_base}-{normalized}'):
+        with open(path, 'a', encoding='utf-8') as f:
+            f.write(line)
+
+
+def fix_installer(distinfo):
+    """Replace pip with rpm in INSTALLER, like sed 's/pip/rpm/' did"""
+    installer = distinfo / 'INSTALLER'
+    if installer.is_file():
+        lines = installer.read_text(encoding='utf-8').splitlines(keepends=True)
+        installer.write_text(''.join(line.replace('pip', 'rpm', 1) for line in lines), encoding='utf-8')
+
+
+def distinfo_dirs(buildroot, site_dirs):
+    """
+    Yield the real paths of the .dist-info directories in the site dirs, each site dir only once.
+    """
+    seen = set()
+    for site_dir in site_dirs:
+        real_site_dir = site_dir.to_real(buildroot)
+        if real_site_dir in seen or not real_site_dir.is_dir():
+            continue
+        seen.add(real_site_dir)
+        yield from sorted(real_site_dir.glob('*.dist-info'))
+
+
+def process_distinfo(distinfo, *, buildroot, record_output, ghost_distinfo_base, overrides):
+    record = distinfo / 'RECORD'
+    record_path = BuildrootPath.from_real(record, root=buildroot)
+    write_ghost_distinfo(record_path, ghost_distinfo_base)
+    fix_installer(distinfo)
+    parsed_record = parse_record(record_path, read_record(record))
+    save_parsed_record(record_path, parsed_record, record_output)
+    for name in 'RECORD', 'REQUESTED':
+        path = distinfo / name
+        if path.exists():
+            path.unlink()
+            print_err(f"removed '{path}'")
+    patch_distinfo_metadata(buildroot, record_path, overrides)
+
+
+def main(cli_args):
+    overrides = load_overrides(cli_args.dep_overrides)
+    for distinfo in distinfo_dirs(cli_args.buildroot, cli_args.site_dirs):
+        process_distinfo(
+            distinfo,
+            buildroot=cli_args.buildroot,
+            record_output=cli_args.record_output,
+            ghost_distinfo_base=cli_args.ghost_distinfo_base,
+            overrides=overrides,
+        )
+
+
+def argparser():
+    parser = argparse.ArgumentParser()
+    r = parser.add_argument_group("required arguments")
+    r.add_argument("--buildroot", type=PosixPath, required=True)
+    r.add_argument("--record-output", type=PosixPath, required=True)
+    r.add_argument("--ghost-distinfo-base", type=PosixPath, required=True)
+    parser.add_argument("--dep-overrides", type=PosixPath, default=None)
+    parser.add_argument("site_dirs", type=BuildrootPath, nargs="+", metavar="SITE_DIR")
+    return parser
+
+
+if __name__ == "__main__":
+    cli_args = argparser().parse_args()
+    main(cli_args)
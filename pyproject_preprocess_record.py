@@ -1,7 +1,9 @@
 import argparse
 import csv
+import fcntl
 import json
 import os
+import posixpath
 from pathlib import PosixPath
 
 from pyproject_save_files import BuildrootPath
@@ -34,35 +36,51 @@ def read_record(record_path):
 
 def parse_record(record_path, record_content):
     """
-    Returns a list with BuildrootPaths parsed from record_content
+    A generator yielding str-paths (absolute in the buildroot) parsed from record_content
 
     params:
-    record_path: RECORD BuildrootPath
-    record_content: list of RECORD triplets
+    record_path: RECORD BuildrootPath (or str)
+    record_content: iterable of RECORD triplets
                     first item is a str-path relative to directory where dist-info directory is
                     (it can also be absolute according to the standard, but not from pip)
 
     Examples:
-        >>> parse_record(BuildrootPath('/usr/lib/python3.7/site-packages/requests-2.22.0.dist-info/RECORD'),
-        ...                            [('requests/sessions.py', 'sha256=xxx', '666')])
+        >>> list(parse_record(BuildrootPath('/usr/lib/python3.7/site-packages/requests-2.22.0.dist-info/RECORD'),
+        ...                                 [('requests/sessions.py', 'sha256=xxx', '666')]))
         ['/usr/lib/python3.7/site-packages/requests/sessions.py']
 
-        >>> parse_record(BuildrootPath('/usr/lib/python3.7/site-packages/tldr-0.5.dist-info/RECORD'),
-        ...                            [('../../../bin/tldr', 'sha256=yyy', '777')])
+        >>> list(parse_record(BuildrootPath('/usr/lib/python3.7/site-packages/tldr-0.5.dist-info/RECORD'),
+        ...                                 [('../../../bin/tldr', 'sha256=yyy', '777')]))
         ['/usr/bin/tldr']
     """
-    sitedir = record_path.parent.parent  # trough the dist-info directory
-    # / with absolute right operand will remove the left operand
+    # trough the dist-info directory
+    sitedir = posixpath.dirname(posixpath.dirname(str(record_path)))
+    # join with absolute right operand will remove the left operand
     # any .. parts are resolved via normpath
-    return [str((sitedir / row[0]).normpath()) for row in record_content]
+    # plain strings are used, creating path objects for each row is too slow for huge RECORDs
+    for row in record_content:
+        yield posixpath.normpath(posixpath.join(sitedir, row[0]))
 
 
 def save_parsed_record(record_path, parsed_record, output_file):
-    content = {}
-    if output_file.is_file():
-        content = json.loads(output_file.read_text())
-    content[str(record_path)] = parsed_record
-    output_file.write_text(json.dumps(content))
+    """
+    Append the parsed record of one dist-info to output_file as a line of JSON.
+
+    The file is only appended to (under an exclusive lock), so the previous records are not re-read
+    and concurrent writers cannot overwrite each other's records.
+    The old format (a single JSON object with all the records on one line) is still readable
+    and can be appended to.
+    """
+    # the paths are serialized one by one, parsed_record can be a generator
+    line = f'{{{json.dumps(str(record_path))}: [{", ".join(map(json.dumps, parsed_record))}]}}\n'
+    with open(output_file, 'a+b') as f:
+        fcntl.flock(f, fcntl.LOCK_EX)
+        if f.seek(0, os.SEEK_END):
+            # the old format has no trailing newline
+            f.seek(-1, os.SEEK_END)
+            if f.read(1) != b'\n':
+                line = '\n' + line
+        f.write(line.encode('utf-8'))
 
 
 def main(cli_args):
@@ -0,0 +1,147 @@
+"""Read python3dist() provides from a local dump of repository metadata.
+
+Used by %pyproject_buildrequires to find out which of the not-yet-installed
+requirements will be installable, see %_pyproject_buildrequires_index.
+"""
+
+import gzip
+import json
+import lzma
+import re
+import xml.etree.ElementTree as ElementTree
+
+from packaging.utils import canonicalize_name
+from packaging.version import InvalidVersion, Version
+
+
+RPM_NS = '{http://linux.duke.edu/metadata/rpm}'
+
+
+def provide_name_re(python3_pkgversion='3'):
+    """
+    A regex matching the distribution name in a python3dist() provide
+
+    Provides with extras, such as python3dist(foo[bar]), are not matched.
+
+    Examples:
+
+        >>> provide_name_re().fullmatch('python3dist(zope-interface)')['name']
+        'zope-interface'
+
+        >>> provide_name_re('3.12').fullmatch('python3.12dist(foo)')['name']
+        'foo'
+
+        >>> provide_name_re().fullmatch('python3dist(foo[bar])') is None
+        True
+    """
+    prefix = re.escape(f'python{python3_pkgversion}dist(')
+    return re.compile(prefix + r'(?P<name>[^()\[\]]+)\)')
+
+
+def pep440_version(rpm_version):
+    """
+    Convert the version of a python3dist() provide back to a PEP 440 version
+
+    The RPM dependency generator uses ~ for pre-releases and ^ for post-releases.
+    Return None for versions that cannot be converted.
+
+    Examples:
+
+        >>> pep440_version('1.2.3')
+        '1.2.3'
+
+        >>> pep440_version('1.0~rc1')
+        '1.0rc1'
+
+        >>> pep440_version('2.0^post1')
+        '2.0.post1'
+
+        >>> pep440_version('1:4.5')
+        '1!4.5'
+
+        >>> pep440_version('banana') is None
+        True
+    """
+    epoch, _, version = rpm_version.rpartition(':')
+    version = version.replace('~', '').replace('^', '.')
+    if epoch:
+        version = f'{epoch}!{version}'
+    try:
+        return str(Version(version))
+    except InvalidVersion:
+        return None
+
+
+def _open(path):
+    if path.suffix == '.gz':
+        return gzip.open(path, 'rb')
+    if path.suffix == '.xz':
+        return lzma.open(path, 'rb')
+    return open(path, 'rb')
+
+
+def _add(index, name, version):
+    versions = index.setdefault(canonicalize_name(name), [])
+    if version is not None and (version := pep440_version(version)) and version not in versions:
+        versions.append(version)
+
+
+def read_json_index(data, python3_pkgversion='3'):
+    """
+    Read the index from JSON data, either a mapping of names to (lists of) versions
+    or a list of provide strings.
+
+    Examples:
+
+        >>> read_json_index({'Foo_Bar': ['1.0', '1.1'], 'baz': '2'})
+        {'foo-bar': ['1.0', '1.1'], 'baz': ['2']}
+
+        >>> read_json_index(['python3dist(foo) = 1.0', 'python3dist(foo[x]) = 1.0', 'python3-foo = 1.0'])
+        {'foo': ['1.0']}
+    """
+    index = {}
+    if isinstance(data, dict):
+        for name, versions in data.items():
+            if not isinstance(versions, list):
+                versions = [versions]
+            index.setdefault(canonicalize_name(name), [])
+            for version in versions:
+                _add(index, name, str(version))
+        return index
+    name_re = provide_name_re(python3_pkgversion)
+    for provide in data:
+        name, _, version = provide.partition(' = ')
+        if match := name_re.fullmatch(name.strip()):
+            _add(index, match['name'], version.strip() or None)
+    return index
+
+
+def read_primary_xml(opened_binary_file, python3_pkgversion='3'):
+    """Read the index from the provides in repository metadata (primary.xml)"""
+    index = {}
+    name_re = provide_name_re(python3_pkgversion)
+    for _, element in ElementTree.iterparse(opened_binary_file):
+        if element.tag == f'{RPM_NS}provides':
+            for entry in element.iter(f'{RPM_NS}entry'):
+                if match := name_re.fullmatch(entry.get('name', '')):
+                    version = entry.get('ver')
+                    if version is not None and entry.get('epoch', '0') != '0':
+                        version = f'{entry.get("epoch")}:{version}'
+                    _add(index, match['name'], version)
+        elif element.tag == '{http://linux.duke.edu/metadata/common}package':
+            # we are done with this package, free the memory
+            element.clear()
+    return index
+
+
+def load_provides_index(path, python3_pkgversion='3'):
+    """
+    Load the index of available python3dist() provides from the given file.
+
+    Returns a dict mapping canonical distribution names to lists of available versions.
+    JSON files are read by read_json_index(), everything else as (compressed) primary.xml.
+    """
+    with _open(path) as f:
+        if '.json' in path.suffixes:
+            return read_json_index(json.load(f), python3_pkgversion)
+        return read_primary_xml(f, python3_pkgversion)
@@ -1,8 +1,11 @@
 import argparse
+import concurrent.futures
 import fnmatch
 import json
 import os
+import posixpath
 import re
+import shlex
 
 from collections import defaultdict
 from keyword import iskeyword
@@ -17,6 +20,9 @@ RPM_GLOB_SYMBOLS = '[]{}*?!'
 # Combined for escape_rpm_path_4_19()
 RPM_SPECIAL_SYMBOLS = RPM_FILES_DELIMETERS + RPM_GLOB_SYMBOLS + '"' + "\\"
 RPM_ESCAPE_REGEX = re.compile(f"([{re.escape(RPM_SPECIAL_SYMBOLS)}])")
+# Paths without any of these are returned unchanged by escape_rpm_path_4_19() and escape_rpm_path_4_18()
+RPM_ESCAPED_SYMBOLS_4_19 = frozenset(RPM_SPECIAL_SYMBOLS + '%')
+RPM_ESCAPED_SYMBOLS_4_18 = frozenset(RPM_FILES_DELIMETERS + '%')
 
 # See the comment in the macro that wraps this script
 RPM_FILES_ESCAPE = os.getenv('RPM_FILES_ESCAPE', '4.19')
@@ -111,6 +117,10 @@ class BuildrootPath(PurePosixPath):
         """
         return type(self)(os.path.normpath(self))
 
+    def __reduce__(self):
+        # keep the attributes (such as glob_suffix_len) when classified in another process
+        return type(self), (str(self),), self.__dict__ or None
+
 
 def pycache_dir(script):
     """
@@ -154,14 +164,12 @@ def add_file_to_module(paths, module_name, module_type, files_dirs, *files):
     """
     Helper procedure, adds given files to the module_name of a given module_type
     """
-    for module in paths["modules"][module_name]:
-        if module["type"] == module_type:
-            module[files_dirs].update(files)
-            break
-    else:
-        paths["modules"][module_name].append(
-            {"type": module_type, "files": set(), "dirs": set(), files_dirs: set(files)}
-        )
+    module = paths["module_index"].get((module_name, module_type))
+    if module is None:
+        module = {"type": module_type, "files": set(), "dirs": set()}
+        paths["modules"][module_name].append(module)
+        paths["module_index"][module_name, module_type] = module
+    module[files_dirs].update(files)
 
 
 def add_py_file_to_module(paths, module_name, module_type, path, python_version,
@@ -347,11 +355,94 @@ def is_license_file(path, license_files, license_directories):
     return False
 
 
+class Directory:
+    """
+    One directory in the DirectoryTable.
+
+    path: BuildrootPath of the directory
+    parent: Directory of the parent directory (None for /)
+    in_distinfo: True if this is the dist-info directory or a directory within it
+    sitedir: BuildrootPath of the sitedir this directory is in (or equal to), None if none
+    module_dir: BuildrootPath of the top-level directory within the sitedir (None if not below a sitedir)
+    added: True once the directory was added to the classified paths
+    """
+
+    __slots__ = ("path", "parent", "in_distinfo", "sitedir", "module_dir", "added")
+
+    def __init__(self, path, parent, in_distinfo, sitedir, module_dir):
+        self.path = path
+        self.parent = parent
+        self.in_distinfo = in_distinfo
+        self.sitedir = sitedir
+        self.module_dir = module_dir
+        self.added = False
+
+
+class DirectoryTable:
+    """
+    The directories of the files in one RECORD, each directory is created and classified only once.
+
+    Each directory links to its parent, so the classification of a directory is derived from its parent's
+    and classifying a file doesn't need to walk through all of its parents.
+
+    Example:
+
+        >>> sitelib = BuildrootPath('/usr/lib/python3.14/site-packages')
+        >>> table = DirectoryTable(sitelib / 'foo-1.dist-info', [sitelib])
+        >>> directory = table.get('/usr/lib/python3.14/site-packages/foo/bar')
+        >>> directory.sitedir, directory.module_dir, directory.in_distinfo
+        (BuildrootPath('/usr/lib/python3.14/site-packages'), BuildrootPath('/usr/lib/python3.14/site-packages/foo'), False)
+        >>> table.new_parents(directory, sitelib)
+        [BuildrootPath('/usr/lib/python3.14/site-packages/foo/bar'), BuildrootPath('/usr/lib/python3.14/site-packages/foo')]
+        >>> table.new_parents(table.get('/usr/lib/python3.14/site-packages/foo/baz'), sitelib)
+        [BuildrootPath('/usr/lib/python3.14/site-packages/foo/baz')]
+        >>> table.get('/usr/lib/python3.14/site-packages/foo-1.dist-info/licenses').in_distinfo
+        True
+    """
+
+    def __init__(self, distinfo, sitedirs):
+        self.distinfo = str(distinfo)
+        # the sitedirs are not nested, so a directory is below at most one of them
+        self.sitedirs = {str(sitedir): sitedir for sitedir in sitedirs}
+        self.directories = {}
+
+    def get(self, name):
+        """Return the Directory for a str-path, creating it (and its parents) if needed"""
+        directory = self.directories.get(name)
+        if directory is not None:
+            return directory
+        parent_name = posixpath.dirname(name)
+        parent = self.get(parent_name) if parent_name != name else None
+        path = BuildrootPath(name)
+        in_distinfo = name == self.distinfo or (parent is not None and parent.in_distinfo)
+        if name in self.sitedirs:
+            sitedir, module_dir = self.sitedirs[name], None
+        elif parent is None:
+            sitedir, module_dir = None, None
+        else:
+            sitedir = parent.sitedir
+            module_dir = path if parent.path == sitedir else parent.module_dir
+        directory = self.directories[name] = Directory(path, parent, in_distinfo, sitedir, module_dir)
+        return directory
+
+    def new_parents(self, directory, stop):
+        """
+        Return the not yet added directories from directory upwards until stop (excluded)
+        and mark them as added.
+        """
+        result = []
+        while directory is not None and directory.path != stop and not directory.added:
+            directory.added = True
+            result.append(directory.path)
+            directory = directory.parent
+        return result
+
+
 def classify_paths(
     record_path, parsed_record_content, metadata, sitedirs, python_version, prefix
 ):
     """
-    For each BuildrootPath in parsed_record_content classify it to a dict structure
+    For each str-path or BuildrootPath in parsed_record_content classify it to a dict structure
     that allows to filter the files for the %files and %check section easier.
 
     For the dict structure, look at the beginning of this function's code.
@@ -362,17 +453,19 @@ def classify_paths(
     paths = {
         "metadata": {
             "files": [],  # regular %file entries with dist-info content
-            "dirs": [distinfo],  # %dir %file entries with dist-info directory
+            "dirs": {distinfo: None},  # %dir %file entries with dist-info directory (a dict as an ordered set)
             "docs": [],  # to be used once there is upstream way to recognize READMEs
             "licenses": [],  # %license entries parsed from dist-info METADATA file
         },
         "lang": {}, # %lang entries: [module_name or None][language_code] lists of .mo and .qm files
         "modules": defaultdict(list),  # each importable module (directory, .py, .so)
+        "module_index": {},  # (module name, type) -> the module dict in "modules", for constant time lookups
         "module_names": set(),  # qualified names of each importable module ("foo.bar.baz")
         "other": {"files": []},  # regular %file entries we could not parse :(
     }
 
-    license_files = metadata.get_all('License-File')
+    # a set, so each file in big licenses directories is checked in constant time
+    license_files = set(metadata.get_all('License-File') or ())
     license_directory = distinfo / 'licenses'  # See PEP 639 "Root License Directory"
     # setuptools was the first known build backend to implement License-File.
     # Unfortunately they didn't put licenses to the license directory in setuptools<78:
@@ -380,17 +473,24 @@ def classify_paths(
     # Hence, we check licenses in both licenses and dist-info
     license_directories = (license_directory, distinfo)
 
+    directories = DirectoryTable(distinfo, sitedirs)
+
     # In RECORDs generated by pip, there are no directories, only files.
     # The example RECORD from PEP 376 does not contain directories either.
     # Hence, we'll only assume files, but TODO get it officially documented.
     for path in parsed_record_content:
-        if path.suffix == ".pyc":
+        path = str(path)
+        if path.endswith(".pyc"):
             # we handle bytecode separately
             continue
 
-        if distinfo in path.parents:
-            if path.parent == distinfo and path.name in ("RECORD", "REQUESTED"):
-                # RECORD and REQUESTED files are removed in %pyproject_install
+        directory = directories.get(posixpath.dirname(path))
+        path = BuildrootPath(path)
+        suffix = path.suffix
+
+        if directory.in_distinfo:
+            if directory.path == distinfo and path.name in ("RECORD", "REQUESTED"):
+                # RECORD and REQUESTED files are removed in %pyproject_install anyway
                 # See PEP 627
                 continue
             if is_license_file(path, license_files, license_directories):
@@ -398,55 +498,54 @@ def classify_paths(
             else:
                 paths["metadata"]["files"].append(path)
             # nested directories within distinfo
-            index = path.parents.index(distinfo)
-            for parent in list(path.parents)[:index]:  # no direct slice until Python 3.10
-                if parent not in paths["metadata"]["dirs"]:
-                    paths["metadata"]["dirs"].append(parent)
+            for parent in directories.new_parents(directory, distinfo):
+                paths["metadata"]["dirs"][parent] = None
             continue
 
-        for sitedir in sitedirs:
-            if sitedir in path.parents:
+        if directory.sitedir is not None:
+            sitedir = directory.sitedir
+            if suffix in (".py", ".so"):
                 # Get only the part without sitedir prefix to classify module names
                 relative_path = path.relative_to(sitedir)
                 paths["module_names"].update(module_names_from_path(relative_path))
-                if path.parent == sitedir:
-                    if path.suffix == ".so":
-                        # extension modules can have 2 suffixes
-                        name = BuildrootPath(path.stem).stem
-                        add_file_to_module(paths, name, "extension", "files", path)
-                    elif path.suffix == ".pyi":
-                        name = path.stem
-                        add_file_to_module(paths, name, "stub", "files", path)
-                    elif path.suffix == ".py":
-                        name = path.stem
-                        # we add the .pyc files, but not top-level __pycache__
+            if directory.path == sitedir:
+                if suffix == ".so":
+                    # extension modules can have 2 suffixes
+                    name = BuildrootPath(path.stem).stem
+                    add_file_to_module(paths, name, "extension", "files", path)
+                elif suffix == ".pyi":
+                    name = path.stem
+                    add_file_to_module(paths, name, "stub", "files", path)
+                elif suffix == ".py":
+                    name = path.stem
+                    # we add the .pyc files, but not top-level __pycache__
+                    add_py_file_to_module(
+                        paths, name, "script", path, python_version,
+                        include_pycache_dir=False
+                    )
+                else:
+                    paths["other"]["files"].append(path)
+            else:
+                # this file is inside a dir, we add all dirs upwards until sitedir
+                # (each directory only once, the table knows which ones were added already)
+                module_dir = directory.module_dir
+                parents = directories.new_parents(directory, sitedir)
+                if parents:
+                    add_file_to_module(paths, module_dir.name, "package", "dirs", *parents)
+                is_lang = False
+                if suffix == ".mo" or suffix == ".qm":
+                    is_lang = add_lang_to_module(paths, module_dir.name, path)
+                if not is_lang:
+                    if suffix == ".py":
+                        # we add the .pyc files, and their __pycache__
                         add_py_file_to_module(
-                            paths, name, "script", path, python_version,
-                            include_pycache_dir=False
+                            paths, module_dir.name, "package", path, python_version,
+                            include_pycache_dir=True
                         )
                     else:
-                        paths["other"]["files"].append(path)
-                else:
-                    # this file is inside a dir, we add all dirs upwards until sitedir
-                    index = path.parents.index(sitedir)
-                    module_dir = path.parents[index - 1]
-                    for parent in list(path.parents)[:index]:  # no direct slice until Python 3.10
-                        add_file_to_module(paths, module_dir.name, "package", "dirs", parent)
-                    is_lang = False
-                    if path.suffix == ".mo" or path.suffix == ".qm":
-                        is_lang = add_lang_to_module(paths, module_dir.name, path)
-                    if not is_lang:
-                        if path.suffix == ".py":
-                            # we add the .pyc files, and their __pycache__
-                            add_py_file_to_module(
-                                paths, module_dir.name, "package", path, python_version,
-                                include_pycache_dir=True
-                            )
-                        else:
-                            add_file_to_module(paths, module_dir.name, "package", "files", path)
-                break
+                        add_file_to_module(paths, module_dir.name, "package", "files", path)
         else:
-            if path.suffix == ".mo" or path.suffix == ".qm":
+            if suffix == ".mo" or suffix == ".qm":
                 add_lang_to_module(paths, None, path) or paths["other"]["files"].append(path)
             else:
                 path = normalize_manpage_filename(prefix, path)
@@ -510,16 +609,52 @@ def escape_rpm_path_4_19(path):
         >>> escape_rpm_path_4_19(path)
         '/usr/man/man5/ipykernel.5*'
     """
+    path, suffix = split_glob_suffix(path)
+    return _escape_rpm_str_4_19(path) + suffix
+
+
+def split_glob_suffix(path):
+    """
+    Split the str-path or BuildrootPath to a str without the glob suffix and the glob suffix (see glob_suffix_len)
+    """
     glob_suffix_len = getattr(path, "glob_suffix_len", 0)
-    suffix = ""
     path = str(path)
     if glob_suffix_len:
-        suffix = path[-glob_suffix_len:]
-        path = path[:-glob_suffix_len]
+        return path[:-glob_suffix_len], path[-glob_suffix_len:]
+    return path, ""
+
+
+def _escape_rpm_str_4_19(path):
+    if RPM_ESCAPED_SYMBOLS_4_19.isdisjoint(path):
+        # the common case, nothing to escape
+        return path
     if "%" in path:
         path = path.replace("%", "%%")
     # Prepend all matched/special characters (\1) with a backslash (escaped, hence \\):
-    return RPM_ESCAPE_REGEX.sub(r'\\\1', path) + suffix
+    return RPM_ESCAPE_REGEX.sub(r'\\\1', path)
+
+
+def escape_rpm_paths_4_19(paths, escaped_dirs=None):
+    r"""
+    Escape many string-paths or BuildrootPaths like escape_rpm_path_4_19(), yield the results in order.
+
+    The escaping is done character by character, so each path is escaped as its directory and its name.
+    Each directory is only escaped once, pass the same escaped_dirs dict to share them between calls.
+
+    Example:
+
+        >>> list(escape_rpm_paths_4_19(['/spa ces/a', '/spa ces/b c', '/spa ces', '/']))
+        ['/spa\\ ces/a', '/spa\\ ces/b\\ c', '/spa\\ ces', '/']
+    """
+    if escaped_dirs is None:
+        escaped_dirs = {}
+    for path in paths:
+        path, suffix = split_glob_suffix(path)
+        directory, slash, name = path.rpartition("/")
+        escaped_dir = escaped_dirs.get(directory)
+        if escaped_dir is None:
+            escaped_dir = escaped_dirs[directory] = _escape_rpm_str_4_19(directory)
+        yield escaped_dir + slash + _escape_rpm_str_4_19(name) + suffix
 
 
 def escape_rpm_path_4_18(path):
@@ -563,6 +698,9 @@ def escape_rpm_path_4_18(path):
         NotImplementedError: ...
     """
     orig_path = path = str(path)
+    if RPM_ESCAPED_SYMBOLS_4_18.isdisjoint(path):
+        # the common case, nothing to escape
+        return path
     if "%" in path:
         # Escaping an actual percentage sign in path by 8 signs
         # has been verified in RPM 4.16 and 4.17:
@@ -580,14 +718,62 @@ def escape_rpm_path_4_18(path):
     return path
 
 
+def escape_rpm_paths_4_18(paths, escaped_dirs=None):
+    """
+    Escape many string-paths or BuildrootPaths like escape_rpm_path_4_18(), yield the results in order.
+
+    RPM < 4.19 quotes whole paths, so the directories cannot be escaped separately,
+    escaped_dirs is unused, it is accepted for compatibility with escape_rpm_paths_4_19().
+    """
+    return map(escape_rpm_path_4_18, paths)
+
+
 if RPM_FILES_ESCAPE == "4.19":
     escape_rpm_path = escape_rpm_path_4_19
+    escape_rpm_paths = escape_rpm_paths_4_19
 elif RPM_FILES_ESCAPE == "4.18":
     escape_rpm_path = escape_rpm_path_4_18
+    escape_rpm_paths = escape_rpm_paths_4_18
 else:
     raise RuntimeError("RPM_FILES_ESCAPE must be 4.18 or 4.19")
 
 
+def match_globs(names, globs):
+    """
+    Match the names (a dict or a set, for fast lookups) with the shell-like globs,
+    like fnmatch.fnmatchcase() does.
+
+    Returns a set of the names matching any of the globs
+    and a set of the globs matching any of the names.
+
+    Globs without wildcards are looked up directly, the others are combined into one regular expression,
+    so each name is only matched once, regardless of the number of globs.
+
+    Examples:
+
+        >>> matched, done = match_globs(['foo', 'foobar', 'baz', 'qux'], {'foo*', 'baz', 'nope', 'no*'})
+        >>> sorted(matched), sorted(done)
+        (['baz', 'foo', 'foobar'], ['baz', 'foo*'])
+
+        >>> matched, done = match_globs(['a.b', '[x]'], {'a?b', '[[]x]'})
+        >>> sorted(matched), sorted(done)
+        (['[x]', 'a.b'], ['[[]x]', 'a?b'])
+    """
+    literal_globs = {glob for glob in globs if not any(symbol in glob for symbol in '*?[')}
+    pattern_globs = {glob: re.compile(fnmatch.translate(glob)) for glob in sorted(set(globs) - literal_globs)}
+
+    matched = {glob for glob in literal_globs if glob in names}
+    done_globs = set(matched)
+    if pattern_globs:
+        combined = re.compile('|'.join(f'(?:{pattern.pattern})' for pattern in pattern_globs.values()))
+        pattern_matched = {name for name in names if combined.match(name)}
+        matched |= pattern_matched
+        # each glob that matches any name matches one of the (usually few) matched names
+        done_globs.update(glob for glob, pattern in pattern_globs.items()
+                          if any(pattern.match(name) for name in pattern_matched))
+    return matched, done_globs
+
+
 def generate_file_list(paths_dict, module_globs, include_others=False):
     """
     This function takes the classified paths_dict and turns it into lines
@@ -600,37 +786,36 @@ def generate_file_list(paths_dict, module_globs, include_others=False):
     Multiple globs matching identical module(s) are OK.
     """
     files = set()
+    # each directory is escaped only once for all the paths
+    escaped_dirs = {}
+
+    def escape(paths, prefix=""):
+        return (f"{prefix}{p}" for p in escape_rpm_paths(paths, escaped_dirs))
 
     if include_others:
-        files.update(f"{escape_rpm_path(p)}" for p in paths_dict["other"]["files"])
+        files.update(escape(paths_dict["other"]["files"]))
         try:
             for lang_code in paths_dict["lang"][None]:
-                files.update(f"%lang({lang_code}) {escape_rpm_path(p)}" for p in paths_dict["lang"][None][lang_code])
+                files.update(escape(paths_dict["lang"][None][lang_code], f"%lang({lang_code}) "))
         except KeyError:
             pass
 
-    files.update(f"{escape_rpm_path(p)}" for p in paths_dict["metadata"]["files"])
+    files.update(escape(paths_dict["metadata"]["files"]))
     for macro in "dir", "doc", "license":
-        files.update(f"%{macro} {escape_rpm_path(p)}" for p in paths_dict["metadata"][f"{macro}s"])
+        files.update(escape(paths_dict["metadata"][f"{macro}s"], f"%{macro} "))
 
     modules = paths_dict["modules"]
-    done_modules = set()
-    done_globs = set()
-
-    for glob in module_globs:
-        for name in modules:
-            if fnmatch.fnmatchcase(name, glob):
-                if name not in done_modules:
-                    try:
-                        for lang_code in paths_dict["lang"][name]:
-                            files.update(f"%lang({lang_code}) {escape_rpm_path(p)}" for p in paths_dict["lang"][name][lang_code])
-                    except KeyError:
-                        pass
-                    for module in modules[name]:
-                        files.update(f"%dir {escape_rpm_path(p)}" for p in module["dirs"])
-                        files.update(f"{escape_rpm_path(p)}" for p in module["files"])
-                    done_modules.add(name)
-                done_globs.add(glob)
+    done_modules, done_globs = match_globs(modules, module_globs)
+
+    for name in done_modules:
+        try:
+            for lang_code in paths_dict["lang"][name]:
+                files.update(escape(paths_dict["lang"][name][lang_code], f"%lang({lang_code}) "))
+        except KeyError:
+            pass
+        for module in modules[name]:
+            files.update(escape(module["dirs"], "%dir "))
+            files.update(escape(module["files"]))
 
     # Users using '*' don't care about the files in the package, so it's ok
     # not to fail the build when no modules are detected
@@ -679,17 +864,14 @@ def generate_module_list(paths_dict, module_globs):
         []
     """
 
-    module_names = paths_dict['module_names']
-    filtered_module_names = set()
+    # Match the top-level part of the qualified name, eg. 'foo.bar.baz' -> 'foo'
+    # each top-level name only once
+    module_names = defaultdict(list)
+    for name in paths_dict['module_names']:
+        module_names[name.partition('.')[0]].append(name)
 
-    for glob in module_globs:
-        for name in module_names:
-            # Match the top-level part of the qualified name, eg. 'foo.bar.baz' -> 'foo'
-            top_level_name = name.split('.')[0]
-            if fnmatch.fnmatchcase(top_level_name, glob):
-                filtered_module_names.add(name)
-
-    return sorted(filtered_module_names)
+    top_level_names, _ = match_globs(module_names, module_globs)
+    return sorted(name for top_level_name in top_level_names for name in module_names[top_level_name])
 
 
 def parse_varargs(varargs):
@@ -779,37 +961,69 @@ def parse_varargs(varargs):
     return globs, include_auto
 
 
-def load_parsed_record(pyproject_record, dist_name=None):
-    parsed_record = {}
-    with open(pyproject_record) as pyproject_record_file:
-        content = json.load(pyproject_record_file)
+def read_parsed_records(pyproject_record):
+    """
+    Yield (record path, list of paths) pairs from %{_pyproject_record}, one line at a time.
+
+    Each line is a JSON object, usually with a single record.
+    In the old format, there is just one line with all the records.
+    """
+    with open(pyproject_record, encoding='utf-8') as pyproject_record_file:
+        for line in pyproject_record_file:
+            if line.strip():
+                yield from json.loads(line).items()
+
+
+def load_parsed_records(pyproject_record):
+    """
+    Returns all the records from %{_pyproject_record}
+    as a dict of record paths (BuildrootPaths) to lists of paths.
+
+    Only the record paths are redefined to BuildrootPaths,
+    the files stay strings until classify_paths() needs them.
+    """
+    # when a dist-info was recorded more than once, the last record wins
+    return {BuildrootPath(record_path): files
+            for record_path, files in read_parsed_records(pyproject_record)}
+
 
-    # Map each record path to its canonical dist name
-    dist_names = {rp: canonical_name_from_distinfo(BuildrootPath(rp).parent.name)
-                  for rp in content}
+def select_parsed_record(parsed_records, dist_names, dist_name=None):
+    """
+    Select the records of the given dist name from all the parsed records,
+    dist_names maps each record path to its canonical dist name.
+
+    Without a dist name, there must be exactly one record.
+    """
     available = sorted(dist_names.values())  # used in error messages
 
     if dist_name:
         normalized_target = canonicalize_name(dist_name)
-        content = {rp: files for rp, files in content.items()
-                   if dist_names[rp] == normalized_target}
-        if not content:
+        selected = {rp: files for rp, files in parsed_records.items()
+                    if dist_names[rp] == normalized_target}
+        if not selected:
             raise ValueError(
                 f"No dist-info found matching dist name '{dist_name}'. "
                 f"Available: {', '.join(available)}"
             )
-    elif len(content) > 1:
+        return selected
+
+    if len(parsed_records) > 1:
         raise ValueError(
             "%pyproject_install has found more than one *.dist-info/RECORD file. "
             "Use %pyproject_save_files -D <name> to select a package. "
             f"Available: {', '.join(available)}"
         )
+    return parsed_records
 
-    # Redefine strings stored in JSON to BuildRootPaths
-    for record_path, files in content.items():
-        parsed_record[BuildrootPath(record_path)] = [BuildrootPath(f) for f in files]
 
-    return parsed_record
+def record_dist_names(parsed_records):
+    """Map each record path to its canonical dist name"""
+    return {rp: canonical_name_from_distinfo(rp.parent.name) for rp in parsed_records}
+
+
+def load_parsed_record(pyproject_record, dist_name=None):
+    parsed_records = load_parsed_records(pyproject_record)
+    return select_parsed_record(parsed_records, record_dist_names(parsed_records), dist_name)
 
 
 def dist_metadata(buildroot, record_path):
@@ -821,20 +1035,11 @@ def dist_metadata(buildroot, record_path):
     return dist.metadata
 
 
-def pyproject_save_files_and_modules(buildroot, sitelib, sitearch, python_version, pyproject_record, prefix, assert_license, allow_no_modules, auto, varargs, dist_name=None):
+def module_globs(varargs, auto, allow_no_modules):
     """
-    Takes arguments from the %{pyproject_save_files} macro
-
-    Returns tuple: list of paths for the %files section, list of module names
-    for the %check section, and list of record paths (BuildrootPaths)
-
-    Raises ValueError when assert_license is true and no License-File (PEP 639)
-    is found.
+    Returns the module globs and whether to include the other files,
+    raises ValueError when the globs don't match allow_no_modules
     """
-    # On 32 bit architectures, sitelib equals to sitearch
-    # This saves us browsing one directory twice
-    sitedirs = sorted({sitelib, sitearch})
-
     globs, include_auto = parse_varargs(varargs)
     include_auto = include_auto or auto
     if not globs and not allow_no_modules:
@@ -846,19 +1051,53 @@ def pyproject_save_files_and_modules(buildroot, sitelib, sitearch, python_versio
         raise ValueError(
             "%pyproject_save_files -M cannot be used together with module globs."
         )
-    parsed_records = load_parsed_record(pyproject_record, dist_name)
+    return globs, include_auto
+
+
+def classify_record(buildroot, record_path, files, sitedirs, python_version, prefix):
+    metadata = dist_metadata(buildroot, record_path)
+    return classify_paths(
+        record_path, files, metadata, sitedirs, python_version, prefix
+    )
+
+
+def classify_records(buildroot, parsed_records, sitedirs, python_version, prefix, jobs=1):
+    """
+    Classify the paths of all the given records, in a process pool when jobs > 1.
 
+    Returns a dict of record paths to classified paths, in the order of parsed_records.
+    """
+    jobs = min(jobs, len(parsed_records))
+    if jobs <= 1:
+        return {
+            record_path: classify_record(buildroot, record_path, files, sitedirs, python_version, prefix)
+            for record_path, files in parsed_records.items()
+        }
+    with concurrent.futures.ProcessPoolExecutor(max_workers=jobs) as executor:
+        futures = {
+            record_path: executor.submit(
+                classify_record, buildroot, record_path, files, sitedirs, python_version, prefix
+            )
+            for record_path, files in parsed_records.items()
+        }
+        return {record_path: future.result() for record_path, future in futures.items()}
+
+
+def files_and_modules(paths_dicts, globs, include_auto, assert_license):
+    """
+    Returns tuple: list of paths for the %files section and list of module names
+    for the %check section, generated from the given classified records
+
+    Raises ValueError when assert_license is true and no License-File (PEP 639)
+    is found.
+    """
     final_file_list = []
     final_module_list = []
 
     # we assume OK when not asserting
     license_ok = not assert_license
 
-    for record_path, files in parsed_records.items():
-        metadata = dist_metadata(buildroot, record_path)
-        paths_dict = classify_paths(
-            record_path, files, metadata, sitedirs, python_version, prefix
-        )
+    for paths_dict in paths_dicts:
         license_ok = license_ok or bool(paths_dict["metadata"]["licenses"])
 
         final_file_list.extend(
@@ -877,10 +1116,113 @@ def pyproject_save_files_and_modules(buildroot, sitelib, sitearch, python_versio
             "and include the %license file in %files manually."
         )
 
+    return final_file_list, final_module_list
+
+
+def pyproject_save_files_and_modules(buildroot, sitelib, sitearch, python_version, pyproject_record, prefix, assert_license, allow_no_modules, auto, varargs, dist_name=None, jobs=1):
+    """
+    Takes arguments from the %{pyproject_save_files} macro
+
+    Returns tuple: list of paths for the %files section, list of module names
+    for the %check section, and list of record paths (BuildrootPaths)
+
+    Raises ValueError when assert_license is true and no License-File (PEP 639)
+    is found.
+    """
+    # On 32 bit architectures, sitelib equals to sitearch
+    # This saves us browsing one directory twice
+    sitedirs = sorted({sitelib, sitearch})
+
+    globs, include_auto = module_globs(varargs, auto, allow_no_modules)
+    parsed_records = load_parsed_record(pyproject_record, dist_name)
+
+    classified = classify_records(
+        buildroot, parsed_records, sitedirs, python_version, prefix, jobs
+    )
+    final_file_list, final_module_list = files_and_modules(
+        classified.values(), globs, include_auto, assert_license
+    )
     return final_file_list, final_module_list, list(parsed_records)
 
 
+def pyproject_save_files_batch(buildroot, sitelib, sitearch, python_version, pyproject_record, prefix, batch, jobs=1):
+    """
+    Takes arguments from the %{pyproject_save_files_batch} macro,
+    batch is a list of parsed %{pyproject_save_files} options, each with a dist name
+
+    %{_pyproject_record} is loaded once and every selected dist-info is classified once.
+
+    Returns list of tuples: canonical dist name, list of paths for the %files section
+    and list of module names for the %check section, in the order of batch
+    """
+    sitedirs = sorted({sitelib, sitearch})
+
+    parsed_records = load_parsed_records(pyproject_record)
+    dist_names = record_dist_names(parsed_records)
+    selections = []
+    to_classify = {}
+
+    for options in batch:
+        if not options.dist_name:
+            raise ValueError(
+                "%pyproject_save_files_batch requires -D <name> in every set of arguments."
+            )
+        globs, include_auto = module_globs(options.varargs, options.auto, options.allow_no_modules)
+        selected = select_parsed_record(parsed_records, dist_names, options.dist_name)
+        to_classify.update(selected)
+        selections.append((options, globs, include_auto, selected))
+
+    classified = classify_records(
+        buildroot, to_classify, sitedirs, python_version, prefix, jobs
+    )
+
+    results = []
+    for options, globs, include_auto, selected in selections:
+        file_list, module_list = files_and_modules(
+            [classified[record_path] for record_path in selected],
+            globs, include_auto, options.assert_license,
+        )
+        results.append((canonicalize_name(options.dist_name), file_list, module_list))
+
+    return results
+
+
+def write_outputs(output_files, output_modules, file_section, module_names):
+    output_files.write_text("\n".join(file_section) + "\n", encoding="utf-8")
+    output_modules.write_text("\n".join(module_names) + "\n", encoding="utf-8")
+
+
+def main_batch(cli_args):
+    if cli_args.dist_name or cli_args.assert_license or cli_args.allow_no_modules or cli_args.auto:
+        raise ValueError(
+            "%pyproject_save_files_batch only accepts options within the quoted sets of arguments."
+        )
+    batch = [options_argparser(prog="%pyproject_save_files_batch").parse_args(shlex.split(arguments))
+             for arguments in cli_args.varargs]
+    results = pyproject_save_files_batch(
+        cli_args.buildroot,
+        cli_args.sitelib,
+        cli_args.sitearch,
+        cli_args.python_version,
+        cli_args.pyproject_record,
+        cli_args.prefix,
+        batch,
+        cli_args.jobs,
+    )
+    # --output-files and --output-modules are the bases of %{pyproject_files -D name}
+    for normalized, file_section, module_names in results:
+        write_outputs(
+            PosixPath(f"{cli_args.output_files}-{normalized}"),
+            PosixPath(f"{cli_args.output_modules}-{normalized}"),
+            file_section,
+            module_names,
+        )
+
+
 def main(cli_args):
+    if cli_args.batch:
+        return main_batch(cli_args)
+
     file_section, module_names, record_paths = pyproject_save_files_and_modules(
         cli_args.buildroot,
         cli_args.sitelib,
@@ -893,47 +1235,31 @@ def main(cli_args):
         cli_args.auto,
         cli_args.varargs,
         cli_args.dist_name,
+        cli_args.jobs,
     )
 
-    files_text = "\n".join(file_section) + "\n"
-    modules_text = "\n".join(module_names) + "\n"
-
-    cli_args.output_files.write_text(files_text, encoding="utf-8")
-    cli_args.output_modules.write_text(modules_text, encoding="utf-8")
+    write_outputs(cli_args.output_files, cli_args.output_modules, file_section, module_names)
 
     # When no -D was given, also write to the named path (derived from dist-info)
     # so that %{pyproject_files -D name} works even without -D in %pyproject_save_files
     if not cli_args.dist_name:
         record_path = record_paths[0]
         normalized = canonical_name_from_distinfo(record_path.parent.name)
-        named_files = PosixPath(f"{cli_args.output_files}-{normalized}")
-        named_modules = PosixPath(f"{cli_args.output_modules}-{normalized}")
-        named_files.write_text(files_text, encoding="utf-8")
-        named_modules.write_text(modules_text, encoding="utf-8")
+        write_outputs(
+            PosixPath(f"{cli_args.output_files}-{normalized}"),
+            PosixPath(f"{cli_args.output_modules}-{normalized}"),
+            file_section,
+            module_names,
+        )
 
 
-def argparser():
+def options_argparser(**kwargs):
+    """The user-facing options of %pyproject_save_files, also used for each set of arguments in batch mode"""
     parser = argparse.ArgumentParser(
-        description="Create %{pyproject_files} for a Python project.",
-        prog="%pyproject_save_files",
-        add_help=False,
         # custom usage to add +auto
         usage="%(prog)s  [-l|-L] [-a|+auto] MODULE_GLOB|-M [MODULE_GLOB ...]",
+        **kwargs,
     )
-    parser.add_argument(
-        '--help', action='help',
-        default=argparse.SUPPRESS,
-        help=argparse.SUPPRESS,
-    )
-    r = parser.add_argument_group("required arguments")
-    r.add_argument("--output-files", type=PosixPath, required=True, help=argparse.SUPPRESS)
-    r.add_argument("--output-modules", type=PosixPath, required=True, help=argparse.SUPPRESS)
-    r.add_argument("--buildroot", type=PosixPath, required=True, help=argparse.SUPPRESS)
-    r.add_argument("--sitelib", type=BuildrootPath, required=True, help=argparse.SUPPRESS)
-    r.add_argument("--sitearch", type=BuildrootPath, required=True, help=argparse.SUPPRESS)
-    r.add_argument("--python-version", type=str, required=True, help=argparse.SUPPRESS)
-    r.add_argument("--pyproject-record", type=PosixPath, required=True, help=argparse.SUPPRESS)
-    r.add_argument("--prefix", type=PosixPath, required=True, help=argparse.SUPPRESS)
     parser.add_argument(
         "-l", "--assert-license", action="store_true", default=False,
         help="Fail when no License-File (PEP 639) is found.",
@@ -961,6 +1287,37 @@ def argparser():
     return parser
 
 
+def argparser():
+    parser = options_argparser(
+        description="Create %{pyproject_files} for a Python project.",
+        prog="%pyproject_save_files",
+        add_help=False,
+    )
+    parser.add_argument(
+        '--help', action='help',
+        default=argparse.SUPPRESS,
+        help=argparse.SUPPRESS,
+    )
+    r = parser.add_argument_group("required arguments")
+    r.add_argument("--output-files", type=PosixPath, required=True, help=argparse.SUPPRESS)
+    r.add_argument("--output-modules", type=PosixPath, required=True, help=argparse.SUPPRESS)
+    r.add_argument("--buildroot", type=PosixPath, required=True, help=argparse.SUPPRESS)
+    r.add_argument("--sitelib", type=BuildrootPath, required=True, help=argparse.SUPPRESS)
+    r.add_argument("--sitearch", type=BuildrootPath, required=True, help=argparse.SUPPRESS)
+    r.add_argument("--python-version", type=str, required=True, help=argparse.SUPPRESS)
+    r.add_argument("--pyproject-record", type=PosixPath, required=True, help=argparse.SUPPRESS)
+    r.add_argument("--prefix", type=PosixPath, required=True, help=argparse.SUPPRESS)
+    parser.add_argument(
+        "-j", "--jobs", type=int, default=1,
+        help="Classify the files of up to JOBS packages in parallel.",
+    )
+    # Used by %pyproject_save_files_batch:
+    # each MODULE_GLOB is then a whole set of %pyproject_save_files arguments,
+    # and --output-files/--output-modules are the bases for the -D outputs
+    parser.add_argument("--batch", action="store_true", default=False, help=argparse.SUPPRESS)
+    return parser
+
+
 if __name__ == "__main__":
     cli_args = argparser().parse_args()
     main(cli_args)
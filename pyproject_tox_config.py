@@ -0,0 +1,445 @@
+"""Read the deps, extras and dependency groups of tox environments without running tox.
+
+Used by %pyproject_buildrequires -t/-e instead of tox with the tox-current-env plugin.
+Only the commonly used subset of the tox 4 configuration is understood:
+
+ - tox.ini, legacy_tox_ini in pyproject.toml, [tool.tox] in pyproject.toml and tox.toml
+   in the current directory,
+ - factor-conditional lines (e.g. py312: foo) in the ini format,
+ - the {[section]key}, {toxinidir} and {tox_root} substitutions,
+ - the [testenv] ([env_run_base]) defaults of the test environments.
+
+For everything else, UnsupportedConfig is raised and tox needs to be run instead.
+The outputs mimic the files written by tox --print-deps-to, --print-extras-to,
+--print-dependency-groups-to and --no-provision.
+"""
+
+import configparser
+import json
+import os
+import re
+import sys
+from pathlib import Path
+
+try:
+    # tomllib is in the standard library since 3.11.0b1
+    import tomllib
+except ImportError:
+    import tomli as tomllib
+
+from packaging.requirements import InvalidRequirement, Requirement
+from packaging.utils import canonicalize_name
+from packaging.version import InvalidVersion, Version
+
+
+class UnsupportedConfig(Exception):
+    """The configuration uses something only tox itself can evaluate"""
+
+
+# Environment variables changing where tox looks for the configuration or overriding it
+TOX_ENVIRON = ('OVERRIDE', 'CONFIG_FILE', 'ROOT_DIR')
+
+# The environments tox knows without any configuration, e.g. py3, py312 or pypy3.11
+PYTHON_ENV_RE = re.compile(r'(py|pypy|cpython)(\d(\.?\d+)?)?')
+
+# Newer tox versions treat architecture factors specially, we let tox handle them
+ARCHITECTURES = {
+    'amd64', 'aarch64', 'arm64', 'i386', 'i486', 'i586', 'i686', 'loongarch64',
+    'powerpc', 'powerpc64', 'powerpc64le', 'ppc', 'ppc64', 'ppc64le',
+    'riscv64', 's390x', 'sparc64', 'sparcv9', 'x86', 'x86_64',
+}
+
+# tox 4 comments: whitespace followed by a # not preceded by a backslash
+COMMENT_RE = re.compile(r'(\s)*(?<!\\)#.*')
+
+# The separator of the factor conditions and the content, e.g. py312: foo
+FACTOR_MARKER_RE = re.compile(r':(\s|$)')
+
+FACTOR_RE = re.compile(r'!?[\w.*?][\w.*?-]*')
+
+# The substitutions, e.g. {[testenv]deps} or {toxinidir}
+SUBSTITUTION_RE = re.compile(r'\{([^{}]*)\}')
+SECTION_REFERENCE_RE = re.compile(r'\[(?P<section>[^\[\]]+)\](?P<key>\w+)')
+
+
+def factor_groups(condition):
+    """
+    Parse the factor condition of a line (the part before the colon)
+    to a list of alternatives, each a list of (factor, negated) pairs.
+
+    Return None if it is not a condition (tox takes such lines as they are).
+
+        >>> factor_groups('py312,!py3-django')
+        [[('py312', False)], [('py3', True), ('django', False)]]
+
+        >>> factor_groups('not a factor') is None
+        True
+    """
+    if not condition:
+        raise UnsupportedConfig('empty factor condition')
+    if '{' in condition or '}' in condition or re.search(r'(?<![\w.])\d', condition):
+        raise UnsupportedConfig(f'generative factor condition: {condition}')
+    groups = []
+    for alternative in condition.split(','):
+        alternative = alternative.strip()
+        if not alternative:
+            continue
+        factors = alternative.split('-')
+        if not all(FACTOR_RE.fullmatch(factor) for factor in factors):
+            return None
+        group = []
+        for factor in factors:
+            negated = factor.startswith('!')
+            name = factor[1:] if negated else factor
+            if name.lower() in ARCHITECTURES:
+                raise UnsupportedConfig(f'architecture factor condition: {condition}')
+            group.append((name, negated))
+        groups.append(group)
+    return groups
+
+
+def env_factors(envname):
+    """
+    The factors of the environment a factor condition is evaluated against
+
+        >>> sorted(env_factors('py312-django')) == sorted(['py312', 'django', sys.platform])
+        True
+    """
+    factors = set(envname.split('-')) if envname is not None else set()
+    if any(factor.lower() in ARCHITECTURES for factor in factors):
+        raise UnsupportedConfig(f'architecture factor in environment name: {envname}')
+    factors.add(sys.platform)
+    return factors
+
+
+def process_ini_value(value, factors):
+    """
+    Strip the comments and the lines whose factor conditions do not match.
+
+    Return None if all the (non-empty) lines were filtered out,
+    tox looks for the key in the base section then.
+
+        >>> process_ini_value('\\nfoo  # comment\\npy312: bar\\n!py312: baz', {'py312'})
+        'foo\\nbar'
+        >>> process_ini_value('py311: bar', {'py312'}) is None
+        True
+    """
+    lines = []
+    for line in value.split('\n'):
+        if line.startswith('#'):
+            continue
+        line = COMMENT_RE.sub('', line).replace('\\#', '#').replace('\r', '')
+        if line.endswith('\\'):
+            raise UnsupportedConfig(f'line continuation: {line}')
+        lines.append(line)
+    filtered = []
+    for line in lines:
+        marker = FACTOR_MARKER_RE.search(line)
+        groups = marker and factor_groups(line[:marker.start()].strip())
+        if groups is None:
+            if line:
+                filtered.append(line)
+        elif any(all((name in factors) ^ negated for name, negated in group) for group in groups):
+            filtered.append(line[marker.start() + 1:].strip())
+    if not filtered and '\n'.join(lines).strip():
+        return None
+    return '\n'.join(filtered)
+
+
+def split_set(value):
+    """
+    Split the value of a set option (such as extras) the way tox does
+
+        >>> split_set('a, b')
+        ['a', 'b']
+        >>> split_set('\\na,b\\nc')
+        ['a,b', 'c']
+    """
+    separator = '\n' if '\n' in value else ','
+    return [item.strip() for item in value.split(separator) if item.strip()]
+
+
+def parse_requires(values):
+    """Parse the tox requires, tox itself only runs if they are satisfied"""
+    try:
+        return [Requirement(value) for value in values]
+    except InvalidRequirement as e:
+        raise UnsupportedConfig(f'invalid requires: {e}')
+
+
+def deps_lines(lines):
+    """
+    Check the lines of deps are requirements (or requirement files)
+    and normalize them like tox --print-deps-to does.
+
+        >>> deps_lines(['', 'foo >= 1', '-rrequirements.txt'])
+        ['foo >= 1', '-r requirements.txt']
+    """
+    result = []
+    for line in lines:
+        line = line.strip()
+        if not line:
+            continue
+        if line.startswith('-r'):
+            line = f'-r {line[2:].strip()}'
+        elif line.startswith('-') or '#' in line:
+            raise UnsupportedConfig(f'deps option: {line}')
+        else:
+            try:
+                Requirement(line)
+            except InvalidRequirement:
+                raise UnsupportedConfig(f'deps line that is not a requirement: {line}')
+        result.append(line)
+    return result
+
+
+class IniConfig:
+    """The tox.ini format (also used by legacy_tox_ini in pyproject.toml)"""
+
+    def __init__(self, content, root):
+        self.root = root
+        self.parser = configparser.ConfigParser(interpolation=None)
+        try:
+            self.parser.read_string(content)
+        except configparser.Error as e:
+            raise UnsupportedConfig(f'cannot parse the configuration: {e}')
+        for section in (self.parser.default_section, *self.parser.sections()):
+            if '{' in section or '}' in section:
+                raise UnsupportedConfig(f'generative section: {section}')
+            if 'base' in self.parser[section]:
+                raise UnsupportedConfig(f'base in section: {section}')
+
+    def get(self, section, keys, factors):
+        """The processed value of the first key in the section (or its default), None if not set"""
+        if not self.parser.has_section(section):
+            section = self.parser.default_section
+        for key in keys:
+            if key in self.parser[section]:
+                value = process_ini_value(self.parser[section][key], factors)
+                if value is not None:
+                    return value
+        return None
+
+    def core(self, *keys):
+        value = self.get('tox', keys, env_factors(None))
+        if value is not None and ('{' in value or '}' in value):
+            raise UnsupportedConfig(f'substitution in the [tox] section: {value}')
+        return value
+
+    def requires(self):
+        return split_set(self.core('requires') or '')
+
+    def min_version(self):
+        return self.core('min_version', 'minversion')
+
+    def has_env(self, envname):
+        envlist = split_set(self.core('env_list', 'envlist') or '')
+        return envname in envlist or self.parser.has_section(f'testenv:{envname}')
+
+    def env(self, envname, key):
+        """The value of the key for the environment, substituted"""
+        factors = env_factors(envname)
+        for section in (f'testenv:{envname}', 'testenv'):
+            value = self.get(section, (key,), factors)
+            if value is not None:
+                return self.substitute(value, factors)
+        return ''
+
+    def substitute(self, value, factors, depth=0):
+        if depth > 10:
+            raise UnsupportedConfig(f'too deep substitution: {value}')
+        parts = SUBSTITUTION_RE.split(value)
+        # the odd parts are the contents of the braces
+        for literal in parts[::2]:
+            if '{' in literal or '}' in literal or literal.endswith('\\'):
+                raise UnsupportedConfig(f'unsupported braces: {value}')
+        for i in range(1, len(parts), 2):
+            if parts[i] in ('toxinidir', 'tox_root'):
+                parts[i] = str(self.root)
+            elif match := SECTION_REFERENCE_RE.fullmatch(parts[i]):
+                section, key = match['section'], match['key']
+                if not (self.parser.has_section(section) and key in self.parser[section]):
+                    raise UnsupportedConfig(f'reference to an unset key: {{{parts[i]}}}')
+                referenced = process_ini_value(self.parser[section][key], factors)
+                if referenced is None:
+                    raise UnsupportedConfig(f'reference to a filtered out key: {{{parts[i]}}}')
+                parts[i] = self.substitute(referenced, factors, depth + 1)
+            else:
+                raise UnsupportedConfig(f'unsupported substitution: {{{parts[i]}}}')
+        return ''.join(parts)
+
+    def deps(self, envname):
+        return deps_lines(self.env(envname, 'deps').split('\n'))
+
+    def names(self, envname, key):
+        return split_set(self.env(envname, key))
+
+
+class TomlConfig:
+    """The native TOML format of tox.toml and [tool.tox] in pyproject.toml"""
+
+    def __init__(self, content, root):
+        self.root = root
+        self.content = content
+        for key in ('env_base', 'base'):
+            if key in content:
+                raise UnsupportedConfig(f'{key} in the configuration')
+        self.envs = content.get('env', {})
+        self.run_base = content.get('env_run_base', {})
+        if not (isinstance(self.envs, dict) and isinstance(self.run_base, dict) and
+                all(isinstance(env, dict) for env in self.envs.values())):
+            raise UnsupportedConfig('environments that are not tables')
+        if any('base' in table for table in (self.run_base, *self.envs.values())):
+            raise UnsupportedConfig('base in an environment')
+
+    @staticmethod
+    def strings(value, key):
+        if not (isinstance(value, list) and all(isinstance(item, str) for item in value)):
+            raise UnsupportedConfig(f'{key} is not a list of strings: {value!r}')
+        return value
+
+    def core(self, *keys):
+        for key in keys:
+            if key in self.content:
+                return self.content[key]
+        return None
+
+    def requires(self):
+        return self.strings(self.core('requires') or [], 'requires')
+
+    def min_version(self):
+        value = self.core('min_version', 'minversion')
+        return None if value is None else str(value)
+
+    def has_env(self, envname):
+        return envname in self.envs or envname in self.strings(self.core('env_list') or [], 'env_list')
+
+    def env(self, envname, key):
+        for table in (self.envs.get(envname, {}), self.run_base):
+            if key in table:
+                return [self.substitute(item) for item in self.strings(table[key], key)]
+        return []
+
+    def substitute(self, value):
+        def replace(match):
+            if match[1] in ('toxinidir', 'tox_root'):
+                return str(self.root)
+            raise UnsupportedConfig(f'unsupported substitution: {match[0]}')
+        value = SUBSTITUTION_RE.sub(replace, value)
+        if '{' in value or '}' in value:
+            raise UnsupportedConfig(f'unsupported braces: {value}')
+        return value
+
+    def deps(self, envname):
+        return deps_lines(line for item in self.env(envname, 'deps') for line in item.split('\n'))
+
+    def names(self, envname, key):
+        return [item.strip() for item in self.env(envname, key) if item.strip()]
+
+
+def load_toml(path):
+    try:
+        with open(path, 'rb') as f:
+            return tomllib.load(f)
+    except tomllib.TOMLDecodeError as e:
+        raise UnsupportedConfig(f'cannot parse {path.name}: {e}')
+
+
+def load_config(root=Path('.')):
+    """
+    Load the tox configuration from root, the way tox 4 discovers it.
+
+    Only the files in root are considered, tox also looks in the parent directories.
+    """
+    for name in TOX_ENVIRON:
+        if f'TOX_{name}' in os.environ or f'TOX{name}' in os.environ:
+            raise UnsupportedConfig(f'TOX_{name} is set')
+    root = root.absolute()
+    if (root / 'tox.ini').exists():
+        return IniConfig((root / 'tox.ini').read_text(encoding='utf-8'), root)
+    if (root / 'setup.cfg').exists():
+        setup_cfg = configparser.ConfigParser(interpolation=None)
+        try:
+            setup_cfg.read(root / 'setup.cfg', encoding='utf-8')
+        except configparser.Error as e:
+            raise UnsupportedConfig(f'cannot parse setup.cfg: {e}')
+        if setup_cfg.has_section('tox:tox'):
+            raise UnsupportedConfig('configuration in setup.cfg')
+    if (root / 'pyproject.toml').exists():
+        tool_tox = load_toml(root / 'pyproject.toml').get('tool', {}).get('tox')
+        if isinstance(tool_tox, dict) and set(tool_tox) - {'legacy_tox_ini'}:
+            return TomlConfig(tool_tox, root)
+        if isinstance(tool_tox, dict) and 'legacy_tox_ini' in tool_tox:
+            if not isinstance(tool_tox['legacy_tox_ini'], str):
+                raise UnsupportedConfig('legacy_tox_ini is not a string')
+            return IniConfig(tool_tox['legacy_tox_ini'], root)
+    if (root / 'tox.toml').exists():
+        return TomlConfig(load_toml(root / 'tox.toml'), root)
+    raise UnsupportedConfig(f'no tox configuration in {root}')
+
+
+def dependency_groups(root):
+    """The normalized names of the dependency groups defined in pyproject.toml"""
+    try:
+        groups = load_toml(root / 'pyproject.toml').get('dependency-groups', {})
+    except FileNotFoundError:
+        return set()
+    return {canonicalize_name(group) for group in groups}
+
+
+def missing_requires(requires, is_installed):
+    return [req for req in requires
+            if not (req.marker and not req.marker.evaluate()) and not is_installed(str(req))]
+
+
+def print_outputs(toxenvs, output_options, *, is_installed, root=Path('.')):
+    """
+    Return the return code and the contents of the files tox would write with the output_options
+    (--print-deps-to, --print-extras-to, --print-dependency-groups-to and --no-provision)
+    for the toxenvs.
+
+    is_installed(requirement_str) tells whether tox provisioning would be needed.
+    Raise UnsupportedConfig when tox needs to be run instead.
+    """
+    config = load_config(root)
+    for envname in toxenvs:
+        if not (PYTHON_ENV_RE.fullmatch(envname) or config.has_env(envname)):
+            raise UnsupportedConfig(f'environment not defined explicitly: {envname}')
+
+    requires = parse_requires(config.requires())
+    min_version = config.min_version()
+    if min_version is not None:
+        try:
+            min_version = Version(min_version)
+        except InvalidVersion as e:
+            raise UnsupportedConfig(f'invalid min_version: {e}')
+    requires.append(Requirement(f'tox>={min_version}' if min_version else 'tox'))
+
+    outputs = {option: '' for option in output_options}
+    if missing_requires(requires, is_installed):
+        if '--no-provision' not in output_options:
+            raise UnsupportedConfig('tox would provision itself')
+        tox_specifier = next(req.specifier for req in requires if req.name == 'tox')
+        outputs['--no-provision'] = json.dumps({
+            'minversion': next((s.version for s in tox_specifier if s.operator in {'>=', '=='}), None),
+            'requires': [str(req) for req in requires],
+        }, indent=4)
+        return 1, outputs
+
+    lines = {option: [] for option in output_options}
+    for envname in toxenvs:
+        if '--print-deps-to' in lines:
+            lines['--print-deps-to'].extend((*map(str, requires), *config.deps(envname)))
+        if '--print-extras-to' in lines:
+            lines['--print-extras-to'].extend(
+                sorted({canonicalize_name(e) for e in config.names(envname, 'extras')}))
+        if '--print-dependency-groups-to' in lines:
+            groups = sorted({canonicalize_name(g) for g in config.names(envname, 'dependency_groups')})
+            if groups and (missing := set(groups) - dependency_groups(root)):
+                # tox fails, let it report that
+                raise UnsupportedConfig(f'undefined dependency groups: {", ".join(sorted(missing))}')
+            lines['--print-dependency-groups-to'].extend(groups)
+    for option, option_lines in lines.items():
+        if option != '--no-provision':
+            outputs[option] = ''.join(f'{line}\n' for line in option_lines)
+    return 0, outputs
@@ -1,6 +1,11 @@
 import argparse
+import importlib
+import json
+import os
+import shutil
 import sys
 import subprocess
+import tempfile
 
 
 def parse_config_settings_args(config_settings):
@@ -60,6 +65,98 @@ def build_wheel(*, wheeldir, stdout=None, config_settings=None):
     return cp.returncode
 
 
+def load_buildsystem_data():
+    """The [build-system] table of pyproject.toml"""
+    try:
+        import tomllib
+    except ImportError:
+        import tomli as tomllib
+    try:
+        with open('pyproject.toml', 'rb') as f:
+            return tomllib.load(f).get('build-system', {})
+    except FileNotFoundError:
+        return {}
+
+
+def load_backend():
+    """Import the build backend specified in pyproject.toml, like pip would"""
+    buildsystem_data = load_buildsystem_data()
+    backend_name = buildsystem_data.get('build-backend') or 'setuptools.build_meta:__legacy__'
+    backend_path = buildsystem_data.get('backend-path') or []
+    # PEP 517 example shows the path as a list, but some projects don't follow that
+    if isinstance(backend_path, str):
+        backend_path = [backend_path]
+    source_tree = os.path.abspath('.')
+    backend_path = [os.path.normpath(os.path.join(source_tree, path)) for path in backend_path]
+    for path in backend_path:
+        if os.path.commonpath([source_tree, path]) != source_tree:
+            raise ValueError(f'backend-path {path} is outside of the source tree')
+    sys.path[:0] = backend_path
+    module_name, _, object_name = backend_name.partition(':')
+    backend_module = importlib.import_module(module_name)
+    module_file = os.path.abspath(getattr(backend_module, '__file__', None) or '')
+    if backend_path and not any(os.path.commonpath([path, module_file]) == path for path in backend_path):
+        # the same check as pip does (an in-tree backend must not be shadowed by an installed module)
+        raise ImportError(f'The build backend {module_name} was not loaded from backend-path, '
+                          f'but from {module_file}')
+    backend = backend_module
+    if object_name:
+        for attribute in object_name.split('.'):
+            backend = getattr(backend, attribute)
+    return backend
+
+
+def prepared_metadata_directory(buildrequires_state, config_settings):
+    """
+    Return the metadata directory prepared by %pyproject_buildrequires for the current directory,
+    or None if there is none or it would be different now.
+    It is kept next to the buildrequires_state file, see PassState in pyproject_buildrequires.py.
+    """
+    try:
+        with open(buildrequires_state) as f:
+            prepared = json.load(f).get('metadata', {}).get(os.getcwd(), {})
+    except (FileNotFoundError, ValueError):
+        return None
+    if not prepared:
+        return None
+    from pyproject_metadata_key import metadata_cache_key
+    if prepared['key'] != metadata_cache_key(load_buildsystem_data(), config_settings):
+        return None
+    try:
+        with open(os.path.join(prepared['dist_info'], 'METADATA')) as f:
+            if f.read() != prepared['metadata']:
+                return None
+    except FileNotFoundError:
+        return None
+    return os.path.abspath(prepared['dist_info'])
+
+
+def build_wheel_pep517(*, wheeldir, config_settings=None, buildrequires_state=None):
+    """
+    Build the wheel by calling the build_wheel hook of the build backend in this process.
+
+    The result is the same as with build_wheel(), only pip's startup and requirement processing is skipped.
+    The config_settings are passed to the hook as they are (see parse_config_settings_args()).
+
+    When %pyproject_buildrequires already prepared the metadata (and it is still up to date),
+    it is passed to the backend, so it does not need to be generated again.
+    """
+    metadata_directory = None
+    if buildrequires_state:
+        metadata_directory = prepared_metadata_directory(buildrequires_state, config_settings)
+        if metadata_directory:
+            print(f'Reusing the metadata prepared by %pyproject_buildrequires: {metadata_directory}',
+                  file=sys.stderr)
+    backend = load_backend()
+    os.makedirs(wheeldir, exist_ok=True)
+    # Like pip, build in a temporary directory, only the finished wheel is moved to wheeldir
+    with tempfile.TemporaryDirectory(prefix='pyproject-wheel-') as tmpdir:
+        wheel = backend.build_wheel(tmpdir, config_settings or None, metadata_directory)
+        shutil.move(os.path.join(tmpdir, wheel), os.path.join(wheeldir, wheel))
+    print(f'Built {wheel} in {wheeldir}', file=sys.stderr)
+    return 0
+
+
 def argparser():
     parser = argparse.ArgumentParser(prog='%pyproject_wheel')
     parser.add_argument('wheeldir', help=argparse.SUPPRESS)
@@ -70,6 +167,10 @@ def argparser():
         help='Configuration settings to pass to the PEP 517 backend',
     )
     parser.add_argument('-d', '--directory', help=argparse.SUPPRESS)  # processed by RPM macro
+    # %_pyproject_wheel_frontend
+    parser.add_argument('--frontend', choices=('pip', 'pep517'), default='pip', help=argparse.SUPPRESS)
+    # %_pyproject_buildrequires_state, only used by the pep517 frontend
+    parser.add_argument('--buildrequires-state', help=argparse.SUPPRESS)
     return parser
 
 
@@ -81,5 +182,13 @@ def parse_args(argv=None):
     return args
 
 
+def main(argv=None):
+    args = parse_args(argv)
+    if args.frontend == 'pep517':
+        return build_wheel_pep517(wheeldir=args.wheeldir, config_settings=args.config_settings,
+                                  buildrequires_state=args.buildrequires_state)
+    return build_wheel(wheeldir=args.wheeldir, config_settings=args.config_settings)
+
+
 if __name__ == '__main__':
-    sys.exit(build_wheel(**vars(parse_args())))
+    sys.exit(main())
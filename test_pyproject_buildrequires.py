@@ -1,12 +1,18 @@
 from pathlib import Path
 import importlib.metadata
+import json
+import subprocess
+import sys
 
 import packaging.version
 import pytest
 import setuptools
 import yaml
+from packaging.markers import Marker
 
-from pyproject_buildrequires import generate_requires, load_pyproject
+import pyproject_tox_config
+from pyproject_buildrequires import generate_requires, load_pyproject, MarkerCache, Requirements
+from pyproject_provides_index import read_json_index
 
 SETUPTOOLS_VERSION = packaging.version.parse(setuptools.__version__)
 SETUPTOOLS_60 = SETUPTOOLS_VERSION >= packaging.version.parse('60')
@@ -77,6 +83,9 @@ def test_data(case_name, capfd, tmp_path, monkeypatch):
     requirement_files = [Path(f) for f in requirement_files]
     use_build_system = case.get('use_build_system', True)
     pyproject_dependencies = case.get('pyproject_dependencies', False)
+    provides_index = case.get('provides_index')
+    if provides_index is not None:
+        provides_index = read_json_index(provides_index)
     try:
         generate_requires(
             get_installed_version=get_installed_version,
@@ -93,6 +102,7 @@ def test_data(case_name, capfd, tmp_path, monkeypatch):
             output=output,
             config_settings=case.get('config_settings'),
             dependency_overrides=case.get('dependency_overrides', []),
+            provides_index=provides_index,
         )
     except SystemExit as e:
         assert e.code == case['result']
@@ -125,3 +135,403 @@ def test_data(case_name, capfd, tmp_path, monkeypatch):
                 stderr_contains = [stderr_contains]
             for expected_substring in stderr_contains:
                 assert expected_substring.format(**locals()) in err
+
+
+def test_pass_state_restores_completed_stages(tmp_path, monkeypatch, capfd):
+    monkeypatch.chdir(tmp_path)
+    tmp_path.joinpath('pyproject.toml').write_text('[build-system]\nrequires = ["setuptools"]\n')
+    tmp_path.joinpath('setup.py').write_text(
+        'from setuptools import setup\n'
+        'setup(name="pkg", version="1.0", install_requires=["foo", "bar"])\n'
+    )
+    output = tmp_path / 'output.txt'
+    state_file = tmp_path / 'state.json'
+    installed = {'setuptools': '50', 'wheel': '1'}
+
+    def get_installed_version(dist_name):
+        try:
+            return installed[dist_name]
+        except KeyError:
+            raise importlib.metadata.PackageNotFoundError(dist_name)
+
+    def run():
+        load_pyproject.cache_clear()
+        generate_requires(
+            get_installed_version=get_installed_version,
+            include_runtime=True,
+            output=output,
+            state_file=state_file,
+        )
+        return sorted(output.read_text().splitlines())
+
+    first = run()
+    assert 'python3dist(foo)' in first
+
+    # the runtime requirements got installed, the hook is not called again
+    installed.update(foo='1', bar='1')
+    def fail(*args, **kwargs):
+        raise AssertionError('the stage should have been restored')
+    monkeypatch.setattr('pyproject_buildrequires.generate_run_requirements_hook', fail)
+    monkeypatch.setattr('pyproject_buildrequires.load_backend', fail)
+    capfd.readouterr()
+    assert run() == first
+    err = capfd.readouterr().err
+    assert 'Restoring run requirements from a previous pass' in err
+    assert 'Requirement satisfied: foo' in err
+
+    # the build backend changed, the hook is called again
+    installed['setuptools'] = '51'
+    with pytest.raises(AssertionError, match='should have been restored'):
+        run()
+
+
+def test_prepared_metadata_is_reused(tmp_path, monkeypatch, capfd):
+    monkeypatch.chdir(tmp_path)
+    tmp_path.joinpath('pyproject.toml').write_text(
+        '[build-system]\n'
+        'requires = []\n'
+        'build-backend = "metadata_cache_backend"\n'
+        'backend-path = ["."]\n'
+    )
+    # the backend reads the requirement from setup.cfg and logs the hook calls
+    tmp_path.joinpath('metadata_cache_backend.py').write_text(
+        'import os\n'
+        'def prepare_metadata_for_build_wheel(metadata_directory, config_settings=None):\n'
+        '    with open("hook.log", "a") as f:\n'
+        '        print("prepare_metadata_for_build_wheel", file=f)\n'
+        '    os.makedirs(os.path.join(metadata_directory, "pkg-1.dist-info"), exist_ok=True)\n'
+        '    with open(os.path.join(metadata_directory, "pkg-1.dist-info", "METADATA"), "w") as f:\n'
+        '        f.write("Metadata-Version: 2.1\\nName: pkg\\nVersion: 1\\n")\n'
+        '        f.write("Requires-Dist: " + open("setup.cfg").read())\n'
+        '    return "pkg-1.dist-info"\n'
+    )
+    tmp_path.joinpath('setup.cfg').write_text('foo\n')
+    tmp_path.joinpath('requirements.txt').write_text('')
+    monkeypatch.syspath_prepend(tmp_path)  # backend-path modifies sys.path, let monkeypatch restore it
+    output = tmp_path / 'output.txt'
+    installed = {'foo': '1', 'reqdep': '1'}
+
+    def get_installed_version(dist_name):
+        try:
+            return installed[dist_name]
+        except KeyError:
+            raise importlib.metadata.PackageNotFoundError(dist_name)
+
+    def run():
+        load_pyproject.cache_clear()
+        generate_requires(
+            get_installed_version=get_installed_version,
+            include_runtime=True,
+            requirement_files=[tmp_path / 'requirements.txt'],
+            output=output,
+            state_file=tmp_path / 'state.json',
+        )
+        return sorted(output.read_text().splitlines())
+
+    def hook_calls():
+        return len(tmp_path.joinpath('hook.log').read_text().splitlines())
+
+    assert run() == ['python3dist(foo)']
+    assert hook_calls() == 1
+
+    # the pass state is discarded, but the metadata is not
+    tmp_path.joinpath('requirements.txt').write_text('reqdep\n')
+    capfd.readouterr()
+    assert run() == ['python3dist(foo)', 'python3dist(reqdep)']
+    assert hook_calls() == 1
+    assert 'Reusing the metadata prepared by the build backend' in capfd.readouterr().err
+
+    # the project changed, the metadata is prepared again
+    tmp_path.joinpath('setup.cfg').write_text('bar\n')
+    assert run() == ['python3dist(bar)', 'python3dist(reqdep)']
+    assert hook_calls() == 2
+
+
+def test_conversion_cache_is_persisted_between_passes(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    tmp_path.joinpath('requirements.txt').write_text('foo >= 1.0, != 1.5\nFoo_Bar[baz] < 3\n')
+    output = tmp_path / 'output.txt'
+    state_file = tmp_path / 'state.json'
+
+    def get_installed_version(dist_name):
+        raise importlib.metadata.PackageNotFoundError(dist_name)
+
+    def run():
+        generate_requires(
+            get_installed_version=get_installed_version,
+            include_runtime=False,
+            use_build_system=False,
+            generate_extras=True,
+            requirement_files=[tmp_path / 'requirements.txt'],
+            output=output,
+            state_file=state_file,
+        )
+        return output.read_text().splitlines()
+
+    first = run()
+    assert first == [
+        '((python3dist(foo) < 1.5 or python3dist(foo) > 1.5) with python3dist(foo) >= 1)',
+        'python3dist(foo-bar) < 3~~',
+        'python3dist(foo-bar[baz]) < 3~~',
+    ]
+
+    # the requirements file changed, but the conversions are reused
+    tmp_path.joinpath('requirements.txt').write_text('Foo_Bar[baz] < 3\nfoo >= 1.0, != 1.5\n')
+    def fail(*args, **kwargs):
+        raise AssertionError('the conversion should have been cached')
+    monkeypatch.setattr('pyproject_buildrequires.Requirements.convert', fail)
+    assert sorted(run()) == sorted(first)
+
+
+@pytest.mark.parametrize('marker_str', [
+    'extra == "b"',
+    'extra != "b"',
+    'python_version < "3" or extra == "B"',
+    '(extra == "a" or extra == "c") and python_version >= "3"',
+    '"c" == extra',
+    'extra > "b"',
+])
+def test_marker_cache_agrees_with_marker_evaluate(marker_str, monkeypatch):
+    marker = Marker(marker_str)
+    cache = MarkerCache()
+    for extras in [[''], ['a'], ['a', 'b', 'x'], ['c', 'd', 'x', 'y', 'z']]:
+        expected = any(marker.evaluate(environment={'extra': e}) for e in extras)
+        assert cache.evaluate_any(marker, extras) == expected
+
+    # everything is evaluated by now
+    monkeypatch.setattr(Marker, 'evaluate', None)
+    assert cache.evaluate_any(marker, ['x', 'y']) == cache.evaluate_any(marker, ['z'])
+
+
+def test_only_affected_alien_requirements_are_readded(capsys):
+    def get_installed_version(dist_name):
+        raise importlib.metadata.PackageNotFoundError(dist_name)
+
+    requirements = Requirements(get_installed_version, extras=['start'])
+    requirements.set_package_name('pkg')
+    requirements.extend([
+        'neverdep; extra == "never"',
+        'olddep; python_version < "3"',
+        'leftdep; extra == "left"',
+        'pkg[left]; extra == "start"',
+        'rightdep; extra == "right"',
+        'pkg[right]; extra == "left"',
+    ], source='test')
+
+    assert requirements.output_lines == ['python3dist(leftdep)', 'python3dist(rightdep)']
+    assert [str(r) for r in requirements.ignored_alien_requirements.values()] == [
+        'neverdep; extra == "never"',
+        'olddep; python_version < "3"',
+    ]
+    err = capsys.readouterr().err
+    assert err.count('Handling leftdep') == 2
+    assert err.count('Handling neverdep') == 1
+    assert err.count('Handling olddep') == 1
+
+
+@pytest.mark.parametrize('marker_str', [
+    'extra != "foo"',
+    'extra != "foo" and python_version >= "3"',
+    'extra == "qux" or extra != "foo"',
+])
+def test_alien_requirements_readded_for_new_extras_match_full_readd(marker_str):
+    def get_installed_version(dist_name):
+        return '1'
+
+    def readd(**kwargs):
+        requirements = Requirements(get_installed_version, extras=['foo'])
+        requirements.add(f'bar; {marker_str}', source='test')
+        assert requirements.output_lines == []
+        requirements.add_extras('baz')
+        requirements.readd_ignored_alien_requirements(**kwargs)
+        return requirements.output_lines
+
+    assert readd(extras=['baz']) == readd() == ['python3dist(bar)']
+
+
+def imported_modules(args, cwd):
+    """Names of the modules imported by running Python with args (via -X importtime)"""
+    proc = subprocess.run([sys.executable, '-X', 'importtime', *args],
+                          cwd=cwd, capture_output=True, text=True, check=True)
+    return {line.rpartition('|')[-1].strip()
+            for line in proc.stderr.splitlines() if line.startswith('import time:')}
+
+
+# Modules %pyproject_buildrequires -R/-p may import on top of the ones it cannot do without,
+# the rest is only imported when needed (e.g. subprocess for tox, zipfile for -w, ...)
+IMPORT_BUDGET = {
+    'pyproject_convert',
+    'pyproject_dependency_overrides',
+    'pyproject_metadata_key',
+    'tomli',
+    'tomllib',
+    'tomllib._parser',
+    'tomllib._re',
+    'tomllib._types',
+}
+
+
+@pytest.mark.parametrize('flag', ['-R', '-p'])
+def test_import_budget(tmp_path, flag):
+    tmp_path.joinpath('pyproject.toml').write_text(
+        '[build-system]\n'
+        'requires = []\n'
+        'build-backend = "test_backend"\n'
+        'backend-path = ["."]\n'
+        '[project]\n'
+        'name = "test"\n'
+        'version = "0"\n'
+    )
+    tmp_path.joinpath('test_backend.py').write_text(
+        'def get_requires_for_build_wheel(config_settings=None):\n'
+        '    return []\n'
+    )
+    script = Path(__file__).parent / 'pyproject_buildrequires.py'
+    modules = imported_modules([script, '--output', 'output.txt', flag], tmp_path)
+    unavoidable = imported_modules(['-c', 'import argparse, hashlib, importlib.metadata, json, '
+                                          'packaging.markers, packaging.requirements'], tmp_path)
+    assert modules - unavoidable - {'test_backend'} <= IMPORT_BUDGET
+
+
+def test_timings(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    tmp_path.joinpath('pyproject.toml').write_text(
+        '[build-system]\n'
+        'requires = ["foo"]\n'
+        'build-backend = "timings_backend"\n'
+        'backend-path = ["."]\n'
+    )
+    tmp_path.joinpath('timings_backend.py').write_text(
+        'def get_requires_for_build_wheel(config_settings=None):\n'
+        '    return ["bar"]\n'
+    )
+    timings_file = tmp_path / 'timings.jsonl'
+    monkeypatch.syspath_prepend(tmp_path)  # backend-path modifies sys.path, let monkeypatch restore it
+
+    for _ in range(2):
+        generate_requires(
+            get_installed_version=lambda name: '1',
+            output=tmp_path / 'output.txt',
+            timings_file=timings_file,
+        )
+
+    records = [json.loads(line) for line in timings_file.read_text().splitlines()]
+    assert len({r['pass'] for r in records}) == 2
+    measured = {(r['kind'], r['name']) for r in records}
+    assert {
+        ('load', 'pyproject.toml'),
+        ('stage', 'build backend'),
+        ('stage', 'get_requires_for_build_wheel'),
+        ('import', 'timings_backend'),
+        ('hook', 'get_requires_for_build_wheel'),
+        ('add', 'foo'),
+        ('add', 'bar'),
+        ('write', 'output'),
+        ('pass', None),
+    } <= measured
+    for record in records:
+        assert record['cwd'] == str(tmp_path)
+        assert record['wall'] >= 0 and record['cpu'] >= 0
+    assert records[-1]['conversions'] == {'hits': 0, 'misses': 2}
+
+
+@pytest.fixture
+def tox_project(tmp_path, monkeypatch):
+    """A project with a tox configuration, returns the pass runner, the installed versions and the tox commands"""
+    monkeypatch.chdir(tmp_path)
+    tmp_path.joinpath('pyproject.toml').write_text(
+        '[build-system]\n'
+        'requires = []\n'
+        'build-backend = "tox_cache_backend"\n'
+        'backend-path = ["."]\n'
+        '[project]\n'
+        'name = "pkg"\n'
+        'version = "0"\n'
+        '[dependency-groups]\n'
+        'tests = ["pytest"]\n'
+        '[tool.tox]\n'
+        'requires = ["tox>=4.22"]\n'
+        '[tool.tox.env_run_base]\n'
+        'skip_install = true\n'
+        'deps = ["toxdep"]\n'
+        'dependency_groups = ["tests"]\n'
+    )
+    tmp_path.joinpath('tox_cache_backend.py').write_text('')
+    tmp_path.joinpath('requirements.txt').write_text('')
+    monkeypatch.syspath_prepend(tmp_path)  # backend-path modifies sys.path, let monkeypatch restore it
+    installed = {'tox': '4.22', 'tox-current-env': '0.0.16'}
+
+    def get_installed_version(dist_name):
+        try:
+            return installed[dist_name]
+        except KeyError:
+            raise importlib.metadata.PackageNotFoundError(dist_name)
+
+    tox_commands = []
+    popen = subprocess.Popen
+    def counting_popen(command, *args, **kwargs):
+        tox_commands.append(command)
+        return popen(command, *args, **kwargs)
+    monkeypatch.setattr(subprocess, 'Popen', counting_popen)
+
+    def run():
+        load_pyproject.cache_clear()
+        generate_requires(
+            get_installed_version=get_installed_version,
+            pyproject_dependencies=True,
+            toxenv=['py3'],
+            requirement_files=[tmp_path / 'requirements.txt'],
+            output=tmp_path / 'output.txt',
+            state_file=tmp_path / 'state.json',
+        )
+        return sorted((tmp_path / 'output.txt').read_text().splitlines())
+
+    return run, installed, tox_commands
+
+
+TOX_PROJECT_REQUIREMENTS = [
+    'python3dist(pytest)',
+    'python3dist(tox)',
+    'python3dist(tox) >= 4.22',
+    'python3dist(tox-current-env) >= 0.0.16',
+    'python3dist(toxdep)',
+]
+
+
+@pytest.mark.skipif(not TOX_4_22, reason='tox 4.22+ is needed to print dependency groups')
+def test_tox_runs_once_and_is_cached(tox_project, tmp_path, monkeypatch, capfd):
+    run, installed, tox_commands = tox_project
+    expected = TOX_PROJECT_REQUIREMENTS
+
+    def unsupported(*args, **kwargs):
+        raise pyproject_tox_config.UnsupportedConfig('tested with tox')
+    monkeypatch.setattr(pyproject_tox_config, 'print_outputs', unsupported)
+
+    assert run() == expected
+    assert len(tox_commands) == 1
+    assert '--print-dependency-groups-to' in tox_commands[0]
+
+    # the missing requirements got installed, the tox stage is restored with the dependency groups
+    installed.update(toxdep='1', pytest='1')
+    assert run() == expected
+    assert len(tox_commands) == 1
+
+    # the pass state is discarded, but the output of tox is not
+    tmp_path.joinpath('requirements.txt').write_text('reqdep\n')
+    installed['reqdep'] = '1'
+    capfd.readouterr()
+    assert run() == sorted(expected + ['python3dist(reqdep)'])
+    assert len(tox_commands) == 1
+    assert 'Reusing the output of tox' in capfd.readouterr().err
+
+
+def test_tox_configuration_is_read_without_tox(tox_project, capfd):
+    run, installed, tox_commands = tox_project
+    assert run() == TOX_PROJECT_REQUIREMENTS
+    assert tox_commands == []
+    assert 'from the tox configuration' in capfd.readouterr().err
+
+    # the tox stage is restored, the dependency groups are read again
+    installed.update(toxdep='1', pytest='1')
+    assert run() == TOX_PROJECT_REQUIREMENTS
+    assert tox_commands == []
@@ -0,0 +1,122 @@
+import os
+import shutil
+import subprocess
+import sys
+from pathlib import Path
+
+import pytest
+
+
+SCRIPT = Path(__file__).parent / 'pyproject_buildrequires_server.py'
+
+
+@pytest.fixture
+def project(tmp_path, monkeypatch):
+    # the backend is importable from sys.path, outside of the project
+    backends = tmp_path / 'backends'
+    backends.mkdir()
+    backends.joinpath('logging_backend.py').write_text(
+        'import os, tempfile\n'
+        'with open(os.environ["BACKEND_LOG"], "a") as f:\n'
+        '    print(os.getpid(), file=f)\n'
+        'def get_requires_for_build_wheel(config_settings=None):\n'
+        '    with open(os.environ["BACKEND_LOG"] + ".tmpdir", "a") as f:\n'
+        '        print(tempfile.gettempdir(), file=f)\n'
+        '    return ["foo", "bar >= 1"]\n'
+    )
+    project = tmp_path / 'project'
+    project.mkdir()
+    project.joinpath('pyproject.toml').write_text(
+        '[build-system]\n'
+        'requires = []\n'
+        'build-backend = "logging_backend"\n'
+    )
+    monkeypatch.setenv('PYTHONPATH', str(backends))
+    monkeypatch.setenv('BACKEND_LOG', str(tmp_path / 'backend.log'))
+    yield project
+    # the server exits when the socket is removed
+    tmp_path.joinpath('server.sock').unlink(missing_ok=True)
+
+
+def run(project, *args):
+    return subprocess.run(
+        [sys.executable, '-Bs', SCRIPT, project.parent / 'server.sock',
+         '--output', project / 'output.txt', *args],
+        cwd=project, capture_output=True, text=True,
+    )
+
+
+def backend_imports(project):
+    return project.parent.joinpath('backend.log').read_text().splitlines()
+
+
+def test_server_keeps_the_backend_imported(project):
+    for _ in range(3):
+        proc = run(project, '-R')
+        assert proc.returncode == 0
+        assert 'Requirement not satisfied: foo' in proc.stderr
+        assert sorted(project.joinpath('output.txt').read_text().splitlines()) == [
+            'python3dist(bar) >= 1', 'python3dist(foo)',
+        ]
+    imports = backend_imports(project)
+    assert len(imports) == 1
+    assert str(os.getpid()) not in imports
+
+
+def install(backends, name, version, top_level):
+    for old in backends.glob(f'{name.replace("-", "_")}-*.dist-info'):
+        shutil.rmtree(old)
+    distinfo = backends / f'{name.replace("-", "_")}-{version}.dist-info'
+    distinfo.mkdir()
+    distinfo.joinpath('METADATA').write_text(f'Metadata-Version: 2.1\nName: {name}\nVersion: {version}\n')
+    distinfo.joinpath('top_level.txt').write_text(f'{top_level}\n')
+
+
+def test_server_is_replaced_when_an_imported_distribution_changes(project):
+    backends = project.parent / 'backends'
+    install(backends, 'logging-backend', '1', 'logging_backend')
+    assert run(project, '-R').returncode == 0
+    # other files in sys.path and newly installed distributions don't matter
+    backends.joinpath('build.log').touch()
+    install(backends, 'unrelated', '1', 'unrelated')
+    assert run(project, '-R').returncode == 0
+    assert len(backend_imports(project)) == 1
+    # the imported build backend is upgraded
+    install(backends, 'logging-backend', '2', 'logging_backend')
+    assert run(project, '-R').returncode == 0
+    imports = backend_imports(project)
+    assert len(imports) == 2
+    assert imports[0] != imports[1]
+
+
+def test_build_owner_is_the_rpmbuild_process(tmp_path):
+    rpmbuild = tmp_path / 'rpmbuild'
+    rpmbuild.symlink_to(sys.executable)
+    # rpmbuild runs a shell running the script
+    script = (f'import pyproject_buildrequires_server as s, os; '
+              f'print(os.getppid(), s.build_owner())')
+    proc = subprocess.run(
+        [rpmbuild, '-c', 'import os, subprocess, sys; print(os.getpid()); sys.stdout.flush(); '
+         f'subprocess.run(["sh", "-c", "{sys.executable} -c \'{script}\'"], check=True)'],
+        cwd=SCRIPT.parent, check=True, capture_output=True, text=True,
+    )
+    rpmbuild_pid, shell_pid, owner = proc.stdout.split()
+    assert owner == rpmbuild_pid != shell_pid
+
+
+def test_server_uses_the_tmpdir_of_each_request(project, monkeypatch):
+    tmpdirs = []
+    for name in 'first', 'second':
+        tmpdir = project.parent / name
+        tmpdir.mkdir()
+        monkeypatch.setenv('TMPDIR', str(tmpdir))
+        assert run(project, '-R').returncode == 0
+        tmpdirs.append(str(tmpdir))
+    assert len(backend_imports(project)) == 1
+    assert project.parent.joinpath('backend.log.tmpdir').read_text().splitlines() == tmpdirs
+
+
+def test_server_exit_code(project):
+    proc = run(project, '--no-such-option')
+    assert proc.returncode == 2
+    assert 'unrecognized arguments: --no-such-option' in proc.stderr
@@ -0,0 +1,158 @@
+import json
+import os
+import subprocess
+import sys
+import sysconfig
+import zipfile
+from pathlib import Path
+
+import pytest
+
+from pyproject_install import SCRIPT_TEMPLATE, install_wheel, install_wheels
+from pyproject_preprocess_record import parse_record, read_record
+from pyproject_save_files import BuildrootPath
+
+
+SCRIPTS = Path(__file__).parent
+
+PREFIX_VARS = {'base': '/usr', 'platbase': '/usr', 'installed_base': '/usr', 'installed_platbase': '/usr'}
+PURELIB = sysconfig.get_path('purelib', 'posix_prefix', vars=PREFIX_VARS)
+PLATLIB = sysconfig.get_path('platlib', 'posix_prefix', vars=PREFIX_VARS)
+
+WHEEL_FILES = {
+    'pkg/__init__.py': 'VERSION = 1\n',
+    'pkg/cli.py': 'def main():\n    return 0\n',
+    'pkg/data/table.json': '{}\n',
+    'pkg-1.data/scripts/pkg-legacy': '#!python\nimport pkg\n',
+    'pkg-1.data/data/share/man/man1/pkg.1': '.TH PKG 1\n',
+    'pkg-1.data/headers/pkg.h': '#define PKG 1\n',
+    'pkg-1.dist-info/METADATA': 'Metadata-Version: 2.1\nName: pkg\nVersion: 1\nRequires-Dist: foo>=1\n',
+    'pkg-1.dist-info/WHEEL': 'Wheel-Version: 1.0\nGenerator: handmade\nRoot-Is-Purelib: true\nTag: py3-none-any\n',
+    'pkg-1.dist-info/entry_points.txt': (
+        '[console_scripts]\n'
+        'pkg = pkg.cli:main\n'
+        'Pkg-Colors = pkg.cli:main [color]\n'
+        '[gui_scripts]\n'
+        'pkg-gui = pkg.cli:main\n'
+    ),
+    'pkg-1.dist-info/licenses/LICENSE': 'MIT\n',
+}
+
+
+def make_wheel(wheeldir, name='pkg', files=WHEEL_FILES):
+    wheeldir.mkdir(exist_ok=True)
+    wheel = wheeldir / f'{name}-1-py3-none-any.whl'
+    files = {path.replace('pkg', name): content.replace('pkg', name)
+             for path, content in files.items()}
+    with zipfile.ZipFile(wheel, 'w') as zf:
+        for path, content in files.items():
+            info = zipfile.ZipInfo(path)
+            info.external_attr = (0o100755 if '/scripts/' in path else 0o100644) << 16
+            zf.writestr(info, content)
+        zf.writestr(f'{name}-1.dist-info/RECORD', ''.join(f'{path},,\n' for path in files))
+    return wheel
+
+
+@pytest.fixture
+def wheel(tmp_path):
+    return make_wheel(tmp_path / 'wheeldir')
+
+
+def tree(root):
+    """Files (with their modes and contents) installed to root, without bytecode and the files we remove"""
+    result = {}
+    for path in root.rglob('*'):
+        if path.is_dir() or '__pycache__' in path.parts or path.name in ('RECORD', 'REQUESTED', 'INSTALLER'):
+            continue
+        result['/' + str(path.relative_to(root))] = oct(path.stat().st_mode), path.read_bytes()
+    return result
+
+
+def pip_install(wheel, root):
+    subprocess.run(
+        [sys.executable, '-m', 'pip', 'install', '--root', root, '--prefix', '/usr', '--no-deps',
+         '--disable-pip-version-check', '--ignore-installed', '--no-warn-script-location',
+         '--no-index', '--no-cache-dir', '--find-links', wheel.parent, 'pkg==1'],
+        check=True, capture_output=True,
+    )
+
+
+def test_installed_files_match_pip(wheel, tmp_path):
+    pip_root = tmp_path / 'pip'
+    pip_install(wheel, pip_root)
+    root = tmp_path / 'builtin'
+    record_path, installed = install_wheel(wheel, buildroot=str(root), prefix='/usr',
+                                           purelib=PURELIB, platlib=PLATLIB)
+    assert tree(root) == tree(pip_root)
+
+    pip_record = pip_root / record_path.relative_to('/')
+    pip_installed = parse_record(record_path, read_record(pip_record))
+    assert sorted(installed) == sorted(path for path in pip_installed
+                                       if not path.endswith(('.pyc', '/REQUESTED', '/RECORD')))
+    assert (root / record_path.parent.relative_to('/') / 'INSTALLER').read_text() == 'rpm\n'
+    assert not (root / record_path.relative_to('/')).exists()
+
+
+def test_script_template_matches_pip():
+    scripts = pytest.importorskip('pip._vendor.distlib.scripts')
+    assert SCRIPT_TEMPLATE == scripts.ScriptMaker.script_template
+
+
+@pytest.mark.parametrize('installer', ['builtin', 'pip'])
+def test_outputs(wheel, tmp_path, installer):
+    root = tmp_path / 'buildroot'
+    record = tmp_path / 'pyproject-record'
+    ghost = tmp_path / 'pyproject-ghost-distinfo'
+    overrides = tmp_path / 'dep-overrides'
+    overrides.write_text('foo:ignore\n')
+    outputs = ['--record-output', record, '--ghost-distinfo-base', ghost, '--dep-overrides', overrides]
+    if installer == 'builtin':
+        command = ['pyproject_install.py', '--buildroot', root, '--prefix', '/usr',
+                   '--purelib', PURELIB, '--platlib', PLATLIB, *outputs, wheel]
+    else:
+        pip_install(wheel, root)
+        command = ['pyproject_postinstall.py', '--buildroot', root, *outputs, PURELIB, PLATLIB]
+    subprocess.run([sys.executable, '-Bs', SCRIPTS / command[0], *command[1:]], check=True, capture_output=True)
+    distinfo = BuildrootPath(PURELIB) / 'pkg-1.dist-info'
+    parsed_record = json.loads(record.read_text())
+    assert list(parsed_record) == [str(distinfo / 'RECORD')]
+    assert '/usr/bin/pkg' in parsed_record[str(distinfo / 'RECORD')]
+    real_distinfo = root / distinfo.relative_to('/')
+    assert (real_distinfo / 'INSTALLER').read_text() == 'rpm\n'
+    assert not (real_distinfo / 'RECORD').exists()
+    assert not (real_distinfo / 'REQUESTED').exists()
+    assert ghost.read_text() == f'%ghost %dir {distinfo}\n'
+    assert tmp_path.joinpath('pyproject-ghost-distinfo-pkg').read_text() == f'%ghost %dir {distinfo}\n'
+    metadata = root / distinfo.relative_to('/') / 'METADATA'
+    assert 'Requires-Dist' not in metadata.read_text()
+
+
+def test_file_outside_of_the_target_directory(tmp_path):
+    wheel = tmp_path / 'evil-1-py3-none-any.whl'
+    with zipfile.ZipFile(wheel, 'w') as zf:
+        zf.writestr('evil-1.dist-info/METADATA', 'Metadata-Version: 2.1\nName: evil\nVersion: 1\n')
+        zf.writestr('evil-1.dist-info/WHEEL', 'Wheel-Version: 1.0\nRoot-Is-Purelib: true\n')
+        zf.writestr('evil-1.data/data/../../../etc/evil', '')
+    with pytest.raises(ValueError, match='would be installed outside of /usr'):
+        install_wheel(wheel, buildroot=str(tmp_path / 'buildroot'), prefix='/usr',
+                      purelib=PURELIB, platlib=PLATLIB)
+    assert not os.path.exists(tmp_path / 'etc')
+
+
+@pytest.mark.parametrize('shared_file', [False, True])
+def test_parallel_install(tmp_path, shared_file):
+    files = dict(WHEEL_FILES)
+    if shared_file:
+        files['pkg-1.data/data/share/shared.txt'] = 'pkg\n'
+    wheels = [make_wheel(tmp_path / 'wheeldir', name, files) for name in ('alpha', 'beta', 'gamma')]
+    kwargs = dict(prefix='/usr', purelib=PURELIB, platlib=PLATLIB)
+    sequential = install_wheels(wheels, jobs=1, buildroot=str(tmp_path / 'sequential'), **kwargs)
+    parallel = install_wheels(wheels, jobs=3, buildroot=str(tmp_path / 'parallel'), **kwargs)
+    assert parallel == sequential
+    assert [record_path.parent.name for record_path, _ in parallel] == [
+        'alpha-1.dist-info', 'beta-1.dist-info', 'gamma-1.dist-info',
+    ]
+    assert tree(tmp_path / 'parallel') == tree(tmp_path / 'sequential')
+    if shared_file:
+        # the last wheel wins, like with pip
+        assert (tmp_path / 'parallel/usr/share/shared.txt').read_text() == 'gamma\n'
@@ -0,0 +1,53 @@
+import gzip
+from textwrap import dedent
+
+from pyproject_provides_index import load_provides_index
+
+
+PRIMARY_XML = dedent("""\
+    <?xml version="1.0" encoding="UTF-8"?>
+    <metadata xmlns="http://linux.duke.edu/metadata/common" xmlns:rpm="http://linux.duke.edu/metadata/rpm" packages="2">
+    <package type="rpm">
+      <name>python3-requests</name>
+      <format>
+        <rpm:provides>
+          <rpm:entry name="python3-requests" flags="EQ" epoch="0" ver="2.32.3" rel="1.fc42"/>
+          <rpm:entry name="python3dist(requests)" flags="EQ" epoch="0" ver="2.32.3"/>
+          <rpm:entry name="python3dist(requests[socks])" flags="EQ" epoch="0" ver="2.32.3"/>
+          <rpm:entry name="python3.13dist(requests)" flags="EQ" epoch="0" ver="2.32.3"/>
+        </rpm:provides>
+      </format>
+    </package>
+    <package type="rpm">
+      <name>python3-zope-interface</name>
+      <format>
+        <rpm:provides>
+          <rpm:entry name="python3dist(zope.interface)" flags="EQ" epoch="1" ver="7~b1"/>
+          <rpm:entry name="python3dist(zope-interface)" flags="EQ" epoch="1" ver="7~b1"/>
+        </rpm:provides>
+      </format>
+    </package>
+    </metadata>
+""")
+
+
+def test_primary_xml(tmp_path):
+    primary = tmp_path / 'primary.xml.gz'
+    with gzip.open(primary, 'wt') as f:
+        f.write(PRIMARY_XML)
+    assert load_provides_index(primary) == {
+        'requests': ['2.32.3'],
+        'zope-interface': ['1!7b1'],
+    }
+    assert load_provides_index(primary, python3_pkgversion='3.13') == {
+        'requests': ['2.32.3'],
+    }
+
+
+def test_json(tmp_path):
+    index = tmp_path / 'provides.json'
+    index.write_text('["python3dist(requests) = 2.32.3", "python3dist(pytest) = 8.3.4"]')
+    assert load_provides_index(index) == {
+        'requests': ['2.32.3'],
+        'pytest': ['8.3.4'],
+    }
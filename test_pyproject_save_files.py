@@ -1,3 +1,6 @@
+import json
+import multiprocessing
+
 import pytest
 import yaml
 
@@ -8,7 +11,8 @@ from pyproject_preprocess_record import parse_record, read_record, save_parsed_r
 
 from pyproject_save_files import argparser, canonical_name_from_distinfo, generate_file_list, BuildrootPath
 from pyproject_save_files import main as save_files_main
-from pyproject_save_files import module_names_from_path
+from pyproject_save_files import module_names_from_path, load_parsed_record, read_parsed_records
+from pyproject_save_files import escape_rpm_path_4_18, escape_rpm_path_4_19, escape_rpm_paths_4_18, escape_rpm_paths_4_19
 
 DIR = Path(__file__).parent
 PREFIX = Path("/usr")
@@ -251,6 +255,33 @@ def test_cli_too_many_RECORDS(tldr_root, output_files, output_modules, pyproject
         save_files_main(cli_args)
 
 
+def test_parsed_record_is_appended(pyproject_record):
+    # the old format, a single JSON object without a trailing newline
+    pyproject_record.write_text(json.dumps({"/old-1.0.dist-info/RECORD": ["/old"],
+                                            "/both-1.0.dist-info/RECORD": ["/outdated"]}))
+    save_parsed_record("/new-1.0.dist-info/RECORD", ["/new"], pyproject_record)
+    save_parsed_record("/both-1.0.dist-info/RECORD", ["/both"], pyproject_record)
+    assert len(pyproject_record.read_text().splitlines()) == 3
+    for name, files in ("old", ["/old"]), ("new", ["/new"]), ("both", ["/both"]):
+        assert load_parsed_record(pyproject_record, name) == {
+            BuildrootPath(f"/{name}-1.0.dist-info/RECORD"): files
+        }
+
+
+def append_records(pyproject_record, start):
+    for i in range(start, start + 50):
+        save_parsed_record(f"/pkg{i}-1.0.dist-info/RECORD", [f"/pkg{i}/file{j}" for j in range(500)],
+                           pyproject_record)
+
+
+def test_parsed_record_concurrent_appends(pyproject_record):
+    with multiprocessing.Pool(4) as pool:
+        pool.starmap(append_records, [(pyproject_record, start) for start in range(0, 200, 50)])
+    records = dict(read_parsed_records(pyproject_record))
+    assert len(records) == 200
+    assert all(len(files) == 500 for files in records.values())
+
+
 def test_cli_bad_argument(tldr_root, output_files, output_modules, pyproject_record):
     cli_args = argparser().parse_args(
         [*default_options(output_files, output_modules, tldr_root, pyproject_record), "tldr*", "+foodir"]
@@ -340,3 +371,85 @@ def test_cli_single_record_named_output(tldr_root, pyproject_record):
     assert named_files.exists()
     assert named_modules.exists()
     assert output_files.read_text() == named_files.read_text()
+
+
+def test_cli_batch(tmp_path, pyproject_record):
+    for package in "tldr", "requests", "kerberos":
+        prepare_pyproject_record(tmp_path, package=package)
+    batch = {"tldr": "-D tldr tldr*", "requests": "--dist-name Requests -l requests +auto", "kerberos": "-D kerberos -a -M"}
+    for name, arguments in batch.items():
+        # like %{pyproject_files -D name} in separate %pyproject_save_files calls
+        cli_args = argparser().parse_args([
+            *default_options(tmp_path / f"files-{name}", tmp_path / f"modules-{name}", tmp_path, pyproject_record),
+            *arguments.split(),
+        ])
+        save_files_main(cli_args)
+    separate = {path.name: path.read_text() for path in tmp_path.glob("files-*")}
+    separate.update({path.name: path.read_text() for path in tmp_path.glob("modules-*")})
+
+    cli_args = argparser().parse_args([
+        *default_options(tmp_path / "batch-files", tmp_path / "batch-modules", tmp_path, pyproject_record),
+        "--batch", "--", *batch.values(),
+    ])
+    save_files_main(cli_args)
+    batched = {path.name.removeprefix("batch-"): path.read_text() for path in tmp_path.glob("batch-*")}
+    assert sorted(batched) == [
+        "files-kerberos", "files-requests", "files-tldr", "modules-kerberos", "modules-requests", "modules-tldr",
+    ]
+    assert batched == separate
+
+
+@pytest.mark.parametrize("jobs", ["1", "3"])
+def test_cli_batch_jobs(tmp_path, pyproject_record, jobs):
+    expected = {package: (glob, files, modules) for package, glob, files, modules in EXPECTED_FILES
+                if package in ("tldr", "requests", "kerberos", "django")}
+    for package in expected:
+        prepare_pyproject_record(tmp_path, package=package)
+    cli_args = argparser().parse_args([
+        *default_options(tmp_path / "files", tmp_path / "modules", tmp_path, pyproject_record),
+        "--jobs", jobs, "--batch", "--",
+        *(f"-D {package} {glob} +auto" for package, (glob, _, _) in expected.items()),
+    ])
+    save_files_main(cli_args)
+    for package, (_, expected_files, expected_modules) in expected.items():
+        assert (tmp_path / f"files-{package}").read_text() == "\n".join(expected_files) + "\n"
+        assert (tmp_path / f"modules-{package}").read_text().split() == expected_modules
+
+
+def test_cli_batch_requires_dist_name(tldr_root, pyproject_record):
+    cli_args = argparser().parse_args([
+        *default_options(tldr_root / "files", tldr_root / "modules", tldr_root, pyproject_record),
+        "--batch", "--", "-l tldr*",
+    ])
+    with pytest.raises(ValueError, match="requires -D <name>"):
+        save_files_main(cli_args)
+
+
+@pytest.mark.parametrize("escape_paths, escape_path", [
+    (escape_rpm_paths_4_19, escape_rpm_path_4_19),
+    (escape_rpm_paths_4_18, escape_rpm_path_4_18),
+])
+def test_escape_rpm_paths_batch(escape_paths, escape_path):
+    names = ["plain", "spa ces", "100%", "tab\tbed", "br[ack]ets", "glob*?!", "back\\slash", "{brace}"]
+    paths = []
+    for directory in "/usr/share", "/usr/share/spa ces", "/usr/share/100%", "/usr/share/{brace}":
+        for name in names:
+            path = BuildrootPath(f"{directory}/{name}.py")
+            paths.append(path)
+            pyc = BuildrootPath(f"{directory}/__pycache__/{name}.cpython-314{{,.opt-?}}.pyc")
+            pyc.glob_suffix_len = len("{,.opt-?}.pyc")
+            paths.append(pyc)
+            paths.append(f"{directory}/{name}")
+
+    def escape_or_error(escape, paths):
+        try:
+            return list(escape(paths))
+        except NotImplementedError:
+            return None
+
+    escaped_dirs = {}
+    for path in paths:
+        assert escape_or_error(escape_paths, [path]) == escape_or_error(lambda ps: map(escape_path, ps), [path])
+        # sharing the escaped directories gives the same results
+        assert (escape_or_error(lambda ps: escape_paths(ps, escaped_dirs), [path]) ==
+                escape_or_error(escape_paths, [path]))
@@ -0,0 +1,224 @@
+"""Compare the outputs of pyproject_tox_config with the outputs of tox itself"""
+
+import importlib.metadata
+import json
+import subprocess
+import sys
+
+import packaging.version
+import pytest
+from packaging.requirements import Requirement
+
+from pyproject_tox_config import print_outputs, UnsupportedConfig
+
+try:
+    import tox
+    import tox_current_env
+except ImportError:
+    TOX_4_22 = False
+else:
+    TOX_4_22 = packaging.version.parse(tox.__version__) >= packaging.version.parse('4.22')
+
+OUTPUT_OPTIONS = ('--print-deps-to', '--print-extras-to', '--no-provision', '--print-dependency-groups-to')
+
+REQUIREMENTS_TXT = 'reqdep\n'
+
+CONFIGS = {
+    'tox.ini with defaults': ({
+        'tox.ini': (
+            '[tox]\n'
+            'env_list = py3, lint\n'
+            '[testenv]\n'
+            'deps =\n'
+            '    pytest >= 7  # the comment is stripped\n'
+            '    -r{toxinidir}/requirements.txt\n'
+            'extras = Toml, cli\n'
+            '[testenv:lint]\n'
+            'deps = flake8\n'
+            'extras =\n'
+        ),
+    }, [['py3'], ['lint'], ['py312'], ['py3', 'lint']]),
+    'tox.ini with factors': ({
+        'tox.ini': (
+            '[tox]\n'
+            'envlist = py3-django, py3-flask\n'
+            '[testenv]\n'
+            'deps =\n'
+            '# a comment line\n'
+            '    common\n'
+            '    django: django >= 4\n'
+            '    !django: notdjango\n'
+            '    py3-flask: flask\n'
+            '    py312,flask: either\n'
+            f'    {sys.platform}: platformdep\n'
+            '    win32: windep\n'
+            '    other\n'
+            'dependency_groups =\n'
+            '    django: Django_Tests\n'
+            '[testenv:filtered]\n'
+            'deps =\n'
+            '    py311: filtered\n'
+        ),
+        'pyproject.toml': '[dependency-groups]\ndjango-tests = []\n',
+    }, [['py3-django'], ['py3-flask'], ['py312'], ['filtered']]),
+    'tox.ini with references': ({
+        'tox.ini': (
+            '[tox]\n'
+            'envlist = flask\n'
+            '[base]\n'
+            'deps =\n'
+            '    basedep\n'
+            '    flask: baseflask\n'
+            '[testenv]\n'
+            'deps =\n'
+            '    {[base]deps}\n'
+            '    testenvdep\n'
+            '[testenv:docs]\n'
+            'deps =\n'
+            '    {[testenv]deps}\n'
+            '    sphinx\n'
+        ),
+    }, [['py3'], ['docs'], ['flask']]),
+    'tox.ini with requires': ({
+        'tox.ini': (
+            '[tox]\n'
+            'requires =\n'
+            '    packaging\n'
+            '    pytest; python_version < "3"\n'
+            'minversion = 4.0\n'
+            '[testenv]\n'
+            'deps = foo\n'
+        ),
+    }, [['py3']]),
+    'tox.ini with provisioning': ({
+        'tox.ini': (
+            '[tox]\n'
+            'requires = this-is-not-installed >= 1\n'
+            'min_version = 4.1\n'
+            '[testenv]\n'
+            'deps = foo\n'
+        ),
+    }, [['py3']]),
+    'legacy_tox_ini': ({
+        'pyproject.toml': (
+            '[tool.tox]\n'
+            'legacy_tox_ini = """\n'
+            '[testenv]\n'
+            'deps = legacy\n'
+            '    py3: legacy-py3\n'
+            'extras = test\n'
+            '"""\n'
+        ),
+    }, [['py3']]),
+    'tool.tox': ({
+        'pyproject.toml': (
+            '[tool.tox]\n'
+            'requires = ["tox>=4.22"]\n'
+            'env_list = ["py3", "docs"]\n'
+            '[tool.tox.env_run_base]\n'
+            'deps = ["pytest", "-r {tox_root}/requirements.txt"]\n'
+            'extras = ["Test_Extra"]\n'
+            'dependency_groups = ["tests"]\n'
+            '[tool.tox.env.docs]\n'
+            'deps = ["sphinx"]\n'
+            '[dependency-groups]\n'
+            'tests = []\n'
+        ),
+    }, [['py3'], ['docs'], ['py3', 'docs']]),
+    'tox.toml': ({
+        'tox.toml': (
+            'min_version = "4.22"\n'
+            '[env_run_base]\n'
+            'deps = ["toxtoml >= 1"]\n'
+            'dependency_groups = ["tests", "typing"]\n'
+            '[env.lint]\n'
+            'deps = ["ruff"]\n'
+            'extras = ["lint"]\n'
+        ),
+        'pyproject.toml': '[dependency-groups]\ntests = []\ntyping = []\n',
+    }, [['py3'], ['lint']]),
+}
+
+
+def is_installed(requirement_str):
+    requirement = Requirement(requirement_str)
+    requirement.specifier.prereleases = True
+    try:
+        return importlib.metadata.version(requirement.name) in requirement.specifier
+    except importlib.metadata.PackageNotFoundError:
+        return False
+
+
+def tox_outputs(project, toxenv):
+    outputs = project.parent / 'outputs'
+    outputs.mkdir(exist_ok=True)
+    command = [sys.executable, '-m', 'tox']
+    for option in OUTPUT_OPTIONS:
+        path = outputs / option.strip('-')
+        path.write_text('')
+        command.extend((option, path))
+    command.extend(('--assert-config', '-q', '-r', '-e', ','.join(toxenv)))
+    proc = subprocess.run(command, cwd=project, capture_output=True, text=True)
+    return proc.returncode, {option: (outputs / option.strip('-')).read_text() for option in OUTPUT_OPTIONS}
+
+
+def normalized(outputs):
+    """Make the outputs comparable, tox prints the extras and the groups in no particular order"""
+    result = {}
+    for option, content in outputs.items():
+        if option == '--no-provision':
+            result[option] = json.loads(content) if content else None
+        elif option == '--print-deps-to':
+            result[option] = [line.strip() for line in content.splitlines() if line.strip()]
+        else:
+            result[option] = sorted(line for line in content.splitlines() if line)
+    return result
+
+
+@pytest.mark.skipif(not TOX_4_22, reason='tox 4.22+ and tox-current-env are needed for the comparison')
+@pytest.mark.parametrize('config', CONFIGS)
+def test_outputs_match_tox(config, tmp_path, monkeypatch):
+    files, toxenvs = CONFIGS[config]
+    project = tmp_path / 'project'
+    project.mkdir()
+    for name, content in files.items():
+        project.joinpath(name).write_text(content)
+    project.joinpath('requirements.txt').write_text(REQUIREMENTS_TXT)
+    monkeypatch.chdir(project)
+    for toxenv in toxenvs:
+        returncode, outputs = print_outputs(toxenv, OUTPUT_OPTIONS, is_installed=is_installed)
+        tox_returncode, expected = tox_outputs(project, toxenv)
+        assert (returncode == 0) == (tox_returncode == 0), toxenv
+        assert normalized(outputs) == normalized(expected), toxenv
+
+
+@pytest.mark.parametrize('files', [
+    {},
+    {'setup.cfg': '[tox:tox]\n[testenv]\ndeps = foo\n'},
+    {'tox.ini': '[testenv]\ndeps = {env:DEPS}\n'},
+    {'tox.ini': '[testenv]\ndeps = {posargs}\n'},
+    {'tox.ini': '[testenv]\ndeps = {[nonexisting]deps}\n'},
+    {'tox.ini': '[testenv]\ndeps = foo \\\n  >= 1\n'},
+    {'tox.ini': '[testenv]\ndeps = --index-url https://example.com foo\n'},
+    {'tox.ini': '[testenv]\ndeps = py3{11,12}: foo\n'},
+    {'tox.ini': '[testenv]\ndeps = x86_64: foo\n'},
+    {'tox.ini': '[testenv:py3{11,12}]\ndeps = foo\n'},
+    {'tox.ini': '[testenv:py3]\nbase = other\n'},
+    {'tox.toml': '[env_run_base]\ndeps = [{ replace = "ref", of = ["other"] }]\n'},
+    {'tox.toml': '[env_base.test]\nfactors = [["a", "b"]]\n'},
+    {'pyproject.toml': '[tool.tox.env_run_base]\ndeps = ["{env_name}"]\n'},
+    {'tox.ini': '[testenv]\ndependency_groups = undefined\n'},
+], ids=lambda files: ' '.join(f'{name}: {content!r}' for name, content in files.items()) or 'no config')
+def test_unsupported(files, tmp_path, monkeypatch):
+    for name, content in files.items():
+        tmp_path.joinpath(name).write_text(content)
+    monkeypatch.chdir(tmp_path)
+    with pytest.raises(UnsupportedConfig):
+        print_outputs(['py3'], OUTPUT_OPTIONS, is_installed=is_installed)
+
+
+def test_undefined_environment(tmp_path, monkeypatch):
+    tmp_path.joinpath('tox.ini').write_text('[tox]\nenv_list = a\n[testenv]\ndeps = foo\n')
+    monkeypatch.chdir(tmp_path)
+    with pytest.raises(UnsupportedConfig, match='not defined'):
+        print_outputs(['b'], OUTPUT_OPTIONS, is_installed=is_installed)
@@ -0,0 +1,172 @@
+import json
+import shutil
+import subprocess
+import sys
+from pathlib import Path
+
+import pytest
+
+
+SCRIPTS = Path(__file__).parent
+
+BACKEND = '''\
+import json, os
+
+def log(**kwargs):
+    with open(os.environ['BACKEND_LOG'], 'a') as f:
+        print(json.dumps(kwargs), file=f)
+
+def prepare_metadata_for_build_wheel(metadata_directory, config_settings=None):
+    log(hook='prepare_metadata_for_build_wheel')
+    os.makedirs(os.path.join(metadata_directory, 'pkg-1.dist-info'))
+    with open(os.path.join(metadata_directory, 'pkg-1.dist-info', 'METADATA'), 'w') as f:
+        f.write('Metadata-Version: 2.1\\nName: pkg\\nVersion: 1\\n')
+    return 'pkg-1.dist-info'
+
+def build_wheel(wheel_directory, config_settings=None, metadata_directory=None):
+    log(hook='build_wheel', config_settings=config_settings, metadata_directory=metadata_directory)
+    open(os.path.join(wheel_directory, 'pkg-1-py3-none-any.whl'), 'w').close()
+    return 'pkg-1-py3-none-any.whl'
+'''
+
+
+@pytest.fixture
+def project(tmp_path, monkeypatch):
+    project = tmp_path / 'project'
+    project.mkdir()
+    project.joinpath('pyproject.toml').write_text(
+        '[build-system]\n'
+        'requires = []\n'
+        'build-backend = "wheel_test_backend"\n'
+        'backend-path = ["backend"]\n'
+    )
+    project.joinpath('backend').mkdir()
+    project.joinpath('backend', 'wheel_test_backend.py').write_text(BACKEND)
+    monkeypatch.setenv('BACKEND_LOG', str(tmp_path / 'backend.log'))
+    return project
+
+
+def run(project, script, *args):
+    return subprocess.run(
+        [sys.executable, '-Bs', SCRIPTS / script, *map(str, args)],
+        cwd=project, check=True, capture_output=True, text=True,
+    )
+
+
+def backend_calls(project):
+    lines = project.parent.joinpath('backend.log').read_text().splitlines()
+    return [json.loads(line) for line in lines]
+
+
+def buildrequires(project, *args):
+    state = project.parent / 'state.json'
+    run(project, 'pyproject_buildrequires.py', '--output', project.parent / 'buildrequires.txt',
+        '--state-file', state, *args)
+    return state
+
+
+def prepared_dist_info(state):
+    return Path(json.loads(state.read_text())['metadata'][str(state.parent / 'project')]['dist_info'])
+
+
+def remove_dist_info(project):
+    # like the %pyproject_buildrequires macro does after each pass
+    for path in project.glob('*.dist-info'):
+        shutil.rmtree(path)
+
+
+def wheel(project, *args):
+    return run(project, 'pyproject_wheel.py', '--frontend', 'pep517', *args, project.parent / 'wheeldir')
+
+
+def test_prepared_metadata_is_passed_to_build_wheel(project):
+    state = buildrequires(project)
+    remove_dist_info(project)
+    proc = wheel(project, '--buildrequires-state', state)
+    assert 'Reusing the metadata prepared by %pyproject_buildrequires' in proc.stderr
+    assert project.parent.joinpath('wheeldir', 'pkg-1-py3-none-any.whl').exists()
+    dist_info = prepared_dist_info(state)
+    assert dist_info.name == 'pkg-1.dist-info'
+    assert project not in dist_info.parents
+    assert backend_calls(project) == [
+        {'hook': 'prepare_metadata_for_build_wheel'},
+        {'hook': 'build_wheel', 'config_settings': None,
+         'metadata_directory': str(dist_info)},
+    ]
+
+
+def test_metadata_reused_by_buildrequires_is_passed_to_build_wheel(project):
+    state = buildrequires(project)
+    remove_dist_info(project)
+    # the next pass reuses the metadata and the hook is not called again
+    buildrequires(project)
+    remove_dist_info(project)
+    proc = wheel(project, '--buildrequires-state', state)
+    assert 'Reusing the metadata prepared by %pyproject_buildrequires' in proc.stderr
+    assert [call['hook'] for call in backend_calls(project)] == ['prepare_metadata_for_build_wheel', 'build_wheel']
+    assert backend_calls(project)[-1]['metadata_directory'] == str(prepared_dist_info(state))
+
+
+@pytest.mark.parametrize('change', ['config_settings', 'project', 'metadata'])
+def test_outdated_metadata_is_not_passed(project, change):
+    state = buildrequires(project)
+    remove_dist_info(project)
+    args = ['--buildrequires-state', state]
+    if change == 'config_settings':
+        args.extend(('-C', 'key=value'))
+    elif change == 'project':
+        project.joinpath('setup.cfg').write_text('')
+    else:
+        prepared_dist_info(state).joinpath('METADATA').write_text('')
+    proc = wheel(project, *args)
+    assert 'Reusing the metadata' not in proc.stderr
+    build_wheel = backend_calls(project)[-1]
+    assert build_wheel['metadata_directory'] is None
+    if change == 'config_settings':
+        assert build_wheel['config_settings'] == {'key': 'value'}
+
+
+def test_backend_path_outside_of_the_source_tree(project):
+    project.joinpath('pyproject.toml').write_text(
+        '[build-system]\n'
+        'build-backend = "wheel_test_backend"\n'
+        'backend-path = ["../backend"]\n'
+    )
+    project.parent.joinpath('backend').mkdir()
+    project.parent.joinpath('backend', 'wheel_test_backend.py').write_text(BACKEND)
+    with pytest.raises(subprocess.CalledProcessError) as excinfo:
+        wheel(project)
+    assert 'is outside of the source tree' in excinfo.value.stderr
+
+
+def test_backend_not_loaded_from_backend_path(project):
+    project.joinpath('pyproject.toml').write_text(
+        '[build-system]\n'
+        'build-backend = "json"\n'
+        'backend-path = ["backend"]\n'
+    )
+    with pytest.raises(subprocess.CalledProcessError) as excinfo:
+        wheel(project)
+    assert 'was not loaded from backend-path' in excinfo.value.stderr
+
+
+def test_wheel_is_identical_to_pip(tmp_path, monkeypatch):
+    pytest.importorskip('setuptools')
+    monkeypatch.setenv('SOURCE_DATE_EPOCH', '1700000000')
+    wheels = {}
+    for frontend in 'pip', 'pep517':
+        project = tmp_path / frontend
+        project.joinpath('pkg').mkdir(parents=True)
+        project.joinpath('pkg', '__init__.py').write_text('VERSION = 1\n')
+        project.joinpath('pyproject.toml').write_text(
+            '[build-system]\n'
+            'requires = ["setuptools"]\n'
+            'build-backend = "setuptools.build_meta"\n'
+            '[project]\n'
+            'name = "pkg"\n'
+            'version = "1"\n'
+        )
+        run(project, 'pyproject_wheel.py', '--frontend', frontend, tmp_path / f'{frontend}-wheeldir')
+        [wheel] = tmp_path.joinpath(f'{frontend}-wheeldir').iterdir()
+        wheels[frontend] = wheel.name, wheel.read_bytes()
+    assert wheels['pep517'] == wheels['pip']